@@ -0,0 +1,337 @@
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import requests
+from feature_preparation import BEDROOM_CHOICES, PROPERTY_TYPE_CHOICES, FURNISHING_CHOICES
+from keyword_features import KEYWORDS
+from maps_stub_server import start_stub_server
+
+# Filler sentences for the synthetic agent descriptions
+DESCRIPTION_SENTENCES = ["Walking distance to MRT and shopping malls.", "Well maintained condo facilities.",
+                         "Near good schools and hawker centres.", "Bright and airy unit with a practical layout.",
+                         "Call now to arrange a viewing.", "Owner is motivated and flexible on move-in date."]
+
+# Error message for a form choice the model does not support (e.g. an unknown category), which is an expected
+# rejection of the synthetic corpus rather than an error of the app
+REJECTION_MESSAGE = "is not supported by the model"
+
+# Whether a lower or a higher value of a benchmark result is better (results that are not listed are reported only)
+LOWER_IS_BETTER = ["p50_ms", "p90_ms", "p99_ms"]
+HIGHER_IS_BETTER = ["requests_per_second", "listings_per_second"]
+
+
+# Create function to generate a synthetic corpus of listings
+# Listing i uses the i-th choice of each form field (cyclically), so the first 11 listings cover every choice of every
+# field and the first 396 listings cover every combination of bedrooms, property type and furnishing
+# Each listing has a unique address, so its location-based features are not cached
+def generate_corpus(n_listings, seed=0):
+    rng = random.Random(seed)
+    phrases = [phrase for feature_phrases in KEYWORDS.values() for phrase in feature_phrases]
+    furnishing_choices = [""] + FURNISHING_CHOICES
+    corpus = []
+    for index in range(n_listings):
+        sentences = rng.sample(DESCRIPTION_SENTENCES, rng.randint(1, 3))
+        sentences += [f"{phrase.capitalize()}." for phrase in rng.sample(phrases, rng.randint(0, 3))]
+        rng.shuffle(sentences)
+        corpus.append({
+            "size": rng.randint(100, 6000),
+            "bedrooms": BEDROOM_CHOICES[index % len(BEDROOM_CHOICES)],
+            # Optional fields are left empty for some listings, so imputation is benchmarked as well
+            "bathrooms": rng.randint(1, 6) if rng.random() < 0.8 else None,
+            "address": f"{index + 1} Benchmark Road {seed}",
+            "property_type": PROPERTY_TYPE_CHOICES[index % len(PROPERTY_TYPE_CHOICES)],
+            "furnishing": furnishing_choices[index % len(furnishing_choices)],
+            "year": rng.randint(1970, 2024) if rng.random() < 0.7 else None,
+            "meters_to_mrt": rng.randint(50, 3000) if rng.random() < 0.7 else None,
+            "agent_description": " ".join(sentences)
+        })
+    return corpus
+
+
+# Create a class that hands out the listings of the corpus to concurrent clients, each listing once (and cycles
+# through the corpus again, with cached locations, if a benchmark needs more listings than the corpus has)
+class CorpusFeeder:
+    def __init__(self, corpus, start=0):
+        self.corpus = corpus
+        self.position = start
+        self.lock = threading.Lock()
+
+    def next(self, n=1):
+        with self.lock:
+            positions = range(self.position, self.position + n)
+            self.position += n
+        return [self.corpus[position % len(self.corpus)] for position in positions]
+
+
+# Create function to convert a listing to form data (empty fields are sent as empty strings, like the browser does)
+def form_data(listing, csrf_token):
+    return {**{field: "" if value is None else str(value) for field, value in listing.items()},
+            "csrf_token": csrf_token}
+
+
+# Create a class for a client of the web form (keeps the session cookie and CSRF token of its first page view)
+class FormClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+        page = self.session.get(f"{base_url}/", timeout=10).text
+        self.csrf_token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+
+    def post(self, listing):
+        # Returns the latency in seconds and the outcome: "ok" if an estimated rental price was rendered, "rejected" if
+        # the model does not support a choice of the listing, otherwise "error"
+        start_time = time.perf_counter()
+        response = self.session.post(f"{self.base_url}/", data=form_data(listing, self.csrf_token), timeout=60)
+        latency = time.perf_counter() - start_time
+        if response.status_code == 200 and "Result:" in response.text:
+            return latency, "ok"
+        if response.status_code == 200 and REJECTION_MESSAGE in response.text:
+            return latency, "rejected"
+        return latency, "error"
+
+
+# Create function to post listings in batches to the API
+# Returns the latency, the number of predicted listings and the number of listings rejected by the model
+def post_batch(session, base_url, listings):
+    start_time = time.perf_counter()
+    response = session.post(f"{base_url}/api/predict", json=listings, timeout=120)
+    latency = time.perf_counter() - start_time
+    if response.status_code != 200:
+        return latency, 0, 0
+    predictions = response.json()["predictions"]
+    return (latency, sum(entry["error"] is None for entry in predictions),
+            sum(REJECTION_MESSAGE in (entry["error"] or "") for entry in predictions))
+
+
+# Create function to summarize latencies in milliseconds
+# Only successful requests are summarized, since rejections (a form choice the model does not support) and error
+# responses are much faster than predictions and would skew the percentiles; they are reported as the expected
+# rejection rate and the error rate instead
+def latency_percentiles(latencies):
+    if not latencies:
+        return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    p50, p90, p99 = np.percentile(np.array(latencies) * 1000, [50, 90, 99])
+    return {"p50_ms": round(p50, 2), "p90_ms": round(p90, 2), "p99_ms": round(p99, 2),
+            "max_ms": round(max(latencies) * 1000, 2)}
+
+
+# Create function to calculate the share of expected rejections and errors among request outcomes
+# Rejections depend only on the corpus, so errors of the app (e.g. failed or timed out requests) are not hidden by them
+def outcome_rates(outcomes):
+    n_outcomes = max(len(outcomes), 1)
+    return {"expected_rejection_rate": round(outcomes.count("rejected") / n_outcomes, 4),
+            "error_rate": round(outcomes.count("error") / n_outcomes, 4)}
+
+
+# Create function to run concurrent clients for a fixed duration
+# run_once(state) sends one request and returns its measurement (e.g. the latency and outcome)
+def run_clients(n_clients, duration, make_state, run_once):
+    results = [[] for _ in range(n_clients)]
+    stop_time = time.monotonic() + duration
+
+    def client(index):
+        state = make_state()
+        while time.monotonic() < stop_time:
+            results[index].append(run_once(state))
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(n_clients)]
+    start_time = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start_time
+    return [result for client_results in results for result in client_results], elapsed
+
+
+# Create function to read the metrics of the app (sample name and labels mapped to the value)
+def read_metrics(base_url):
+    samples = {}
+    for line in requests.get(f"{base_url}/metrics", timeout=10).text.splitlines():
+        match = re.match(r"^(\w+)(?:\{(.*)\})? (\S+)$", line)
+        if match:
+            labels = tuple(re.findall(r'(\w+)="([^"]*)"', match.group(2) or ""))
+            samples[(match.group(1), labels)] = float(match.group(3))
+    return samples
+
+
+# Create function to break down the time of a benchmark by stage, based on the metrics before and after it
+# (mean milliseconds per call and calls per request), and to count the Google Maps API calls and spend per request
+def stage_breakdown(before, after, n_requests):
+    difference = {key: value - before.get(key, 0) for key, value in after.items()}
+    stages = {}
+    for (name, labels), value in difference.items():
+        if name == "stage_duration_seconds_count" and value > 0:
+            total_seconds = difference[("stage_duration_seconds_sum", labels)]
+            stages[dict(labels)["stage"]] = {"mean_ms": round(1000 * total_seconds / value, 2),
+                                             "calls_per_request": round(value / max(n_requests, 1), 2)}
+    maps_calls = sum(value for (name, labels), value in difference.items()
+                     if name == "google_maps_api_requests_total")
+    maps_spend = sum(value for (name, labels), value in difference.items()
+                     if name == "google_maps_api_spend_dollars_total")
+    return {"stages": dict(sorted(stages.items())),
+            "maps_calls_per_request": round(maps_calls / max(n_requests, 1), 2),
+            "maps_spend_per_request": round(maps_spend / max(n_requests, 1), 4)}
+
+
+# Create function to start the preforking server with the stub as Google Maps API and wait until it accepts requests
+def start_app_server(workers, port, maps_base_url, directory):
+    environment = dict(os.environ, google_maps_base_url=maps_base_url,
+                       location_cache_path=os.path.join(directory, "location_cache.sqlite"),
+                       metrics_dir=os.path.join(directory, "metrics"), log_level="WARNING")
+    environment.setdefault("SECRET_KEY", "benchmark")
+    process = subprocess.Popen([sys.executable, "serve.py", "--workers", str(workers), "--port", str(port),
+                                "--host", "127.0.0.1"], env=environment, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not start within 60 seconds")
+
+
+# Create function to find a free port
+def free_port():
+    with socket.socket() as listening_socket:
+        listening_socket.bind(("127.0.0.1", 0))
+        return listening_socket.getsockname()[1]
+
+
+# Create function to run all benchmarks against a running app and return the results
+def run_benchmarks(base_url, corpus, n_single, clients, duration, batch_size, batch_clients):
+    feeder = CorpusFeeder(corpus)
+    results = {}
+
+    # Warm up the workers (connection pools, model) with a few requests that are not measured
+    form_client = FormClient(base_url)
+    for listing in feeder.next(5):
+        form_client.post(listing)
+
+    # Latency of single form requests one after another (no contention)
+    before = read_metrics(base_url)
+    measurements = [form_client.post(listing) for listing in feeder.next(n_single)]
+    results["single_request"] = {**latency_percentiles([latency for latency, outcome in measurements
+                                                        if outcome == "ok"]),
+                                 **outcome_rates([outcome for latency, outcome in measurements]),
+                                 **stage_breakdown(before, read_metrics(base_url), n_single)}
+
+    # Sustained form throughput of concurrent clients
+    before = read_metrics(base_url)
+    measurements, elapsed = run_clients(clients, duration, lambda: FormClient(base_url),
+                                        lambda client: client.post(feeder.next()[0]))
+    n_ok = sum(outcome == "ok" for latency, outcome in measurements)
+    results["form_throughput"] = {"requests_per_second": round(n_ok / elapsed, 2),
+                                  **latency_percentiles([latency for latency, outcome in measurements
+                                                         if outcome == "ok"]),
+                                  **outcome_rates([outcome for latency, outcome in measurements]),
+                                  **stage_breakdown(before, read_metrics(base_url), len(measurements))}
+
+    # Sustained batch throughput of concurrent API clients
+    before = read_metrics(base_url)
+    measurements, elapsed = run_clients(batch_clients, duration, requests.Session,
+                                        lambda session: post_batch(session, base_url, feeder.next(batch_size)))
+    n_predicted = sum(n for latency, n, n_rejected in measurements)
+    n_rejected = sum(n_rejected for latency, n, n_rejected in measurements)
+    n_listings = max(len(measurements) * batch_size, 1)
+    results["batch_throughput"] = {"listings_per_second": round(n_predicted / elapsed, 2),
+                                   **latency_percentiles([latency for latency, n, n_rejected in measurements if n > 0]),
+                                   "expected_rejection_rate": round(n_rejected / n_listings, 4),
+                                   "error_rate": round(1 - (n_predicted + n_rejected) / n_listings, 4),
+                                   **stage_breakdown(before, read_metrics(base_url), len(measurements))}
+    results["listings_used"] = feeder.position
+    return results
+
+
+# Create function to compare results with a baseline and return the regressions
+# Latencies and throughputs may be worse by the relative tolerance, error rates by 1 percentage point
+def compare_results(results, baseline, tolerance):
+    regressions = []
+    for benchmark, values in baseline["results"].items():
+        if not isinstance(values, dict) or benchmark not in results["results"]:
+            continue
+        for metric, baseline_value in values.items():
+            value = results["results"][benchmark].get(metric)
+            if value is None or baseline_value is None:
+                continue
+            if metric in LOWER_IS_BETTER and value > baseline_value * (1 + tolerance):
+                regressions.append(f"{benchmark} {metric}: {value} (baseline {baseline_value})")
+            elif metric in HIGHER_IS_BETTER and value < baseline_value * (1 - tolerance):
+                regressions.append(f"{benchmark} {metric}: {value} (baseline {baseline_value})")
+            elif metric == "error_rate" and value > baseline_value + 0.01:
+                regressions.append(f"{benchmark} {metric}: {value} (baseline {baseline_value})")
+    return regressions
+
+
+# Run the end-to-end benchmarks against the preforking server with a local Google Maps stub and save the results or
+# compare them with a baseline (exits with status 1 if a result regressed)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the app end to end with a local Google Maps stub.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes of the server.")
+    parser.add_argument("--maps-latency", type=float, default=0.05, help="Mean latency of the stub in seconds.")
+    parser.add_argument("--maps-failure-rate", type=float, default=0.0, help="Share of stub responses with status 503.")
+    parser.add_argument("--corpus-size", type=int, default=5000, help="Number of synthetic listings.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--single-requests", type=int, default=50, help="Number of sequential form requests.")
+    parser.add_argument("--clients", type=int, default=8, help="Number of concurrent form clients.")
+    parser.add_argument("--duration", type=float, default=10, help="Duration of each throughput benchmark in seconds.")
+    parser.add_argument("--batch-size", type=int, default=50, help="Listings per batch API request.")
+    parser.add_argument("--batch-clients", type=int, default=2, help="Number of concurrent batch API clients.")
+    parser.add_argument("--output", default="benchmarks/results.json", help="File to save the results to.")
+    parser.add_argument("--save-baseline", action="store_true", help="Also save the results as the baseline.")
+    parser.add_argument("--baseline", default="benchmarks/baseline.json")
+    parser.add_argument("--compare", action="store_true", help="Fail if the results regressed against the baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default: 20%%).")
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ["output", "save_baseline", "baseline", "compare", "tolerance"]}
+    corpus = generate_corpus(args.corpus_size, args.seed)
+    stub = start_stub_server(latency=args.maps_latency, failure_rate=args.maps_failure_rate)
+    with tempfile.TemporaryDirectory() as directory:
+        port = free_port()
+        server = start_app_server(args.workers, port, stub.base_url, directory)
+        try:
+            results = run_benchmarks(f"http://127.0.0.1:{port}", corpus, args.single_requests, args.clients,
+                                     args.duration, args.batch_size, args.batch_clients)
+        finally:
+            server.terminate()
+            server.wait()
+    stub.shutdown()
+
+    # Record the setup the results were measured on, since they are only comparable on the same setup
+    setup = {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+    results = {"config": config, "setup": setup, "results": results}
+    print(json.dumps(results, indent=2))
+    paths = [args.output] + ([args.baseline] if args.save_baseline else [])
+    for path in paths:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Saved results to {path}")
+
+    if args.compare:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["config"] != config:
+            print(f"Warning: the baseline was measured with a different configuration: {baseline['config']}")
+        if baseline.get("setup") != setup:
+            print(f"Warning: the baseline was measured on a different setup: {baseline.get('setup')}")
+        regressions = compare_results(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
@@ -0,0 +1,33 @@
+import pickle
+import timeit
+import numpy as np
+import pandas as pd
+from feature_encoder import FeatureEncoder
+from feature_preparation import FEATURE_COLUMNS
+from keyword_features import KEYWORDS
+
+# Micro-benchmark for encoding a single row (DataFrame + column transformer vs. FeatureEncoder)
+# Run from the repository root with: python -m benchmarks.feature_encoding
+if __name__ == "__main__":
+    # Load column transformer from pickle file
+    with open("models/column_transformer.pkl", "rb") as file:
+        column_transformer = pickle.load(file)
+    encoder = FeatureEncoder.from_column_transformer(column_transformer)
+
+    # Create a row with the first known category of each categorical feature
+    values = {"size": 1000, "bedrooms": encoder.categories["bedrooms"][0], "bathrooms": 2, "latitude": 1.3,
+              "longitude": 103.8, "meters_to_cbd": 8000, "meters_to_school": 500, "restaurants_rating": 4.1,
+              "property_type": encoder.categories["property_type"][0],
+              "furnishing": encoder.categories["furnishing"][0], "year": 2010, "meters_to_mrt": 400,
+              **{feature: False for feature in KEYWORDS}}
+    row = tuple(values[column] for column in FEATURE_COLUMNS)
+
+    n_runs = 1000
+    dataframe_seconds = timeit.timeit(
+        lambda: column_transformer.transform(pd.DataFrame([row], columns=FEATURE_COLUMNS)), number=n_runs)
+    encoder_seconds = timeit.timeit(lambda: encoder.transform_row(row), number=n_runs)
+    np.testing.assert_allclose(encoder.transform_row(row),
+                               column_transformer.transform(pd.DataFrame([row], columns=FEATURE_COLUMNS)))
+    print(f"DataFrame + column transformer: {1e6 * dataframe_seconds / n_runs:.1f} µs per row")
+    print(f"FeatureEncoder: {1e6 * encoder_seconds / n_runs:.1f} µs per row")
+    print(f"Speedup: {dataframe_seconds / encoder_seconds:.0f}x")
@@ -0,0 +1,30 @@
+import pickle
+import timeit
+import numpy as np
+from inference_engine import InferenceEngine
+
+# Micro-benchmark for the latency of the prediction paths for different batch sizes (scikit-learn wrapper, native
+# booster and, for single rows, the tree evaluator)
+# Run from the repository root with: python -m benchmarks.inference
+if __name__ == "__main__":
+    # Load XGBoost model from pickle file
+    with open("models/xgboost.pkl", "rb") as file:
+        model = pickle.load(file)
+    engine = InferenceEngine.from_booster(model.get_booster(), use_tree_evaluator=True)
+    engine.load_boosters()
+
+    # Create random encoded features with some missing values
+    rng = np.random.default_rng(42)
+    features = rng.normal(size=(10000, model.get_booster().num_features()))
+    features[rng.random(features.shape) < 0.02] = np.nan
+
+    print(f"{'Batch size':>10} {'XGBRegressor':>14} {'Booster':>14} {'Tree evaluator':>16}")
+    for batch_size, n_runs in [(1, 1000), (100, 200), (10000, 10)]:
+        batch = features[:batch_size]
+        wrapper_seconds = timeit.timeit(lambda: model.predict(batch), number=n_runs) / n_runs
+        booster = engine.batch_booster if batch_size >= engine.batch_threshold else engine.single_thread_booster
+        booster_seconds = timeit.timeit(
+            lambda: booster.inplace_predict(np.ascontiguousarray(batch, dtype=np.float32)), number=n_runs) / n_runs
+        evaluator = (f"{1e3 * timeit.timeit(lambda: engine.predict(batch), number=n_runs) / n_runs:13.3f} ms"
+                     if batch_size == 1 else f"{'-':>16}")
+        print(f"{batch_size:>10} {1e3 * wrapper_seconds:11.3f} ms {1e3 * booster_seconds:11.3f} ms {evaluator}")
@@ -0,0 +1,27 @@
+import timeit
+import numpy as np
+from keyword_features import KEYWORDS, compile_keywords
+
+# Micro-benchmark for the time per agent description of separate substring scans per keyword vs. a single scan with
+# the compiled matcher, for the current keywords and for ten times as many phrases (keyword_features.py picks the
+# implementation by phrase count, see SINGLE_SCAN_MIN_PHRASES)
+# Run from the repository root with: python -m benchmarks.keyword_matching
+if __name__ == "__main__":
+    # Create random descriptions from the keywords and filler words
+    rng = np.random.default_rng(42)
+    words = ["spacious", "unit", "near", "mrt", "Floor", "High", "VIEW", "new", "Brand", "renovat", "sea", "city",
+             "penthouse", "view", "quiet", "pool", "with", "amenities", "call", "now", "for", "viewing"]
+    words += [phrase for phrases in KEYWORDS.values() for phrase in phrases]
+    descriptions = [" ".join(rng.choice(words, size=rng.integers(0, 200))).lower() for _ in range(10000)]
+
+    many_keywords = {f"{feature}_{index}": [f"{phrase}{'' if index == 0 else f' {index}'}" for phrase in phrases]
+                     for feature, phrases in KEYWORDS.items() for index in range(10)}
+    for name, keywords in [("Current keywords", KEYWORDS), ("10x phrases", many_keywords)]:
+        pattern = compile_keywords(keywords)[0]
+        scans_seconds = min(timeit.repeat(lambda: [[any(keyword in description for keyword in phrases)
+                                                    for phrases in keywords.values()] for description in descriptions],
+                                          number=1, repeat=3))
+        single_seconds = min(timeit.repeat(lambda: [pattern.findall(description) for description in descriptions],
+                                           number=1, repeat=3))
+        print(f"{name:>16}: separate scans {1e6 * scans_seconds / len(descriptions):7.2f} µs, "
+              f"single scan {1e6 * single_seconds / len(descriptions):7.2f} µs per description")
@@ -0,0 +1,114 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import requests
+import location_features
+from http_utils import HostRateLimiter
+from location_features import MAPS_API_COSTS, maps_get
+from poi_index import EARTH_RADIUS_METERS, SNAPSHOT_COLUMNS, save_snapshot
+from request_context import configure_logging
+
+# Bounding box of Singapore (south, west, north, east in degrees)
+SINGAPORE_BOUNDS = (1.2, 103.6, 1.48, 104.1)
+
+# Places Nearby Search returns up to 20 results per page and up to 3 pages per search
+MAX_PAGES = 3
+
+# Seconds to wait before requesting the next page (the page token is only valid after a short delay)
+PAGE_TOKEN_DELAY = 2.0
+
+
+# Create function to generate a grid of search centers over a bounding box, spaced spacing meters apart
+def search_grid(bounds, spacing):
+    south, west, north, east = bounds
+    latitude_step = np.degrees(spacing / EARTH_RADIUS_METERS)
+    longitude_step = latitude_step / np.cos(np.radians((south + north) / 2))
+    latitudes = np.arange(south, north + latitude_step / 2, latitude_step)
+    longitudes = np.arange(west, east + longitude_step / 2, longitude_step)
+    return [(round(latitude, 6), round(longitude, 6)) for latitude in latitudes for longitude in longitudes]
+
+
+# Create function to collect all places of a type around a search center with Places Nearby Search (all pages)
+def search_places(latitude, longitude, place_type, radius):
+    base_url = f"{location_features.google_maps_base_url}/place/nearbysearch/json"
+    params = {
+        "location": f"{latitude},{longitude}",
+        "radius": radius,
+        "type": place_type,
+        "key": location_features.google_maps_api_key
+    }
+    places = []
+    for page in range(MAX_PAGES):
+        data = maps_get(base_url, params)
+        places += data.get("results", [])
+        if not data.get("next_page_token"):
+            break
+        time.sleep(PAGE_TOKEN_DELAY)
+        params = {"pagetoken": data["next_page_token"], "key": location_features.google_maps_api_key}
+    return places
+
+
+# Create function to build a POI snapshot of schools and restaurants from Nearby Searches over a grid
+# The searches overlap (the radius covers the whole grid cell), so places found by several searches are kept once
+def build_snapshot(bounds, spacing, place_types, max_workers):
+    centers = search_grid(bounds, spacing)
+    # Radius that covers the corners of each grid cell
+    radius = int(np.ceil(spacing / np.sqrt(2)))
+    searches = [(latitude, longitude, place_type) for place_type in place_types for latitude, longitude in centers]
+    print(f"{len(searches)} searches with a radius of {radius} m (estimated cost: at least "
+          f"{len(searches) * MAPS_API_COSTS['nearbysearch']:.2f}$)")
+
+    poi = {}
+    n_failed = 0
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(search_places, latitude, longitude, place_type, radius): place_type
+                   for latitude, longitude, place_type in searches}
+        for future in as_completed(futures):
+            place_type = futures[future]
+            try:
+                places = future.result()
+            except (requests.RequestException, ValueError) as error:
+                n_failed += 1
+                print(f"Search failed: {error!r}")
+                continue
+            for place in places:
+                location = place["geometry"]["location"]
+                key = place.get("place_id") or (place.get("name"), location["lat"], location["lng"])
+                poi[place_type, key] = {"type": place_type, "name": place.get("name"), "latitude": location["lat"],
+                                        "longitude": location["lng"], "rating": place.get("rating", np.nan)}
+    if n_failed:
+        raise SystemExit(f"{n_failed} searches failed, so the snapshot would be incomplete; run the command again")
+    return pd.DataFrame(list(poi.values()), columns=SNAPSHOT_COLUMNS)
+
+
+# Build a POI snapshot for the POI index of the app (see poi_index.py and the environment variable poi_snapshot_path)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a POI snapshot of schools and restaurants in Singapore.")
+    parser.add_argument("--output", default="data/poi_snapshot.csv")
+    parser.add_argument("--spacing", type=float, default=1000.0,
+                        help="Distance between the search centers in meters (default: 1000).")
+    parser.add_argument("--types", nargs="+", default=["school", "restaurant"], help="Place types to collect.")
+    parser.add_argument("--bounds", type=float, nargs=4, default=SINGAPORE_BOUNDS,
+                        metavar=("SOUTH", "WEST", "NORTH", "EAST"), help="Bounding box to search (default: Singapore).")
+    parser.add_argument("--workers", type=int, default=16, help="Number of concurrent API calls.")
+    parser.add_argument("--rate", type=float, default=20.0, help="Maximum API requests per second.")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per API call for temporary errors.")
+    args = parser.parse_args()
+
+    # Show warnings of the API calls as plain text
+    configure_logging(level="WARNING", structured=False)
+
+    # Replace the rate limit, retries and circuit breakers of the app with the ones of a batch job
+    location_features.maps_rate_limiter = HostRateLimiter(args.rate)
+    location_features.maps_max_retries = args.retries
+    location_features.use_batch_circuit_breakers()
+
+    snapshot = build_snapshot(args.bounds, args.spacing, args.types, args.workers)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    save_snapshot(snapshot, args.output)
+    counts = snapshot["type"].value_counts()
+    print(f"Saved {len(snapshot)} POIs to {args.output}: " + ", ".join(f"{counts.get(place_type, 0)} {place_type}"
+                                                                       for place_type in args.types))
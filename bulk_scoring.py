@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from feature_preparation import LISTING_COLUMNS, LOCATION_COLUMNS, prepare_features, validate_listings
+from location_cache import normalize_address
+from model_bundle import ModelBundle, current_version, write_atomically
+from request_context import configure_logging
+
+# Model bundle of a worker process (loaded once per worker by load_worker_bundle)
+worker_bundle = None
+
+
+# Create function to load the model bundle of a version (the pickled models if no bundle has been exported)
+def load_bundle(bundles_dir, version):
+    if version is None:
+        return ModelBundle.from_pickles("models/column_transformer.pkl", "models/xgboost.pkl")
+    return ModelBundle.load(os.path.join(bundles_dir, version))
+
+
+# Create function to load the model bundle in a worker process with a single-threaded booster, so the worker
+# processes use one core each instead of oversubscribing the cores
+def load_worker_bundle(bundles_dir, version):
+    global worker_bundle
+    worker_bundle = load_bundle(bundles_dir, version)
+    worker_bundle.inference_engine.batch_threads = 1
+    worker_bundle.inference_engine.load_boosters()
+
+
+# Create function to get the column names of a csv or Parquet file without reading its rows
+def read_column_names(path):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(path).schema_arrow.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+# Create function to read a csv or Parquet file in chunks of at most chunk_size rows, starting at row start_row
+# Each chunk is indexed by the position of its rows in the file
+def read_chunks(path, chunk_size, start_row=0):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        position = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            chunk = batch.to_pandas()
+            # Skip the rows that were scored before the interruption
+            if position + len(chunk) > start_row:
+                chunk = chunk.iloc[max(0, start_row - position):]
+                chunk.index = pd.RangeIndex(max(position, start_row), position + len(batch))
+                yield chunk
+            position += len(batch)
+    else:
+        # Skip the rows that were scored before the interruption with a number of lines instead of a list of row
+        # numbers (which pandas would keep in memory), so the column names are passed explicitly
+        # Read bedrooms as strings, so "1" is not read as the integer 1
+        position = start_row
+        for chunk in pd.read_csv(path, chunksize=chunk_size, header=None, names=read_column_names(path),
+                                 skiprows=start_row + 1, dtype={"bedrooms": str}):
+            chunk.index = pd.RangeIndex(position, position + len(chunk))
+            position += len(chunk)
+            yield chunk
+
+
+# Create function to add the location-based features to a chunk via the Google Maps API (once per unique address,
+# enriching the addresses concurrently; cached locations are not fetched again)
+def enrich_chunk(chunk, executor):
+    # Import location_features only here, since precomputed location-based features need no Google Maps API client
+    from location_features import get_location_features
+
+    addresses = chunk["address"].dropna().astype(str)
+    addresses = addresses[addresses.str.strip() != ""]
+    address_keys = addresses.map(normalize_address)
+    unique_addresses = dict(zip(address_keys, addresses))
+    location_features = dict(zip(unique_addresses, executor.map(get_location_features, unique_addresses.values())))
+    chunk = chunk.copy()
+    for column in LOCATION_COLUMNS + ["degraded"]:
+        chunk[column] = address_keys.map(lambda key: location_features[key][column]).reindex(chunk.index)
+    return chunk
+
+
+# Create function to predict the rental prices of valid listings with the model bundle of the worker process
+def predict_listings(listings):
+    input_data = prepare_features(listings)
+    input_data_transformed = worker_bundle.feature_encoder.transform_rows(input_data.to_records(index=False))
+    return np.round(worker_bundle.inference_engine.predict(input_data_transformed)).astype(int)
+
+
+# Create function to score a chunk of listings in a worker process: apply the same validation, imputation and keyword
+# rules as the web application, then encode and predict all valid listings of the chunk at once
+# Returns the predictions and an error message for each listing that cannot be scored
+def score_chunk(chunk, id_columns, require_address):
+    listings = chunk.reindex(columns=LISTING_COLUMNS + LOCATION_COLUMNS)
+    listings["bedrooms"] = listings["bedrooms"].map(lambda value: value if pd.isna(value) else str(value))
+    errors = validate_listings(listings, worker_bundle.feature_encoder.categories, require_address=require_address)
+
+    predictions = pd.Series(pd.NA, index=chunk.index, dtype="Int64")
+    valid = errors.isna()
+    if valid.any():
+        try:
+            predictions[valid] = predict_listings(listings[valid])
+        except (ValueError, TypeError):
+            # A listing that passed validation but cannot be encoded must not stop the run (a resumed run would fail
+            # on the same chunk again), so score the chunk listing by listing and report the failing listings
+            for position in listings.index[valid]:
+                try:
+                    predictions[position] = predict_listings(listings.loc[[position]])[0]
+                except (ValueError, TypeError) as error:
+                    errors[position] = f"Listing cannot be scored: {error}"
+
+    result = chunk[id_columns].copy() if id_columns else pd.DataFrame(index=chunk.index)
+    result.insert(0, "row", chunk.index)
+    result["prediction"] = predictions
+    result["degraded"] = chunk["degraded"].fillna(False).astype(bool) if "degraded" in chunk else False
+    result["error"] = errors
+    return result
+
+
+# Create function to load the progress of an interrupted run (None if the run has to start from the beginning)
+def load_progress(path, settings):
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        progress = json.load(file)
+    if progress["settings"] != settings:
+        raise SystemExit(f"The progress file {path} belongs to a run with different settings "
+                         f"({progress['settings']}). Use --restart to score from the beginning.")
+    return progress
+
+
+# Create function to score a csv or Parquet file of listings chunk by chunk across a process pool and append the
+# predictions to a csv file, saving the progress after each chunk so an interrupted run resumes where it stopped
+# Returns the number of rows scored by this run
+# Chunks with listings whose location lookups failed stop the run before they are written (unless allow_degraded), so
+# the next run retries them instead of resuming after rows scored with imputed location-based features
+def score_file(input_path, output_path, chunk_size=50000, workers=None, id_columns=(), bundles_dir="models/bundles",
+               enrichment_workers=16, restart=False, breaker_failures=0, max_retries=3, allow_degraded=False):
+    workers = workers or os.cpu_count()
+    id_columns = list(id_columns)
+    input_columns = read_column_names(input_path)
+    missing_columns = [column for column in id_columns if column not in input_columns]
+    if missing_columns:
+        raise ValueError(f"Id columns not found in {input_path}: {missing_columns}")
+
+    # Pin the model version, so all chunks (including the ones scored after resuming) use the same model
+    version = current_version(bundles_dir)
+    progress_path = f"{output_path}.progress"
+    settings = {"input": os.path.abspath(input_path), "id_columns": id_columns, "model_version": version}
+    progress = None if restart else load_progress(progress_path, settings)
+    if progress is None:
+        progress = {"settings": settings, "rows": 0, "output_bytes": 0}
+    else:
+        print(f"Resuming after {progress['rows']} scored rows")
+
+    # Precomputed location-based features skip the Google Maps API entirely
+    enrich = not set(LOCATION_COLUMNS).issubset(input_columns)
+    if enrich:
+        import location_features
+
+        # Keep calling an API after consecutive failures and retry temporary errors like the enrichment pipeline
+        location_features.use_batch_circuit_breakers(breaker_failures)
+        location_features.maps_max_retries = max_retries
+    print(f"Scoring {input_path} with model {version or 'pickle'} ("
+          f"{'enriching addresses via the Google Maps API' if enrich else 'precomputed location-based features'})")
+
+    # Drop the output of a chunk that was only partially written before the interruption
+    with open(output_path, "ab"):
+        pass
+    os.truncate(output_path, progress["output_bytes"])
+
+    start_time = time.monotonic()
+    n_rows = 0
+    n_degraded = 0
+    with open(output_path, "ab") as output_file, \
+            ProcessPoolExecutor(workers, initializer=load_worker_bundle, initargs=(bundles_dir, version)) as executor, \
+            ThreadPoolExecutor(enrichment_workers) as enrichment_executor:
+
+        # Write the scored chunks in input order and save the progress after each one
+        def write_result(future):
+            nonlocal n_rows, n_degraded
+            result = future.result()
+            output_file.write(result.to_csv(index=False, header=progress["output_bytes"] == 0).encode())
+            output_file.flush()
+            os.fsync(output_file.fileno())
+            progress["rows"] += len(result)
+            progress["output_bytes"] = output_file.tell()
+            write_atomically(progress_path, json.dumps(progress).encode())
+            n_rows += len(result)
+            n_degraded += int(result["degraded"].sum())
+            print(f"Scored {progress['rows']} rows ({n_rows / (time.monotonic() - start_time):.0f} rows/s)")
+
+        # Keep at most two chunks per worker in flight, so memory stays bounded however large the input is
+        pending = deque()
+        for chunk in read_chunks(input_path, chunk_size, start_row=progress["rows"]):
+            if enrich:
+                chunk = enrich_chunk(chunk, enrichment_executor)
+                n_failed = int(chunk["degraded"].fillna(False).astype(bool).sum())
+                if n_failed and not allow_degraded:
+                    # Write the chunks scored so far, so the next run starts with this chunk (its successful lookups
+                    # are cached and not paid again)
+                    while pending:
+                        write_result(pending.popleft())
+                    raise SystemExit(f"Location lookups failed for {n_failed} listings of rows {chunk.index[0]} to "
+                                     f"{chunk.index[-1]}. Run the same command again to retry them, or pass "
+                                     f"--allow-degraded to score them with imputed location-based features.")
+            pending.append(executor.submit(score_chunk, chunk, id_columns, enrich))
+            if len(pending) >= 2 * workers:
+                write_result(pending.popleft())
+        while pending:
+            write_result(pending.popleft())
+
+    elapsed = time.monotonic() - start_time
+    print(f"Scored {n_rows} rows in {elapsed:.1f}s ({n_rows / max(elapsed, 1e-9):.0f} rows/s), "
+          f"{progress['rows']} rows in total. Predictions saved to {output_path}")
+    if n_degraded:
+        print(f"{n_degraded} rows were scored with imputed location-based features (degraded=True in the output)")
+    return n_rows
+
+
+# Score a large file of listings offline (e.g. to re-price a listing export)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a large csv or Parquet file of listings in chunks.")
+    parser.add_argument("input", help="Csv or Parquet file of listings (same fields as the web form, optionally with "
+                                      "the location-based features).")
+    parser.add_argument("output", help="Csv file for the predictions.")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Number of listings per chunk.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of scoring processes.")
+    parser.add_argument("--id-columns", nargs="+", default=[],
+                        help="Input columns to copy to the output (e.g. a listing id).")
+    parser.add_argument("--bundles-dir", default="models/bundles")
+    parser.add_argument("--enrichment-workers", type=int, default=16,
+                        help="Number of concurrent Google Maps API lookups if the input has no location-based "
+                             "features.")
+    parser.add_argument("--restart", action="store_true", help="Ignore the progress of an interrupted run.")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per Google Maps API call for temporary errors.")
+    parser.add_argument("--breaker-failures", type=int, default=0,
+                        help="Stop calling a Google Maps API for 30 seconds after this many consecutive failures "
+                             "(default: 0, never stop).")
+    parser.add_argument("--allow-degraded", action="store_true",
+                        help="Score listings whose location lookups failed with imputed location-based features "
+                             "instead of stopping the run.")
+    args = parser.parse_args()
+
+    # Show warnings of the feature functions (e.g. addresses that could not be geocoded) as plain text
+    configure_logging(level="WARNING", structured=False)
+
+    score_file(args.input, args.output, chunk_size=args.chunk_size, workers=args.workers, id_columns=args.id_columns,
+               bundles_dir=args.bundles_dir, enrichment_workers=args.enrichment_workers, restart=args.restart,
+               breaker_failures=args.breaker_failures, max_retries=args.retries, allow_degraded=args.allow_degraded)
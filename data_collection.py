@@ -1,107 +1,302 @@
-import cloudscraper
-from bs4 import BeautifulSoup
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from bs4 import BeautifulSoup, SoupStrainer
 import pandas as pd
-
-# Create a CloudScraper object
-scraper = cloudscraper.create_scraper()
+from http_utils import HostRateLimiter, get_with_retries
+from listing_store import ListingStore
 
 # URL of PropertyGuru rental property search for Singapore
 search_url = "https://www.propertyguru.com.sg/property-for-rent"
 
-# Create list to store property information
-property_list = []
-
-# Create counter for the number of scraped properties
-n_scraped = 0
-
-# Loop through the search results pages
-for page in range(1, 20):  # range(1, n_pages + 1):
-    # Make a search request
-    response = scraper.get(search_url + f"/{page}")
-
-    # Parse the search results
-    soup = BeautifulSoup(response.content, "lxml")
-
-    # Detect captcha
-    if "captcha" in soup.text:
-        print("Captcha detected when trying to scrape " + search_url + f"/{page}")
-
-    # Get list of property cards that contain property information (identified by div tags with a specific class)
-    property_card_list = soup.find_all("div", {"class": "listing-card"})
-
-    # Loop through the property cards
-    for property_card in property_card_list:
-        # Get property name (identified by an HTML anchor tag with a specific class and item property)
-        name = property_card.find("a", {"class": "nav-link", "itemprop": "url"}).get_text()
-
-        # Get property address (identified by an HTML span tag with a specific item property)
-        address = property_card.find("span", {"itemprop": "streetAddress"}).get_text()
-
-        # Get property price (identified by an HTML span tag with a specific class)
-        price = property_card.find(class_="price").get_text()
-
-        # Get property size (identified by an HTML list tag with a specific class)
-        size = property_card.find("li", {"class": "listing-floorarea"}).get_text()
-
-        # Get bedrooms and bathrooms
-        # Get HTML tag that contains the information about the bedrooms and bathrooms
-        rooms_tag = property_card.find("li", {"class": "listing-rooms"})
-        # If the HTML tag is missing, set bedrooms and bathrooms as missing values
-        if rooms_tag is None:
-            bedrooms = ""
-            bathrooms = ""
-        # If the property is identified as a room in a shared flat, assign bedrooms as "Room" and bathrooms as missing
-        elif "Room" in rooms_tag.get_text():
-            bedrooms = "Room"
-            bathrooms = ""
-        # If the property is identified as a studio, assign bedrooms as "Studio" and bathrooms as missing
-        elif "Studio" in rooms_tag.get_text():
-            bedrooms = "Studio"
-            bathrooms = ""
-        # If the property is not a room or a studio, extract the bedrooms and bathrooms information
-        else:
-            bedrooms = rooms_tag.find(class_="bed").get_text(strip=True) if rooms_tag.find(class_="bed") is not None else ""
-            bathrooms = rooms_tag.find(class_="bath").get_text(strip=True) if rooms_tag.find(class_="bath") is not None else ""
-
-        # Get property type, furnishing, and build year (identified by an HTML unordered list tag with a specific class)
-        property_type_furnishing_year = soup.find("ul", {"class": "listing-property-type"}).get_text()
-
-        # Get distance to MRT (identified by an HTML unordered list tag with a specific data-automation-id)
-        mrt_distance_tag = property_card.find("ul", {"data-automation-id": "listing-features-walk"})
-        # If the HTML tag is missing, assign a missing value
-        if mrt_distance_tag is None:
-            mrt_distance = ""
-        # If the HTML tag is present, extract the MRT distance information
-        else:
-            mrt_distance = mrt_distance_tag.get_text(strip=True)
+# Columns of the scraped property information
+COLUMNS = ["name", "address", "price", "size", "bedrooms", "bathrooms", "property_type_furnishing_year",
+           "mrt_distance", "agent_description"]
+
+
+# Create function to check whether the class attribute of a tag contains the class of property cards
+# (SoupStrainer compares the whole attribute value, so a card with additional classes would not match a plain string)
+def is_property_card_class(class_value):
+    classes = class_value.split() if isinstance(class_value, str) else class_value or []
+    return "listing-card" in classes
+
+
+# Only build the parse tree for the property cards (identified by div tags with a specific class), not the full page
+PROPERTY_CARD_STRAINER = SoupStrainer("div", {"class": is_property_card_class})
+
+# Create one CloudScraper object per fetcher thread (the Cloudflare challenge state is not shared between threads)
+thread_local = threading.local()
+
+
+# Create function to get the CloudScraper object of the current thread
+def get_scraper():
+    if not hasattr(thread_local, "scraper"):
+        # Import cloudscraper only when scraping, so saved pages can be parsed without it
+        import cloudscraper
+
+        thread_local.scraper = cloudscraper.create_scraper()
+    return thread_local.scraper
+
+
+# Create function to fetch a search results page
+def fetch_page(page, rate_limiter=None, max_retries=3):
+    response = get_with_retries(get_scraper(), search_url + f"/{page}", rate_limiter=rate_limiter,
+                                max_retries=max_retries, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+# Create function to extract the property information from a property card (all lookups are scoped to the card)
+def parse_property_card(property_card):
+    # Get property name (identified by an HTML anchor tag with a specific class and item property)
+    name = property_card.find("a", {"class": "nav-link", "itemprop": "url"}).get_text()
+
+    # Get property address (identified by an HTML span tag with a specific item property)
+    address = property_card.find("span", {"itemprop": "streetAddress"}).get_text()
+
+    # Get property price (identified by an HTML span tag with a specific class)
+    price = property_card.find(class_="price").get_text()
+
+    # Get property size (identified by an HTML list tag with a specific class)
+    size = property_card.find("li", {"class": "listing-floorarea"}).get_text()
+
+    # Get bedrooms and bathrooms
+    # Get HTML tag that contains the information about the bedrooms and bathrooms
+    rooms_tag = property_card.find("li", {"class": "listing-rooms"})
+    # If the HTML tag is missing, set bedrooms and bathrooms as missing values
+    if rooms_tag is None:
+        bedrooms = ""
+        bathrooms = ""
+    # If the property is identified as a room in a shared flat, assign bedrooms as "Room" and bathrooms as missing
+    elif "Room" in rooms_tag.get_text():
+        bedrooms = "Room"
+        bathrooms = ""
+    # If the property is identified as a studio, assign bedrooms as "Studio" and bathrooms as missing
+    elif "Studio" in rooms_tag.get_text():
+        bedrooms = "Studio"
+        bathrooms = ""
+    # If the property is not a room or a studio, extract the bedrooms and bathrooms information
+    else:
+        bedrooms_tag = rooms_tag.find(class_="bed")
+        bathrooms_tag = rooms_tag.find(class_="bath")
+        bedrooms = bedrooms_tag.get_text(strip=True) if bedrooms_tag is not None else ""
+        bathrooms = bathrooms_tag.get_text(strip=True) if bathrooms_tag is not None else ""
 
-        # Get property agent description (identified by an HTML div tag with a specific class)
-        agent_description = property_card.find("div", {"class": "featured-description"}).get_text().split('"')[1]
+    # Get property type, furnishing, and build year (identified by an HTML unordered list tag with a specific class)
+    property_type_tag = property_card.find("ul", {"class": "listing-property-type"})
+    property_type_furnishing_year = property_type_tag.get_text() if property_type_tag is not None else ""
 
-        # Add property to the property list
-        property_list.append([name, address, price, size, bedrooms, bathrooms, property_type_furnishing_year,
-                              mrt_distance, agent_description])
+    # Get distance to MRT (identified by an HTML unordered list tag with a specific data-automation-id)
+    mrt_distance_tag = property_card.find("ul", {"data-automation-id": "listing-features-walk"})
+    # If the HTML tag is missing, assign a missing value
+    if mrt_distance_tag is None:
+        mrt_distance = ""
+    # If the HTML tag is present, extract the MRT distance information
+    else:
+        mrt_distance = mrt_distance_tag.get_text(strip=True)
 
-    # Update the number of scraped properties
-    n_scraped += len(property_card_list)
-    # Show number of scraped properties
-    print(f"Number of scraped properties: {n_scraped}")
+    # Get property agent description (identified by an HTML div tag with a specific class)
+    agent_description = property_card.find("div", {"class": "featured-description"}).get_text().split('"')[1]
 
-# Show first 10 elements of the list of properties
-print(property_list[:10])
+    return [name, address, price, size, bedrooms, bathrooms, property_type_furnishing_year, mrt_distance,
+            agent_description]
 
-# Show total number of properties
-print(len(property_list))
 
-# Convert list of properties to pandas dataframe
-new_data = pd.DataFrame(property_list, columns=["name", "address", "price", "size", "bedrooms", "bathrooms",
-                                                "property_type_furnishing_year", "mrt_distance", "agent_description"])
+# Create function to parse a search results page into a list of properties
+# Returns the properties and whether a captcha page was returned instead of search results
+def parse_search_page(html):
+    property_cards = BeautifulSoup(html, "lxml", parse_only=PROPERTY_CARD_STRAINER).find_all(
+        "div", {"class": "listing-card"})
+    captcha = not property_cards and b"captcha" in html.lower()
+    return [parse_property_card(property_card) for property_card in property_cards], captcha
 
-# Read the existing csv
-df = pd.read_csv("data/rental_prices_singapore.csv")
 
-# Append the new data to the existing dataframe
-df = pd.concat([df, new_data], ignore_index=True)
+# Create function to fetch search results pages concurrently and parse them in a pool of processes
+# Each parsed page is added to the listing store as soon as it is ready (if a store is given), so an interrupted run
+# can be resumed from its completed pages
+# Returns a dataframe with the scraped properties (only the new ones if a store is given) in page order
+def scrape_pages(pages, max_workers=4, requests_per_second=2.0, max_retries=3, parse_processes=None,
+                 save_html_dir=None, store=None, run_id=None):
+    rate_limiter = HostRateLimiter(requests_per_second)
+    parse_processes = parse_processes or os.cpu_count() or 1
+    page_properties = {}
+    n_scraped = 0
+
+    def handle_page(page, properties, captcha):
+        nonlocal n_scraped
+        # Detect captcha (the page is not marked as completed, so it is scraped again when the run is resumed)
+        if captcha:
+            print("Captcha detected when trying to scrape " + search_url + f"/{page}")
+            return
+        properties = pd.DataFrame(properties, columns=COLUMNS)
+        if store is not None:
+            properties = store.add_page(run_id, page, properties)
+        page_properties[page] = properties
+        # Update and show the number of scraped properties
+        n_scraped += len(properties)
+        print(f"Number of scraped properties: {n_scraped}{' new' if store is not None else ''}")
+
+    # Parse in the main process when there is only one core, since a process pool would only add overhead
+    parse_executor = ProcessPoolExecutor(parse_processes) if parse_processes > 1 else None
+    with ThreadPoolExecutor(max_workers) as fetch_executor:
+        fetch_futures = {fetch_executor.submit(fetch_page, page, rate_limiter, max_retries): page for page in pages}
+        parse_futures = {}
+        for future in as_completed(fetch_futures):
+            page = fetch_futures[future]
+            try:
+                html = future.result()
+            except Exception as error:
+                print(f"Failed to scrape {search_url}/{page}: {error}")
+                continue
+            if save_html_dir is not None:
+                with open(os.path.join(save_html_dir, f"page_{page}.html"), "wb") as file:
+                    file.write(html)
+            if parse_executor is not None:
+                parse_futures[parse_executor.submit(parse_search_page, html)] = page
+            else:
+                handle_page(page, *parse_search_page(html))
+
+        for future in as_completed(parse_futures):
+            handle_page(parse_futures[future], *future.result())
+    if parse_executor is not None:
+        parse_executor.shutdown()
+
+    return pd.concat([pd.DataFrame(columns=COLUMNS)] + [page_properties[page] for page in sorted(page_properties)],
+                     ignore_index=True)
+
+
+# Create function to parse a search results page like the original sequential scraper did (full page parse tree)
+def parse_search_page_full(html):
+    soup = BeautifulSoup(html, "lxml")
+    return [parse_property_card(property_card) for property_card in soup.find_all("div", {"class": "listing-card"})]
+
+
+# Create function to write synthetic search results pages with the markup of the property cards (plus navigation,
+# filters and scripts like a real page), so the parsing benchmark can be reproduced without scraping
+def generate_fixture_pages(fixtures_dir, n_pages=19, cards_per_page=20, seed=0):
+    rng = random.Random(seed)
+    streets = ["Orchard Road", "River Valley Road", "Tanjong Pagar Road", "Holland Avenue", "Bukit Timah Road",
+               "Tampines Street 81", "Punggol Drive", "Marine Parade Road"]
+    property_types = ["Condominium", "Apartment", "HDB Flat", "Terraced House", "Detached House"]
+    furnishings = ["Fully Furnished", "Partially Furnished", "Unfurnished"]
+    descriptions = ["High floor unit with unblocked view", "Newly renovated, near MRT", "Penthouse with pool view",
+                    "Brand new unit, move in immediately", "Quiet and cosy, walk to amenities"]
+    os.makedirs(fixtures_dir, exist_ok=True)
+    for page in range(1, n_pages + 1):
+        cards = []
+        for card in range(cards_per_page):
+            bedrooms = rng.choice(["Room", "Studio", "1", "2", "3", "4", "5"])
+            if bedrooms in ("Room", "Studio"):
+                rooms = f'<li class="listing-rooms pull-left"><span>{bedrooms}</span></li>'
+            else:
+                bathrooms = rng.randint(1, int(bedrooms))
+                rooms = (f'<li class="listing-rooms pull-left"><span class="bed">{bedrooms} <i class="pgicon"></i>'
+                         f'</span><span class="bath">{bathrooms} <i class="pgicon"></i></span></li>')
+            minutes, meters = rng.randint(1, 20), rng.randint(50, 1500)
+            mrt = (f'<ul data-automation-id="listing-features-walk"><li>{minutes} min ({meters} m) from MRT</li></ul>'
+                   if rng.random() < 0.8 else "")
+            cards.append(
+                f'<div class="listing-card listing-id-{page}{card:02d} featured-listing">'
+                f'<div class="gallery-container"><img src="/images/{page}-{card}.jpg" alt="photo"></div>'
+                f'<div class="header-wrapper"><h3><a class="nav-link" itemprop="url" href="/listing/{page}-{card}">'
+                f'Property {page}-{card}</a></h3>'
+                f'<p itemprop="address"><span itemprop="streetAddress">{rng.randint(1, 500)} {rng.choice(streets)}'
+                f'</span></p></div>'
+                f'<div class="listing-features"><span class="price">S$ {rng.randint(8, 150) * 100:,} /mo</span>'
+                f'<ul class="listing-features pull-left">{rooms}<li class="listing-floorarea pull-left">'
+                f'{rng.randint(150, 5000):,} sqft</li></ul>'
+                f'<ul class="listing-property-type"><li>{rng.choice(property_types)}</li><li>'
+                f'{rng.choice(furnishings)}</li><li>Built: {rng.randint(1980, 2023)}</li></ul>{mrt}</div>'
+                f'<div class="featured-description">"{rng.choice(descriptions)}"</div></div>')
+        navigation = "".join(f'<li><a href="/property-for-rent/{link}">{link}</a></li>' for link in range(1, 50))
+        filters = "".join(f'<option value="{value}">Filter {value}</option>' for value in range(200))
+        html = (f'<!DOCTYPE html><html><head><title>Property for rent - page {page}</title>'
+                f'<script>window.dataLayer = [{{"page": {page}}}];</script></head><body>'
+                f'<nav><ul>{navigation}</ul></nav><form><select>{filters}</select></form>'
+                f'<div class="listing-widget-new">{"".join(cards)}</div>'
+                f'<footer><ul>{navigation}</ul></footer></body></html>')
+        with open(os.path.join(fixtures_dir, f"page_{page:03d}.html"), "w") as file:
+            file.write(html)
+
+
+# Create function to measure the parsing throughput in pages per second on saved search results pages
+def benchmark(fixtures_dir, processes=None, repeat=3):
+    file_names = sorted(file_name for file_name in os.listdir(fixtures_dir) if file_name.endswith(".html"))
+    if not file_names:
+        raise FileNotFoundError(f"No .html files in {fixtures_dir} (save pages with --save-html or generate "
+                                f"synthetic pages with --generate-fixtures)")
+    pages = []
+    for file_name in file_names:
+        with open(os.path.join(fixtures_dir, file_name), "rb") as file:
+            pages.append(file.read())
+    processes = processes or os.cpu_count() or 1
+
+    # Check that the strained parse returns the same properties as the full page parse
+    for html in pages:
+        assert parse_search_page(html)[0] == parse_search_page_full(html)
+
+    def parse_in_pool():
+        with ProcessPoolExecutor(processes) as executor:
+            return list(executor.map(parse_search_page, pages))
+
+    print(f"{len(pages)} pages, {sum(len(parse_search_page(html)[0]) for html in pages)} properties")
+    for name, parse in [("Full page parse", lambda: [parse_search_page_full(html) for html in pages]),
+                        ("Property card parse", lambda: [parse_search_page(html) for html in pages]),
+                        (f"Property card parse ({processes} processes)", parse_in_pool)]:
+        seconds = float("inf")
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            parse()
+            seconds = min(seconds, time.perf_counter() - start_time)
+        print(f"{name:>40}: {len(pages) / seconds:8.1f} pages/s")
+
+
+# Scrape the search results pages and add the new listings to the listing store
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape rental property listings from PropertyGuru.")
+    parser.add_argument("--first-page", type=int, default=1)
+    parser.add_argument("--last-page", type=int, default=19)
+    parser.add_argument("--workers", type=int, default=4, help="Number of pages fetched concurrently.")
+    parser.add_argument("--rate", type=float, default=2.0, help="Maximum requests per second to the host.")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per page for temporary errors.")
+    parser.add_argument("--parse-processes", type=int, help="Number of parser processes (default: number of cores).")
+    parser.add_argument("--store", default="data/listings", help="Directory of the listing store.")
+    parser.add_argument("--new-run", action="store_true", help="Start a new run instead of resuming an unfinished one.")
+    parser.add_argument("--import-csv", metavar="PATH",
+                        help="Add the listings of a csv file (e.g. data/rental_prices_singapore.csv) to the store.")
+    parser.add_argument("--save-html", metavar="DIR", help="Save the fetched pages, e.g. as benchmark fixtures.")
+    parser.add_argument("--benchmark", metavar="DIR", help="Measure the parsing throughput on saved pages.")
+    parser.add_argument("--generate-fixtures", metavar="DIR",
+                        help="Write synthetic search results pages for the benchmark (same pages on every run).")
+    args = parser.parse_args()
+
+    if args.generate_fixtures:
+        generate_fixture_pages(args.generate_fixtures)
+        print(f"Saved synthetic search results pages to {args.generate_fixtures}")
+    elif args.benchmark:
+        benchmark(args.benchmark, processes=args.parse_processes)
+    elif args.import_csv:
+        new_data = ListingStore(args.store).import_csv(args.import_csv)
+        print(f"Imported {len(new_data)} new listings from {args.import_csv}")
+    else:
+        if args.save_html:
+            os.makedirs(args.save_html, exist_ok=True)
+        store = ListingStore(args.store)
+        run_id, pages = store.start_run(args.first_page, args.last_page, resume=not args.new_run)
+        new_data = scrape_pages(pages, max_workers=args.workers, requests_per_second=args.rate,
+                                max_retries=args.retries, parse_processes=args.parse_processes,
+                                save_html_dir=args.save_html, store=store, run_id=run_id)
+
+        # Finish the run once all pages are completed (otherwise the next run resumes it)
+        remaining_pages = sorted(set(pages) - store.completed_pages(run_id))
+        if remaining_pages:
+            print(f"Run {run_id} is incomplete, run again to scrape pages {remaining_pages}")
+        else:
+            store.finish_run(run_id)
 
-# Save dataframe as csv
-df.to_csv("data/rental_prices_singapore.csv", index=False)
+        # Show first 10 new properties and the total number of new properties
+        print(new_data.head(10))
+        print(len(new_data))
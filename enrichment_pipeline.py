@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import requests
+import location_features
+from http_utils import HostRateLimiter
+from location_cache import normalize_address, coordinates_key
+from request_context import configure_logging
+from location_features import (get_missing_address, get_latitude_longitude, get_meters_to_cbd, get_school_location,
+                               get_meters_to_school, get_restaurants_rating)
+
+# Cost per Google Maps API call in $ (see data_preprocessing.ipynb)
+API_COSTS = {
+    "missing_address": 0.017,
+    "geocode": 0.005,
+    "meters_to_cbd": 0.005,
+    "school_location": 0.032,
+    "meters_to_school": 0.005,
+    "restaurants_rating": 0.032
+}
+
+
+# Create function to load the results of a stage from its checkpoint file (one JSON object per line)
+def load_checkpoint(path):
+    results = {}
+    if os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Ignore a partially written last line after a crash
+                    continue
+                results[entry["key"]] = entry["value"]
+    return results
+
+
+# Create function to run a stage: call the function once per unique key concurrently and append each result to the
+# checkpoint file as soon as it arrives, so a crash never repeats a paid API call
+# Inputs map each unique key to the arguments of the function; returns a dict that maps each key to its result
+def run_stage(name, inputs, function, checkpoint_dir, max_workers):
+    path = os.path.join(checkpoint_dir, f"{name}.jsonl")
+    results = load_checkpoint(path)
+    pending = {key: arguments for key, arguments in inputs.items() if key not in results}
+    print(f"Stage {name}: {len(inputs)} unique inputs, {len(inputs) - len(pending)} from checkpoint, "
+          f"{len(pending)} to fetch (estimated cost: {len(pending) * API_COSTS[name]:.2f}$)")
+
+    start_time = time.monotonic()
+    n_failed = 0
+    with open(path, "a") as file, ThreadPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(function, *arguments): key for key, arguments in pending.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                value = future.result()
+            except (requests.RequestException, ValueError) as error:
+                # Failed calls are not checkpointed, so they are retried on the next run
+                print(f"Stage {name} failed for {key}: {error}")
+                n_failed += 1
+                continue
+            results[key] = value
+            file.write(json.dumps({"key": key, "value": value}) + "\n")
+            file.flush()
+    elapsed = time.monotonic() - start_time
+    print(f"Stage {name}: fetched {len(pending) - n_failed} in {elapsed:.1f}s ({n_failed} failed)")
+    return results
+
+
+# Create function to get the key of a location (None if latitude or longitude is missing)
+def location_key(*coordinates):
+    if any(pd.isna(coordinate) for coordinate in coordinates):
+        return None
+    return coordinates_key(*coordinates)
+
+
+# Create function to enrich listings with the location-based features, one stage after another
+# Each stage fetches every unique name, address or location only once
+def enrich(df, checkpoint_dir="data/enrichment", max_workers=16):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    df = df.copy()
+
+    # Get missing addresses based on the property name
+    missing = df["address"].isna() | (df["address"] == "")
+    names = {name: (name,) for name in df.loc[missing, "name"].dropna().unique()}
+    addresses = run_stage("missing_address", names, get_missing_address, checkpoint_dir, max_workers)
+    df["address_new"] = df["address"].where(~missing, df["name"].map(addresses))
+
+    # Get latitude and longitude from the address
+    address_keys = df["address_new"].map(lambda address: normalize_address(address) if isinstance(address, str)
+                                         else None)
+    inputs = {key: (address,) for key, address in zip(address_keys, df["address_new"]) if key is not None}
+    coordinates = run_stage("geocode", inputs, get_latitude_longitude, checkpoint_dir, max_workers)
+    df["latitude"] = [coordinates.get(key, (np.nan, np.nan))[0] if key else np.nan for key in address_keys]
+    df["longitude"] = [coordinates.get(key, (np.nan, np.nan))[1] if key else np.nan for key in address_keys]
+
+    # Get meters to CBD, the closest school and the restaurants rating from latitude and longitude
+    location_keys = [location_key(latitude, longitude) for latitude, longitude in zip(df["latitude"], df["longitude"])]
+    inputs = {key: (latitude, longitude) for key, latitude, longitude in zip(location_keys, df["latitude"],
+                                                                            df["longitude"]) if key is not None}
+    meters_to_cbd = run_stage("meters_to_cbd", inputs, get_meters_to_cbd, checkpoint_dir, max_workers)
+    df["meters_to_cbd"] = [meters_to_cbd.get(key, np.nan) for key in location_keys]
+    school_locations = run_stage("school_location", inputs, get_school_location, checkpoint_dir, max_workers)
+    school_locations = [school_locations.get(key, (np.nan, np.nan)) for key in location_keys]
+    # Same format as the "school_location" column in data_preprocessing.ipynb, e.g. "(1.3, 103.8)"
+    df["school_location"] = [str((float(school_latitude), float(school_longitude)))
+                             for school_latitude, school_longitude in school_locations]
+
+    # Get meters to the closest school
+    school_keys = [location_key(latitude, longitude, school_latitude, school_longitude)
+                   for latitude, longitude, (school_latitude, school_longitude)
+                   in zip(df["latitude"], df["longitude"], school_locations)]
+    school_inputs = {key: (latitude, longitude, school_latitude, school_longitude)
+                     for key, latitude, longitude, (school_latitude, school_longitude)
+                     in zip(school_keys, df["latitude"], df["longitude"], school_locations) if key is not None}
+    meters_to_school = run_stage("meters_to_school", school_inputs, get_meters_to_school, checkpoint_dir, max_workers)
+    df["meters_to_school"] = [meters_to_school.get(key, np.nan) for key in school_keys]
+
+    restaurants_rating = run_stage("restaurants_rating", inputs, get_restaurants_rating, checkpoint_dir, max_workers)
+    df["restaurants_rating"] = [restaurants_rating.get(key, np.nan) for key in location_keys]
+    return df
+
+
+# Enrich the scraped listings with location-based features via the Google Maps API
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrich the scraped listings with location-based features.")
+    parser.add_argument("--input", default="data/listings",
+                        help="Listing store directory or csv file (default: data/listings).")
+    parser.add_argument("--output", default="data/preprocessing/rental_prices_singapore_preprocessing_6.csv")
+    parser.add_argument("--checkpoint-dir", default="data/enrichment",
+                        help="Directory of the stage checkpoints (delete it to fetch everything again).")
+    parser.add_argument("--workers", type=int, default=16, help="Number of concurrent API calls.")
+    parser.add_argument("--rate", type=float, default=20.0, help="Maximum API requests per second.")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per API call for temporary errors.")
+    parser.add_argument("--breaker-failures", type=int, default=0,
+                        help="Stop calling an API for 30 seconds after this many consecutive failures (default: 0, "
+                             "never stop).")
+    args = parser.parse_args()
+
+    # Show warnings of the feature functions (e.g. addresses that could not be geocoded) as plain text
+    configure_logging(level="WARNING", structured=False)
+
+    # Replace the rate limit and retries of the app with the ones of the pipeline
+    location_features.maps_rate_limiter = HostRateLimiter(args.rate)
+    location_features.maps_max_retries = args.retries
+    # Keep calling an API after consecutive failures (failed calls are retried on the next run)
+    location_features.use_batch_circuit_breakers(args.breaker_failures)
+
+    if os.path.isdir(args.input):
+        from listing_store import load_listings
+
+        listings = load_listings(args.input)
+    else:
+        listings = pd.read_csv(args.input)
+    # Remove duplicates (same as data_preprocessing.ipynb)
+    listings = listings.drop_duplicates(subset=["name", "price", "size"]).reset_index(drop=True)
+
+    enriched = enrich(listings, checkpoint_dir=args.checkpoint_dir, max_workers=args.workers)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    enriched.to_csv(args.output, index=False)
+    print(f"Saved {len(enriched)} enriched listings to {args.output}")
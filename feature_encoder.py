@@ -0,0 +1,137 @@
+import numpy as np
+
+
+# Create a class that encodes model features with plain NumPy, using the parameters of a fitted column transformer
+# (StandardScaler, OneHotEncoder and passthrough columns) but without the pandas and scikit-learn overhead per call
+class FeatureEncoder:
+    def __init__(self, feature_names, blocks):
+        # Blocks describe the transformers in the order of the column transformer output (see to_spec for the format)
+        self.feature_names = list(feature_names)
+        self.blocks = []
+        # Categories known to the model for each categorical feature
+        self.categories = {}
+        n_output_features = 0
+
+        for block in blocks:
+            block = dict(block)
+            if block["kind"] == "scaler":
+                block["mean"] = np.asarray(block["mean"], dtype=float)
+                block["scale"] = np.asarray(block["scale"], dtype=float)
+                block["width"] = len(block["positions"])
+            elif block["kind"] == "onehot":
+                # Map each category to its output column offset within the block
+                block["offsets"] = []
+                width = 0
+                for position, categories in zip(block["positions"], block["categories"]):
+                    self.categories[self.feature_names[position]] = list(categories)
+                    block["offsets"].append({category: width + index for index, category in enumerate(categories)})
+                    width += len(categories)
+                block["width"] = width
+            elif block["kind"] == "passthrough":
+                block["width"] = len(block["positions"])
+            else:
+                raise ValueError(f"Unknown encoder block kind: {block['kind']}")
+            block["start"] = n_output_features
+            n_output_features += block["width"]
+            self.blocks.append(block)
+        self.n_output_features = n_output_features
+
+    @classmethod
+    def from_column_transformer(cls, column_transformer):
+        # Import scikit-learn only when building the encoder from a pickled column transformer
+        from sklearn.preprocessing import StandardScaler, OneHotEncoder
+
+        feature_names = list(column_transformer.feature_names_in_)
+        blocks = []
+
+        # Extract the parameters of each transformer in the order of the column transformer output
+        for name, transformer, columns in column_transformer.transformers_:
+            if transformer == "drop" or len(columns) == 0:
+                continue
+            positions = [int(column) if isinstance(column, (int, np.integer)) else feature_names.index(column)
+                         for column in columns]
+            if transformer == "passthrough":
+                blocks.append({"kind": "passthrough", "positions": positions})
+            elif isinstance(transformer, StandardScaler):
+                mean = transformer.mean_ if transformer.with_mean else np.zeros(len(positions))
+                scale = transformer.scale_ if transformer.with_std else np.ones(len(positions))
+                blocks.append({"kind": "scaler", "positions": positions, "mean": list(map(float, mean)),
+                               "scale": list(map(float, scale))})
+            elif isinstance(transformer, OneHotEncoder) and transformer.drop_idx_ is None:
+                blocks.append({"kind": "onehot", "positions": positions,
+                               "categories": [categories.tolist() for categories in transformer.categories_],
+                               "ignore_unknown": transformer.handle_unknown != "error"})
+            else:
+                raise ValueError(f"Unsupported transformer in column transformer: {name} ({transformer})")
+        return cls(feature_names, blocks)
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(spec["feature_names"], spec["blocks"])
+
+    def to_spec(self):
+        # Compact JSON-serializable description of the encoder
+        blocks = []
+        for block in self.blocks:
+            spec_block = {"kind": block["kind"], "positions": block["positions"]}
+            if block["kind"] == "scaler":
+                spec_block["mean"] = block["mean"].tolist()
+                spec_block["scale"] = block["scale"].tolist()
+            elif block["kind"] == "onehot":
+                spec_block["categories"] = block["categories"]
+                spec_block["ignore_unknown"] = block["ignore_unknown"]
+            blocks.append(spec_block)
+        return {"feature_names": self.feature_names, "blocks": blocks}
+
+    def transform_row(self, row):
+        # Encode one row of raw features (a tuple in the order of the feature names) into a 1 x n matrix
+        output = np.zeros((1, self.n_output_features))
+        for block in self.blocks:
+            start = block["start"]
+            if block["kind"] == "scaler":
+                values = np.array([row[position] for position in block["positions"]], dtype=float)
+                output[0, start:start + block["width"]] = (values - block["mean"]) / block["scale"]
+            elif block["kind"] == "onehot":
+                for position, offsets in zip(block["positions"], block["offsets"]):
+                    offset = offsets.get(row[position])
+                    if offset is not None:
+                        output[0, start + offset] = 1.0
+                    elif not block["ignore_unknown"]:
+                        raise ValueError(f"Unknown category {row[position]!r} in column "
+                                         f"{self.feature_names[position]}")
+            else:
+                output[0, start:start + block["width"]] = [row[position] for position in block["positions"]]
+        return output
+
+    def transform_rows(self, rows):
+        # Encode many rows of raw features (a sequence of tuples or a structured array with the feature names as
+        # fields) into an n x m matrix
+        if isinstance(rows, np.ndarray) and rows.dtype.names is not None:
+            columns = [rows[name] for name in self.feature_names]
+        else:
+            columns = list(zip(*rows))
+        n_rows = len(columns[0]) if columns else 0
+
+        output = np.zeros((n_rows, self.n_output_features))
+        if n_rows == 0:
+            return output
+        for block in self.blocks:
+            start = block["start"]
+            if block["kind"] == "scaler":
+                values = np.column_stack([np.asarray(columns[position], dtype=float)
+                                          for position in block["positions"]])
+                output[:, start:start + block["width"]] = (values - block["mean"]) / block["scale"]
+            elif block["kind"] == "onehot":
+                for position, offsets in zip(block["positions"], block["offsets"]):
+                    indices = np.array([offsets.get(value, -1) for value in columns[position]], dtype=int)
+                    unknown = indices < 0
+                    if unknown.any() and not block["ignore_unknown"]:
+                        value = columns[position][np.flatnonzero(unknown)[0]]
+                        raise ValueError(f"Unknown category {value!r} in column {self.feature_names[position]}")
+                    rows_known = np.flatnonzero(~unknown)
+                    output[rows_known, start + indices[rows_known]] = 1.0
+            else:
+                for index, position in enumerate(block["positions"]):
+                    output[:, start + index] = np.asarray(columns[position], dtype=float)
+        return output
+
@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+from keyword_features import extract_keyword_features, extract_keyword_flags
+
+# Choices of the categorical inputs (same categories as in the training data, see model_training.ipynb)
+BEDROOM_CHOICES = ["Room", "Studio", "1", "2", "3", "4", "5", "6", "7+"]
+PROPERTY_TYPE_CHOICES = ["Condominium", "Apartment", "HDB Flat", "Semi-Detached House", "Good Class Bungalow",
+                         "Corner Terrace", "Detached House", "Executive Condominium", "Terraced House", "Bungalow House",
+                         "Cluster House"]
+FURNISHING_CHOICES = ["Fully Furnished", "Partially Furnished", "Unfurnished"]
+
+# Values to handle missing inputs (see data_preprocessing.ipynb)
+# Bathrooms: Assume 1 bathroom for a room or studio, 7 bathrooms for 7+ bedrooms, else same number as bedrooms
+BEDROOM_BATHROOMS = {"Room": 1, "Studio": 1, "7+": 7}
+# Meters to school: the maximum, meters to MRT: the median, furnishing: the mode, built year: the median
+IMPUTATION_VALUES = {"meters_to_school": 9689, "meters_to_mrt": 450, "furnishing": "Partially Furnished", "year": 2013}
+
+# Values of the location-based features that cannot be looked up in time (degraded mode, see location_features.py)
+# Meters to CBD and restaurants rating: the median; meters to school: same as above
+# Latitude and longitude stay missing, which the XGBoost model handles natively
+DEGRADED_LOCATION_VALUES = {"latitude": np.nan, "longitude": np.nan, "meters_to_cbd": 10302.5,
+                            "school_latitude": np.nan, "school_longitude": np.nan,
+                            "meters_to_school": IMPUTATION_VALUES["meters_to_school"], "restaurants_rating": 4.035}
+
+# Raw listing inputs (as submitted by the user) and the features expected by the column transformer
+LISTING_COLUMNS = ["size", "bedrooms", "bathrooms", "address", "property_type", "furnishing", "year", "meters_to_mrt",
+                   "agent_description"]
+LOCATION_COLUMNS = ["latitude", "longitude", "meters_to_cbd", "meters_to_school", "restaurants_rating"]
+FEATURE_COLUMNS = ["size", "bedrooms", "bathrooms", "latitude", "longitude", "meters_to_cbd", "meters_to_school",
+                   "restaurants_rating", "property_type", "furnishing", "year", "meters_to_mrt", "high_floor", "new",
+                   "renovated", "view", "penthouse"]
+
+
+# Create function to check a listing submitted to the API and return an error message if it is invalid
+def validate_listing(listing):
+    if not isinstance(listing, dict):
+        return "Listing must be a JSON object."
+
+    # Required fields (a text of only whitespace counts as missing)
+    for field in ["size", "bedrooms", "address", "property_type"]:
+        value = listing.get(field)
+        if value is None or (isinstance(value, str) and value.strip() == ""):
+            return f"Missing required field: {field}."
+
+    # Integer fields (bool is a subclass of int in Python, so exclude it explicitly)
+    for field in ["size", "bathrooms", "year", "meters_to_mrt"]:
+        value = listing.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+            return f"Field {field} must be an integer."
+    if listing["size"] <= 0:
+        return "Field size must be positive."
+
+    # Text fields
+    for field in ["address", "agent_description"]:
+        value = listing.get(field)
+        if value is not None and not isinstance(value, str):
+            return f"Field {field} must be a string."
+
+    # Categorical fields
+    if listing["bedrooms"] not in BEDROOM_CHOICES:
+        return f"Field bedrooms must be one of {BEDROOM_CHOICES}."
+    if listing["property_type"] not in PROPERTY_TYPE_CHOICES:
+        return f"Field property_type must be one of {PROPERTY_TYPE_CHOICES}."
+    if listing.get("furnishing") not in [None, ""] + FURNISHING_CHOICES:
+        return f"Field furnishing must be one of {FURNISHING_CHOICES}."
+    return None
+
+
+# Create function to check a dataframe of listings (e.g. a chunk of a csv or Parquet file) with the same rules as
+# validate_listing and check_model_categories, without a Python loop per listing
+# Returns a Series with an error message for each invalid listing (None for valid listings), the first error wins
+def validate_listings(listings, categories, require_address=True):
+    errors = pd.Series(None, index=listings.index, dtype=object)
+
+    # Text of each field (missing values become "")
+    text = {field: listings[field].astype("string").fillna("")
+            for field in ["size", "bedrooms", "address", "property_type", "furnishing", "bathrooms", "year",
+                          "meters_to_mrt"]}
+
+    # Required fields
+    for field in ["size", "bedrooms"] + (["address"] if require_address else []) + ["property_type"]:
+        errors[(text[field].str.strip() == "") & errors.isna()] = f"Missing required field: {field}."
+
+    # Integer fields (given values must be whole numbers)
+    for field in ["size", "bathrooms", "year", "meters_to_mrt"]:
+        values = pd.to_numeric(listings[field], errors="coerce")
+        invalid = (text[field] != "") & (values.isna() | (values % 1 != 0))
+        errors[invalid & errors.isna()] = f"Field {field} must be an integer."
+    errors[(pd.to_numeric(listings["size"], errors="coerce") <= 0) & errors.isna()] = "Field size must be positive."
+
+    # Categorical fields
+    for field, choices in [("bedrooms", BEDROOM_CHOICES), ("property_type", PROPERTY_TYPE_CHOICES),
+                           ("furnishing", FURNISHING_CHOICES)]:
+        invalid = ~text[field].isin(choices + ([""] if field == "furnishing" else []))
+        errors[invalid & errors.isna()] = f"Field {field} must be one of {choices}."
+
+    # Categories that were not part of the training data (a missing furnishing is imputed)
+    for feature in ["bedrooms", "property_type", "furnishing"]:
+        unsupported = ~text[feature].isin(categories[feature]) & (text[feature] != "") & errors.isna()
+        for position, value in text[feature][unsupported].items():
+            errors[position] = f"Value {value!r} of field {feature} is not supported by the model."
+    return errors
+
+
+# Create function to check that the categories of a valid listing are known to the model (the form offers categories
+# that were not part of the training data) and return an error message if they are not
+# A missing furnishing is imputed, so only a given furnishing is checked
+def check_model_categories(listing, categories):
+    for feature in ["bedrooms", "property_type", "furnishing"]:
+        value = listing.get(feature)
+        if feature == "furnishing" and value in (None, ""):
+            continue
+        if value not in categories[feature]:
+            return f"Value {value!r} of field {feature} is not supported by the model."
+    return None
+
+
+# Create function to turn a single raw listing with location-based features into a tuple of model features
+# (same rules as prepare_features, but without the pandas overhead for single predictions)
+def prepare_feature_row(listing):
+    # Handle missing values
+    bathrooms = listing.get("bathrooms")
+    if bathrooms is None:
+        bedrooms = listing["bedrooms"]
+        bathrooms = BEDROOM_BATHROOMS[bedrooms] if bedrooms in BEDROOM_BATHROOMS else int(bedrooms)
+    meters_to_school = listing["meters_to_school"]
+    if meters_to_school is None or np.isnan(meters_to_school):
+        meters_to_school = IMPUTATION_VALUES["meters_to_school"]
+    meters_to_mrt = listing.get("meters_to_mrt")
+    meters_to_mrt = IMPUTATION_VALUES["meters_to_mrt"] if meters_to_mrt is None else meters_to_mrt
+    furnishing = listing.get("furnishing") or IMPUTATION_VALUES["furnishing"]
+    year = listing.get("year")
+    year = IMPUTATION_VALUES["year"] if year is None else year
+
+    return (listing["size"], listing["bedrooms"], bathrooms, listing["latitude"], listing["longitude"],
+            listing["meters_to_cbd"], meters_to_school, listing["restaurants_rating"], listing["property_type"],
+            furnishing, year, meters_to_mrt) + extract_keyword_flags(listing.get("agent_description"))
+
+
+# Create function to turn raw listings with location-based features into the model features
+# The listings dataframe needs the LISTING_COLUMNS plus the LOCATION_COLUMNS
+def prepare_features(listings):
+    features = listings.copy()
+
+    # Convert numerical inputs to floats so missing values become np.nan
+    for column in ["size", "bathrooms", "latitude", "longitude", "meters_to_cbd", "meters_to_school",
+                   "restaurants_rating", "year", "meters_to_mrt"]:
+        features[column] = pd.to_numeric(features[column], errors="coerce").astype(float)
+
+    # Extract features from the agent description
+    for feature, values in extract_keyword_features(features["agent_description"]).items():
+        features[feature] = values
+
+    # Handle missing values
+    bedroom_bathrooms = features["bedrooms"].map(BEDROOM_BATHROOMS)
+    bedroom_bathrooms = bedroom_bathrooms.fillna(pd.to_numeric(features["bedrooms"], errors="coerce"))
+    features["bathrooms"] = features["bathrooms"].fillna(bedroom_bathrooms)
+    features["furnishing"] = features["furnishing"].replace("", np.nan)
+    features = features.fillna(IMPUTATION_VALUES)
+
+    return features[FEATURE_COLUMNS]
@@ -0,0 +1,160 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes that indicate a temporary problem, so the request is retried
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# Create an exception for requests that run out of time because the deadline of the caller has passed
+class DeadlineExceeded(requests.Timeout):
+    pass
+
+
+# Create an exception for requests that are not sent because the circuit breaker of the service is open
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+# Create a class for a thread-safe token bucket that limits the request rate
+class RateLimiter:
+    def __init__(self, rate, burst=1):
+        # Rate in requests per second (no limit if rate is None or 0) and the number of requests allowed at once
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_update = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        # Block until a request is allowed
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_update) * self.rate)
+            self.last_update = now
+            # Take a token now (the balance becomes negative if none is left) and sleep until it is earned
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Create a class that keeps a separate rate limiter for each host
+class HostRateLimiter:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.limiters:
+                self.limiters[host] = RateLimiter(self.rate, self.burst)
+            limiter = self.limiters[host]
+        limiter.wait()
+
+
+# Create a class for a circuit breaker that stops sending requests to a failing service for a while, so callers fail
+# fast instead of waiting for timeouts
+# Closed: requests are sent. Open (after failure_threshold consecutive failures): requests fail immediately.
+# Half-open (reset_timeout seconds after opening): one trial request is sent, which closes or opens the circuit again
+class CircuitBreaker:
+    def __init__(self, name="", failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.n_failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        # Whether a request may be sent (in the half-open state, only one trial request at a time)
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self.trial_in_progress:
+                self.trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.n_failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.n_failures += 1
+            if self.trial_in_progress or self.n_failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_progress:
+                    logger.warning("Circuit breaker %s opened after %d failures", self.name, self.n_failures)
+                self.opened_at = time.monotonic()
+            self.trial_in_progress = False
+
+    def release(self):
+        # End a request without a verdict on the health of the service (e.g. the caller ran out of time)
+        with self._lock:
+            self.trial_in_progress = False
+
+
+# Create function to calculate the delay before a retry (exponential backoff with jitter, or the Retry-After header)
+def retry_delay(attempt, backoff, response=None):
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+    return backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+# Create function to send a GET request with rate limiting and retries for connection errors and temporary errors
+# Each attempt times out after timeout seconds; with a deadline (a time.monotonic() value), attempts are cut short at
+# the deadline (raising DeadlineExceeded) and no retry is started that could not finish before it
+# on_attempt (if given) is called before each attempt is sent, e.g. to count the requests of each attempt
+# Returns the last response (which may be an error response), or raises the last connection error
+def get_with_retries(session, url, rate_limiter=None, max_retries=3, backoff=1.0, timeout=None, deadline=None,
+                     on_attempt=None, **kwargs):
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait(url)
+        attempt_timeout = timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Deadline exceeded before requesting {url}")
+            attempt_timeout = remaining if timeout is None else min(timeout, remaining)
+        if on_attempt is not None:
+            on_attempt()
+        try:
+            response = session.get(url, timeout=attempt_timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            if isinstance(error, requests.Timeout) and attempt_timeout != timeout:
+                raise DeadlineExceeded(f"Deadline exceeded while requesting {url}") from error
+            delay = retry_delay(attempt, backoff)
+            if attempt == max_retries or (deadline is not None and time.monotonic() + delay >= deadline):
+                raise
+            logger.warning("Retrying %s after error: %s", url, error)
+            time.sleep(delay)
+            continue
+        delay = retry_delay(attempt, backoff, response)
+        if (response.status_code not in RETRY_STATUS_CODES or attempt == max_retries
+                or (deadline is not None and time.monotonic() + delay >= deadline)):
+            return response
+        logger.warning("Retrying %s after status %s", url, response.status_code)
+        time.sleep(delay)
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import numpy as np
+
+
+# Create a class that evaluates the trees of an XGBoost regression model with flattened NumPy arrays, which avoids the
+# XGBoost call overhead for single-row predictions
+class TreeEvaluator:
+    def __init__(self, left, right, features, thresholds, default_left, roots, base_score, max_depth):
+        # Nodes of all trees are flattened into global arrays (node indices are offset by the position of their tree)
+        # Leaves point to themselves and hold their leaf value as threshold, so every tree can be traversed for the
+        # same number of steps
+        self.left = left
+        self.right = right
+        self.features = features
+        self.thresholds = thresholds
+        self.default_left = default_left
+        self.roots = roots
+        self.base_score = base_score
+        self.max_depth = max_depth
+
+    @classmethod
+    def from_booster(cls, booster):
+        model = json.loads(booster.save_raw(raw_format="json"))
+        learner = model["learner"]
+        if learner["objective"]["name"] != "reg:squarederror":
+            raise ValueError(f"Unsupported objective for the tree evaluator: {learner['objective']['name']}")
+        trees = learner["gradient_booster"]["model"]["trees"]
+
+        left, right, features, thresholds, default_left, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for tree in trees:
+            if any(split_type != 0 for split_type in tree["split_type"]):
+                raise ValueError("Categorical splits are not supported by the tree evaluator")
+            n_nodes = len(tree["left_children"])
+            tree_left = np.array(tree["left_children"])
+            tree_right = np.array(tree["right_children"])
+            is_leaf = tree_left == -1
+            node_ids = np.arange(n_nodes)
+            left.append(np.where(is_leaf, node_ids, tree_left) + offset)
+            right.append(np.where(is_leaf, node_ids, tree_right) + offset)
+            features.append(np.where(is_leaf, 0, tree["split_indices"]))
+            # Split conditions hold the leaf values for leaves
+            thresholds.append(np.array(tree["split_conditions"], dtype=np.float32))
+            default_left.append(np.array(tree["default_left"], dtype=bool))
+            roots.append(offset)
+            max_depth = max(max_depth, cls._depth(tree_left, tree_right))
+            offset += n_nodes
+
+        # Store node indices as 64-bit integers, which NumPy uses for indexing without converting them on every step
+        return cls(np.concatenate(left).astype(np.int64), np.concatenate(right).astype(np.int64),
+                   np.concatenate(features).astype(np.int64), np.concatenate(thresholds),
+                   np.concatenate(default_left), np.array(roots, dtype=np.int64),
+                   float(learner["learner_model_param"]["base_score"]), max_depth)
+
+    @staticmethod
+    def _depth(left, right):
+        # Calculate the depth of a tree by walking down level by level from the root
+        depth = 0
+        level = [0]
+        while True:
+            level = [child for node in level if left[node] != -1 for child in (left[node], right[node])]
+            if not level:
+                return depth
+            depth += 1
+
+    def predict_row(self, row):
+        # Walk all trees at once, one level per step, following the default direction for missing values
+        row = np.asarray(row, dtype=np.float32)
+        nodes = self.roots
+        for _ in range(self.max_depth):
+            values = row[self.features[nodes]]
+            go_left = np.where(np.isnan(values), self.default_left[nodes], values < self.thresholds[nodes])
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return np.float32(self.base_score + self.thresholds[nodes].sum(dtype=np.float64))
+
+
+# Create a class for low-latency predictions with the native XGBoost booster instead of the scikit-learn wrapper
+class InferenceEngine:
+    def __init__(self, booster_loader, tree_evaluator=None, batch_threads=None, batch_threshold=1000):
+        # The booster is loaded on first use, so single-row predictions with the tree evaluator never import XGBoost
+        self.booster_loader = booster_loader
+        self.tree_evaluator = tree_evaluator
+        self.batch_threads = batch_threads or int(os.getenv("xgboost_batch_threads", os.cpu_count() or 1))
+        self.batch_threshold = batch_threshold
+        self.single_thread_booster = None
+        self.batch_booster = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_booster(cls, booster, use_tree_evaluator=False, **kwargs):
+        tree_evaluator = TreeEvaluator.from_booster(booster) if use_tree_evaluator else None
+        return cls(lambda: booster, tree_evaluator=tree_evaluator, **kwargs)
+
+    def load_boosters(self):
+        # Keep a single-threaded booster for small requests, so that multiple web workers do not oversubscribe the
+        # cores, and a multi-threaded booster for large batches
+        with self._lock:
+            if self.batch_booster is None:
+                booster = self.booster_loader()
+                single_thread_booster = booster.copy()
+                single_thread_booster.set_param({"nthread": 1})
+                booster.set_param({"nthread": self.batch_threads})
+                self.single_thread_booster = single_thread_booster
+                self.batch_booster = booster
+
+    def predict(self, features):
+        # Predict on a contiguous float32 array without DMatrix construction (inplace prediction is thread-safe)
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        if len(features) == 1 and self.tree_evaluator is not None:
+            return np.array([self.tree_evaluator.predict_row(features[0])], dtype=np.float32)
+        if self.batch_booster is None:
+            self.load_boosters()
+        booster = self.batch_booster if len(features) >= self.batch_threshold else self.single_thread_booster
+        return booster.inplace_predict(features, missing=np.nan)
+
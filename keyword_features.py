@@ -0,0 +1,105 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Keywords to extract property features from the agent description (see data_preprocessing.ipynb)
+KEYWORDS = {
+    "high_floor": ["high floor"],
+    "new": ["brand new", "new unit"],
+    "renovated": ["renovated", "renovation"],
+    "view": ["sea view", "seaview", "panoramic view", "unblocked view", "unblock view", "stunning view", "park view",
+             "breathtaking view", "river view", "pool view", "spectacular view", "city view", "greenery view",
+             "gorgeous view"],
+    "penthouse": ["penthouse"]
+}
+KEYWORD_FEATURES = list(KEYWORDS)
+
+
+# Create function to build a regular expression that matches any of the phrases, with common prefixes factored into a
+# trie (e.g. "renovat(?:ed|ion)"), so the regex engine tries each character of a description only once per trie level
+# instead of once per phrase
+def trie_pattern(phrases):
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for character in phrase:
+            node = node.setdefault(character, {})
+        node[""] = {}
+
+    def node_pattern(node):
+        alternatives = [re.escape(character) + node_pattern(child) for character, child in sorted(node.items())
+                        if character]
+        if not alternatives:
+            return ""
+        pattern = alternatives[0] if len(alternatives) == 1 else f"(?:{'|'.join(alternatives)})"
+        # A phrase ending here makes the rest optional (greedy, so the longest phrase is matched)
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return node_pattern(trie)
+
+
+# Create function to compile all keyword features into a single regular expression and a bit mask per phrase
+def compile_keywords(keywords):
+    phrases = sorted({phrase for feature_phrases in keywords.values() for phrase in feature_phrases})
+
+    # A matched phrase sets the bits of all features with a phrase it contains (e.g. "sea view" would also set a
+    # feature with the phrase "view"), since the contained phrase is not matched separately
+    phrase_masks = {phrase: sum(1 << bit for bit, feature_phrases in enumerate(keywords.values())
+                                if any(other in phrase for other in feature_phrases))
+                    for phrase in phrases}
+
+    # Matches do not overlap, so a phrase starting inside a matched phrase (e.g. "renovated" in "high floorenovated")
+    # is not matched; store where such phrases could start, so they can be checked after a match
+    phrase_overlaps = {phrase: [(start, other) for other in phrases for start in range(1, len(phrase))
+                                if len(phrase) - start < len(other) and phrase[start:] == other[:len(phrase) - start]
+                                and phrase_masks[other] & ~phrase_masks[phrase]]
+                       for phrase in phrases}
+    return re.compile(trie_pattern(phrases)), phrase_masks, phrase_overlaps
+
+
+KEYWORD_PATTERN, PHRASE_MASKS, PHRASE_OVERLAPS = compile_keywords(KEYWORDS)
+FEATURE_BITS = np.array([1 << bit for bit in range(len(KEYWORD_FEATURES))], dtype=np.int64)
+
+
+# Separate substring scans per phrase are faster for short phrase lists (about 6 µs vs. 27 µs per description for the
+# 20 phrases above); the single scan with the compiled matcher only pays off from about 40 phrases (see
+# benchmarks/keyword_matching.py)
+SINGLE_SCAN_MIN_PHRASES = 40
+use_single_scan = len(PHRASE_MASKS) >= SINGLE_SCAN_MIN_PHRASES
+
+
+# Create function to scan an agent description once and return the bit mask of its keyword features
+def keyword_mask(agent_description):
+    mask = 0
+    if isinstance(agent_description, str):
+        agent_description = agent_description.lower()
+        for match in KEYWORD_PATTERN.finditer(agent_description):
+            phrase = match.group()
+            mask |= PHRASE_MASKS[phrase]
+            for start, other in PHRASE_OVERLAPS[phrase]:
+                if agent_description.startswith(other, match.start() + start):
+                    mask |= PHRASE_MASKS[other]
+    return mask
+
+
+# Create function to extract the keyword features from a single agent description
+def extract_keyword_flags(agent_description):
+    if not use_single_scan:
+        agent_description = agent_description.lower() if isinstance(agent_description, str) else ""
+        return tuple(any(keyword in agent_description for keyword in keywords) for keywords in KEYWORDS.values())
+    mask = keyword_mask(agent_description)
+    return tuple(bool(mask & int(bit)) for bit in FEATURE_BITS)
+
+
+# Create function to extract the keyword features from a column of agent descriptions (pandas Series, NumPy array or
+# list)
+def extract_keyword_features(agent_descriptions):
+    agent_descriptions = pd.Series(agent_descriptions)
+    if not use_single_scan:
+        flags = np.array([extract_keyword_flags(description) for description in agent_descriptions], dtype=bool)
+        return pd.DataFrame(flags.reshape(len(agent_descriptions), len(KEYWORD_FEATURES)),
+                            index=agent_descriptions.index, columns=KEYWORD_FEATURES)
+    masks = np.fromiter((keyword_mask(description) for description in agent_descriptions), dtype=np.int64,
+                        count=len(agent_descriptions))
+    return pd.DataFrame((masks[:, None] & FEATURE_BITS) != 0, index=agent_descriptions.index,
+                        columns=KEYWORD_FEATURES)
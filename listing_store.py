@@ -0,0 +1,112 @@
+import datetime
+import glob
+import os
+import sqlite3
+import time
+import pandas as pd
+
+# Columns that identify a listing (same subset as drop_duplicates in data_preprocessing.ipynb)
+KEY_COLUMNS = ["name", "price", "size"]
+
+
+# Create function to make a run id from a timestamp (UTC with microseconds, so run ids sort chronologically)
+def make_run_id(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y%m%d%H%M%S%f")
+
+
+# Create a class for an append-only store of scraped listings: one Parquet file per scraped page in a directory per
+# run, and an SQLite index of the keys of all stored listings, so new listings are deduplicated as they are scraped
+# and a run only writes its new listings
+class ListingStore:
+    def __init__(self, root="data/listings"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(root, "index.sqlite"))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS listing_keys (name TEXT NOT NULL, price TEXT NOT NULL, "
+                                "size TEXT NOT NULL, run_id TEXT NOT NULL, PRIMARY KEY (name, price, size)) "
+                                "WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, first_page INTEGER, "
+                                "last_page INTEGER, started_at TEXT NOT NULL, finished_at TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS completed_pages (run_id TEXT NOT NULL, "
+                                "page INTEGER NOT NULL, n_listings INTEGER NOT NULL, n_new INTEGER NOT NULL, "
+                                "PRIMARY KEY (run_id, page))")
+        self.connection.commit()
+
+    def start_run(self, first_page, last_page, resume=True):
+        # Resume the latest unfinished run over the same pages, or start a new run
+        # Returns the run id and the pages that still need to be scraped
+        row = self.connection.execute("SELECT run_id FROM runs WHERE finished_at IS NULL AND first_page = ? AND "
+                                      "last_page = ? ORDER BY started_at DESC LIMIT 1",
+                                      (first_page, last_page)).fetchone()
+        if resume and row is not None:
+            run_id = row[0]
+            completed_pages = self.completed_pages(run_id)
+            print(f"Resuming run {run_id} ({len(completed_pages)} pages already completed)")
+        else:
+            run_id = make_run_id(time.time())
+            completed_pages = set()
+            with self.connection:
+                self.connection.execute("INSERT INTO runs (run_id, first_page, last_page, started_at) "
+                                        "VALUES (?, ?, ?, ?)", (run_id, first_page, last_page, self._now()))
+        return run_id, [page for page in range(first_page, last_page + 1) if page not in completed_pages]
+
+    def completed_pages(self, run_id):
+        return {page for page, in self.connection.execute("SELECT page FROM completed_pages WHERE run_id = ?",
+                                                          (run_id,))}
+
+    def add_page(self, run_id, page, listings):
+        # Store the listings of a scraped page that are not in the store yet and mark the page as completed
+        # The keys and the page are committed in one transaction after the Parquet file is written, so a page that is
+        # scraped again after a crash overwrites its file and is deduplicated the same way
+        # Returns the new listings
+        listings = listings.reset_index(drop=True)
+        with self.connection:
+            is_new = [self.connection.execute("INSERT OR IGNORE INTO listing_keys (name, price, size, run_id) "
+                                              "VALUES (?, ?, ?, ?)", (*map(str, key), run_id)).rowcount == 1
+                      for key in listings[KEY_COLUMNS].itertuples(index=False, name=None)]
+            new_listings = listings[is_new].reset_index(drop=True)
+            if len(new_listings) > 0:
+                self._write_partition(run_id, f"page_{page:05d}", new_listings)
+            self.connection.execute("INSERT OR REPLACE INTO completed_pages (run_id, page, n_listings, n_new) "
+                                    "VALUES (?, ?, ?, ?)", (run_id, page, len(listings), len(new_listings)))
+        return new_listings
+
+    def finish_run(self, run_id):
+        with self.connection:
+            self.connection.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (self._now(), run_id))
+
+    def import_csv(self, path):
+        # Seed the store with the listings of a csv file written by earlier versions of data_collection.py
+        # (the run id is the modification time of the file, so the imported listings sort before later runs)
+        run_id = make_run_id(os.path.getmtime(path))
+        listings = pd.read_csv(path, dtype=str, keep_default_na=False)
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO runs (run_id, started_at, finished_at) VALUES (?, ?, ?)",
+                                    (run_id, self._now(), self._now()))
+        return self.add_page(run_id, 0, listings)
+
+    def load_listings(self, columns=None):
+        return load_listings(self.root, columns=columns)
+
+    def _write_partition(self, run_id, name, listings):
+        # Write the Parquet file atomically, so readers never see a partially written file
+        run_dir = os.path.join(self.root, f"run={run_id}")
+        os.makedirs(run_dir, exist_ok=True)
+        path = os.path.join(run_dir, f"{name}.parquet")
+        temporary_path = f"{path}.tmp{os.getpid()}"
+        listings.to_parquet(temporary_path, index=False)
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def _now():
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+# Create function to load the stored listings in the order they were scraped (only the given columns, since Parquet
+# files are read column by column)
+def load_listings(root="data/listings", columns=None):
+    paths = sorted(glob.glob(os.path.join(root, "run=*", "*.parquet")))
+    if not paths:
+        return pd.DataFrame(columns=columns)
+    return pd.concat([pd.read_parquet(path, columns=columns) for path in paths], ignore_index=True)
@@ -0,0 +1,91 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import requests
+from location_cache import LocationCache, normalize_address, coordinates_key
+
+# Listing used for the load test (its location-based features are seeded into the cache, so no paid API calls are made)
+LISTING = {"size": 1000, "bedrooms": "2", "bathrooms": 2, "address": "1 Raffles Place", "property_type": "Condominium",
+           "furnishing": "Fully Furnished", "year": 2015, "meters_to_mrt": 300,
+           "agent_description": "Brand new high floor unit with unblocked city view."}
+LATITUDE, LONGITUDE = 1.2841, 103.8515
+SCHOOL_LATITUDE, SCHOOL_LONGITUDE = 1.2874, 103.8475
+
+
+# Create function to seed the location cache with the features of the load test listing
+def seed_location_cache(path):
+    cache = LocationCache(path)
+    cache.set("geocode", normalize_address(LISTING["address"]), [LATITUDE, LONGITUDE])
+    cache.set("meters_to_cbd", coordinates_key(LATITUDE, LONGITUDE), 150)
+    cache.set("school_location", coordinates_key(LATITUDE, LONGITUDE), [SCHOOL_LATITUDE, SCHOOL_LONGITUDE])
+    cache.set("meters_to_school", coordinates_key(LATITUDE, LONGITUDE, SCHOOL_LATITUDE, SCHOOL_LONGITUDE), 600)
+    cache.set("restaurants_rating", coordinates_key(LATITUDE, LONGITUDE), 4.1)
+
+
+# Create function to start the preforking server with the given number of workers and wait until it accepts requests
+def start_server(workers, port, cache_path):
+    environment = dict(os.environ, location_cache_path=cache_path)
+    process = subprocess.Popen([sys.executable, "serve.py", "--workers", str(workers), "--port", str(port),
+                                "--host", "127.0.0.1"], env=environment, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.post(f"http://127.0.0.1:{port}/api/predict", json=[LISTING], timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not start within 60 seconds")
+
+
+# Create function to send requests from concurrent clients for a fixed duration and return the requests per second
+def run_load(port, clients, duration):
+    n_requests = [0] * clients
+    n_errors = [0] * clients
+    stop_time = time.monotonic() + duration
+
+    def client(index):
+        # Each client reuses one keep-alive connection
+        with requests.Session() as session:
+            while time.monotonic() < stop_time:
+                response = session.post(f"http://127.0.0.1:{port}/api/predict", json=[LISTING], timeout=10)
+                if response.status_code == 200 and response.json()["predictions"][0]["error"] is None:
+                    n_requests[index] += 1
+                else:
+                    n_errors[index] += 1
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    start_time = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start_time
+    return sum(n_requests) / elapsed, sum(n_errors)
+
+
+# Measure the requests per second for different numbers of workers
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the preforking server with different numbers of workers.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=16, help="Number of concurrent clients.")
+    parser.add_argument("--duration", type=float, default=10, help="Duration per run in seconds.")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "location_cache.sqlite")
+        seed_location_cache(cache_path)
+        print(f"{'Workers':>7} {'Requests/s':>11} {'Errors':>7}")
+        for workers in args.workers:
+            server = start_server(workers, args.port, cache_path)
+            try:
+                requests_per_second, n_errors = run_load(args.port, args.clients, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{workers:>7} {requests_per_second:>11.1f} {n_errors:>7}")
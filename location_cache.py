@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from metrics import location_cache_lookups
+
+logger = logging.getLogger(__name__)
+
+# Value returned by LocationCache.get for keys that are not cached (a cached value can be None, e.g. for a negative
+# result like an address that cannot be geocoded)
+CACHE_MISS = object()
+
+
+# Create function to normalize an address so that trivially different spellings share one cache entry
+def normalize_address(address):
+    # Lowercase, collapse whitespace and strip surrounding whitespace and punctuation
+    address = re.sub(r"\s+", " ", address.lower())
+    return address.strip(" ,.;")
+
+
+# Create function to build a cache key from latitude and longitude
+def coordinates_key(*coordinates, precision=4):
+    # Round coordinates to 4 decimals (about 11 meters) so that repeated geocodes of the same address share one entry
+    return ",".join(f"{coordinate:.{precision}f}" for coordinate in coordinates)
+
+
+# Create a class for a two-level cache with an in-process LRU front and an SQLite back store shared across processes
+class LocationCache:
+    def __init__(self, path, ttl_seconds=30 * 24 * 3600, max_memory_entries=10000, purge_interval_seconds=24 * 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+
+        # Expired entries are deleted from the back store on the first write of a process and then at most once per
+        # purge interval, so the SQLite file does not grow without bound
+        self.purge_interval_seconds = purge_interval_seconds
+        self._last_purge = None
+
+        # In-process LRU front that maps (namespace, key) to (value, expiry timestamp)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        # SQLite connections cannot be shared across threads or forked processes, so keep one per thread and process
+        self._local = threading.local()
+
+        # Hit and miss counters (also exported as location_cache_lookups_total on the /metrics endpoint)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        # Open a new connection if this thread has none yet or the process was forked since it was opened
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            # Write-ahead logging lets multiple worker processes read while one of them writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS location_cache (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                               "value TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))")
+            connection.commit()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _remember(self, namespace, key, value, expires_at):
+        # Store the entry in the LRU front and evict the least recently used entries if it is full
+        with self._lock:
+            self._memory[(namespace, key)] = (value, expires_at)
+            self._memory.move_to_end((namespace, key))
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, namespace, key, default=None):
+        # Returns default if the key is not cached (pass CACHE_MISS to tell a miss from a cached None)
+        now = time.time()
+
+        # Look up the LRU front first
+        with self._lock:
+            entry = self._memory.get((namespace, key))
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end((namespace, key))
+                    self.memory_hits += 1
+                    location_cache_lookups.inc(result="memory_hit")
+                    return value
+                # Drop expired entry
+                del self._memory[(namespace, key)]
+
+        # Fall back to the SQLite back store
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM location_cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        except sqlite3.Error as error:
+            logger.warning("Location cache read failed", extra={"error": str(error), "namespace": namespace})
+            row = None
+        if row is not None and row[1] > now:
+            value = json.loads(row[0])
+            self._remember(namespace, key, value, row[1])
+            with self._lock:
+                self.disk_hits += 1
+            location_cache_lookups.inc(result="disk_hit")
+            return value
+
+        with self._lock:
+            self.misses += 1
+        location_cache_lookups.inc(result="miss")
+        return default
+
+    def set(self, namespace, key, value):
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(namespace, key, value, expires_at)
+        try:
+            connection = self._connection()
+            connection.execute("INSERT OR REPLACE INTO location_cache (namespace, key, value, expires_at) "
+                               "VALUES (?, ?, ?, ?)", (namespace, key, json.dumps(value), expires_at))
+            connection.commit()
+            if self._last_purge is None or time.monotonic() - self._last_purge >= self.purge_interval_seconds:
+                self._last_purge = time.monotonic()
+                self.purge_expired()
+        except sqlite3.Error as error:
+            logger.warning("Location cache write failed", extra={"error": str(error), "namespace": namespace})
+
+    def purge_expired(self):
+        # Delete expired entries from the back store
+        connection = self._connection()
+        connection.execute("DELETE FROM location_cache WHERE expires_at <= ?", (time.time(),))
+        connection.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory)
+            }
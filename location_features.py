@@ -0,0 +1,527 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from feature_preparation import DEGRADED_LOCATION_VALUES
+from http_utils import CircuitBreaker, CircuitOpenError, DeadlineExceeded, HostRateLimiter, get_with_retries
+from metrics import (location_fallbacks, maps_api_errors, maps_api_latency, maps_api_rejected, maps_api_requests,
+                     maps_api_spend, timed)
+from location_cache import CACHE_MISS, LocationCache, normalize_address, coordinates_key
+from poi_index import POIIndex
+from request_context import deadline_var, remaining_time, submit_with_context
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Get Google Maps API key from .env
+google_maps_api_key = os.getenv("google_maps_api_key")
+
+# Get the base URL of the Google Maps API (can be set to a local stub server, see maps_stub_server.py)
+google_maps_base_url = os.getenv("google_maps_base_url", "https://maps.googleapis.com/maps/api").rstrip("/")
+
+# Create a pooled HTTP session to reuse keep-alive connections to the Google Maps API across calls and requests
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# Limit the rate of Google Maps API requests (allowing bursts of up to one second of requests) and retry temporary
+# errors (the enrichment pipeline replaces both with its command line options)
+maps_requests_per_second = float(os.getenv("google_maps_requests_per_second", "50"))
+maps_rate_limiter = HostRateLimiter(maps_requests_per_second, burst=max(1, maps_requests_per_second))
+maps_max_retries = int(os.getenv("google_maps_max_retries", "2"))
+
+# Time out each Google Maps API request, so a hanging upstream cannot hold a worker (requests made while handling a web
+# request are also cut short at the deadline of the request)
+maps_timeout = float(os.getenv("google_maps_timeout_seconds", "2"))
+
+# Seconds to wait for a location lookup after the deadline of the request (see lookup_timeout)
+LOOKUP_GRACE_SECONDS = 0.02
+
+# Create a cache for location-based features to avoid repeated paid Google Maps API calls for the same location
+location_cache = LocationCache(path=os.getenv("location_cache_path", "cache/location_cache.sqlite"),
+                               ttl_seconds=int(os.getenv("location_cache_ttl_days", "30")) * 24 * 3600)
+
+# Load a POI snapshot of schools and restaurants (if configured) to compute the nearest school and restaurants rating
+# from a local spatial index instead of Places Nearby Search API calls
+poi_snapshot_path = os.getenv("poi_snapshot_path")
+poi_index = POIIndex.from_snapshot(poi_snapshot_path) if poi_snapshot_path else None
+
+# Number of Google Maps API calls to enrich an address that is not cached (geocoding, meters to CBD and meters to the
+# closest school, plus the closest school and the restaurants rating without the POI index)
+maps_calls_per_address = 3 if poi_index is not None else 5
+
+# Create a thread pool to run independent Google Maps API calls concurrently
+enrichment_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="enrichment")
+
+# Cost per Google Maps API call in $ by API (for the estimated spend in the /metrics endpoint)
+MAPS_API_COSTS = {
+    "findplacefromtext": 0.017,
+    "geocode": 0.005,
+    "distancematrix": 0.005,
+    "nearbysearch": 0.032
+}
+
+
+# Create a circuit breaker per Google Maps API, so lookups fail fast (and fall back to imputed values) while an API is
+# failing or timing out
+maps_circuit_breakers = {
+    api: CircuitBreaker(api, failure_threshold=int(os.getenv("google_maps_breaker_failures", "5")),
+                        reset_timeout=float(os.getenv("google_maps_breaker_reset_seconds", "30")))
+    for api in MAPS_API_COSTS
+}
+
+
+# Create function to replace the circuit breakers of the app for batch jobs (enrichment pipeline and bulk scoring)
+# The breakers fail fast to keep web requests within their latency budget, but in a batch job a few failures in a row
+# would fail every following lookup, so the replacements only open after failure_threshold failures (never if 0)
+def use_batch_circuit_breakers(failure_threshold=0):
+    global maps_circuit_breakers
+    maps_circuit_breakers = {api: CircuitBreaker(api, failure_threshold=failure_threshold or float("inf"))
+                             for api in MAPS_API_COSTS}
+
+
+# Create function to send a Google Maps API request with rate limiting, retries, a timeout and a circuit breaker and
+# return the JSON response
+# Records the number of requests and estimated spend (per attempt, since every retry is a billed request), failures and
+# latency (including retries) per API
+def maps_get(url, params):
+    # Name of the API, e.g. "geocode" for .../geocode/json
+    api = url.rsplit("/", 2)[-2]
+    deadline = deadline_var.get()
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded(f"Deadline exceeded before requesting the {api} API")
+    circuit_breaker = maps_circuit_breakers[api]
+    if not circuit_breaker.allow():
+        maps_api_rejected.inc(api=api)
+        raise CircuitOpenError(f"Circuit breaker of the {api} API is open")
+
+    # Create function to count each attempt (including retries) as a request
+    def count_attempt():
+        maps_api_requests.inc(api=api)
+        maps_api_spend.inc(MAPS_API_COSTS.get(api, 0), api=api)
+
+    start_time = time.perf_counter()
+    try:
+        try:
+            response = get_with_retries(session, url, rate_limiter=maps_rate_limiter, max_retries=maps_max_retries,
+                                        backoff=0.5, timeout=maps_timeout, deadline=deadline, on_attempt=count_attempt,
+                                        params=params)
+        except DeadlineExceeded:
+            # Running out of time says nothing about the health of the API
+            circuit_breaker.release()
+            raise
+        except requests.RequestException:
+            circuit_breaker.record_failure()
+            raise
+        except Exception:
+            circuit_breaker.release()
+            raise
+        try:
+            data = response.json() if response.status_code < 400 else {}
+        except ValueError:
+            circuit_breaker.record_failure()
+            raise
+        # Server errors and exhausted quota (HTTP 429, or status OVER_QUERY_LIMIT in a JSON body with HTTP 200) count
+        # as failures, so the breaker opens instead of sending more requests that are refused
+        if response.status_code >= 500 or response.status_code == 429 or data.get("status") == "OVER_QUERY_LIMIT":
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+        response.raise_for_status()
+        # Fail the lookup (like an HTTP error), so it falls back to imputed values and is not cached
+        if data.get("status") == "OVER_QUERY_LIMIT":
+            raise requests.HTTPError(f"Over the query limit of the {api} API", response=response)
+    except (requests.RequestException, ValueError):
+        maps_api_errors.inc(api=api)
+        raise
+    finally:
+        maps_api_latency.observe(time.perf_counter() - start_time, api=api)
+    return data
+
+
+# Create function to get the first element of a Distance Matrix API response (an empty dict if it has none)
+def first_distance_element(data):
+    rows = data.get("rows") or [{}]
+    elements = rows[0].get("elements") or [{}]
+    return elements[0]
+
+
+# Create function to check if a Distance Matrix API response has a distance for its first origin and destination
+def distance_element_found(data):
+    element = first_distance_element(data)
+    return element.get("status") == "OK" and "distance" in element
+
+
+# Create functions to check if a response is a definitive negative result (nothing found or no route), which is cached
+# like a found result with the value None, unlike errors such as OVER_QUERY_LIMIT that may succeed later
+def nothing_found(data):
+    return data.get("status") == "ZERO_RESULTS" or (data.get("status") == "OK" and not data.get("results"))
+
+
+def no_distance_found(data):
+    return data.get("status") == "OK" and first_distance_element(data).get("status") in ("ZERO_RESULTS", "NOT_FOUND")
+
+
+# Create function to get the address of a property from its name (for listings without an address)
+@timed("missing_address")
+def get_missing_address(name):
+    # Base URL for the Google Maps Find Place API
+    base_url = f"{google_maps_base_url}/place/findplacefromtext/json"
+
+    # Parameters for the Find Place API request
+    params = {
+        "input": f"{name}, Singapore",
+        "inputtype": "textquery",
+        "fields": "formatted_address",
+        "key": google_maps_api_key
+    }
+
+    # Send Find Place API request and store the response
+    data = maps_get(base_url, params)
+
+    # Check if request was successful
+    if data.get("status") == "OK":
+        # Extract address from the response
+        return data["candidates"][0]["formatted_address"]
+    # If no address was found, give notification and return a missing value
+    logger.warning("No address found", extra={"property_name": name})
+    return np.nan
+
+
+# Create function to get latitude and longitude from an address
+@timed("geocode")
+def get_latitude_longitude(address):
+    # Return cached latitude and longitude if the address was geocoded before
+    cache_key = normalize_address(address)
+    cached = location_cache.get("geocode", cache_key, default=CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return (np.nan, np.nan) if cached is None else (cached[0], cached[1])
+
+    # Base URL for the Google Maps Geocoding API
+    base_url = f"{google_maps_base_url}/geocode/json"
+
+    # Parameters for the Geocoding API request
+    params = {
+        "address": f"{address}, Singapore",
+        "key": google_maps_api_key
+    }
+
+    # Send Geocoding API request and store the response
+    data = maps_get(base_url, params)
+
+    # Check if request was successful
+    if data.get("status") == "OK":
+        # Extract latitude and longitude from the response
+        location = data["results"][0]["geometry"]["location"]
+        latitude = location["lat"]
+        longitude = location["lng"]
+        location_cache.set("geocode", cache_key, [latitude, longitude])
+    else:
+        # Assign missing values and log a warning if the request failed
+        latitude = np.nan
+        longitude = np.nan
+        if nothing_found(data):
+            location_cache.set("geocode", cache_key, None)
+        logger.warning("Geocoding request failed", extra={"address": address, "status": data.get("status")})
+
+    # Return latitude and longitude
+    return latitude, longitude
+
+
+# Create function to get meters to central business district from property latitude and longitude
+@timed("meters_to_cbd")
+def get_meters_to_cbd(property_latitude, property_longitude):
+    # Return a missing value if latitude or longitude is missing
+    if np.isnan(property_latitude) or np.isnan(property_longitude):
+        logger.debug("Property latitude or longitude missing. Assigning missing value for meters to CBD.")
+        return np.nan
+
+    # Return cached meters to CBD if they were fetched for this location before
+    cache_key = coordinates_key(property_latitude, property_longitude)
+    cached = location_cache.get("meters_to_cbd", cache_key, default=CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return np.nan if cached is None else cached
+
+    # Latitude and longitude of central business district (i.e. Raffles Place)
+    cbd_latitude = 1.284184
+    cbd_longitude = 103.85151
+
+    # Base URL for the Google Maps Distance Matrix API
+    base_url = f"{google_maps_base_url}/distancematrix/json"
+
+    # Parameters for the Distance Matrix API request
+    params = {
+        "origins": f"{property_latitude},{property_longitude}",
+        "destinations": f"{cbd_latitude},{cbd_longitude}",
+        "key": google_maps_api_key
+    }
+
+    # Send the Distance Matrix API request and store the response
+    data = maps_get(base_url, params)
+
+    # Process the response to get the distance (an element without a route, e.g. status "ZERO_RESULTS", has no distance)
+    if distance_element_found(data):
+        meters_to_cbd = data["rows"][0]["elements"][0]["distance"]["value"]
+        logger.debug("Distance between property and CBD", extra={"meters_to_cbd": meters_to_cbd})
+        location_cache.set("meters_to_cbd", cache_key, meters_to_cbd)
+    else:
+        if no_distance_found(data):
+            location_cache.set("meters_to_cbd", cache_key, None)
+        logger.warning("No distance information available for meters to CBD.")
+        return np.nan
+    return meters_to_cbd
+
+
+# Create function to get latitude and longitude of the closest school from property latitude and longitude
+@timed("school_location")
+def get_school_location(property_latitude, property_longitude):
+    # Return missing value if latitude or longitude is missing
+    if np.isnan(property_latitude) or np.isnan(property_longitude):
+        logger.debug("Property latitude or longitude missing. Assigning missing values for school latitude and "
+                     "longitude.")
+        return np.nan, np.nan
+
+    # Return cached school location if it was fetched for this location before
+    cache_key = coordinates_key(property_latitude, property_longitude)
+    cached = location_cache.get("school_location", cache_key, default=CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return (np.nan, np.nan) if cached is None else (cached[0], cached[1])
+
+    # Base URL for the Google Maps Places Nearby Search API
+    base_url = f"{google_maps_base_url}/place/nearbysearch/json"
+
+    # Parameters for the Nearby Search API request
+    params = {
+        "location": f"{property_latitude},{property_longitude}",
+        "radius": 1000,  # Search radius in meters
+        "type": "school",
+        "key": google_maps_api_key
+    }
+
+    # Send the Nearby Search API request and store the response
+    data = maps_get(base_url, params)
+
+    # Extract latitude and longitude of the closest school from the response
+    if "results" in data and data["results"]:
+        closest_school = data["results"][0]
+        school_name = closest_school["name"]
+        school_location = closest_school["geometry"]["location"]
+        school_latitude = school_location["lat"]
+        school_longitude = school_location["lng"]
+        logger.debug("Closest school", extra={"school_name": school_name, "school_latitude": school_latitude,
+                                               "school_longitude": school_longitude})
+        location_cache.set("school_location", cache_key, [school_latitude, school_longitude])
+    else:
+        school_latitude = np.nan
+        school_longitude = np.nan
+        if nothing_found(data):
+            location_cache.set("school_location", cache_key, None)
+        logger.info("No schools found nearby.")
+    return school_latitude, school_longitude
+
+
+# Create function to get meters to the closest school
+@timed("meters_to_school")
+def get_meters_to_school(property_latitude, property_longitude, school_latitude, school_longitude):
+    # Return missing value if property latitude or longitude is missing
+    if np.isnan(property_latitude) or np.isnan(property_longitude):
+        logger.debug("Property latitude or longitude missing. Assigning missing value for meters to school.")
+        return np.nan
+
+    # Return missing value if the school location is missing
+    if np.isnan(school_latitude) or np.isnan(school_longitude):
+        logger.debug("School latitude or longitude missing. Assigning missing value for meters to school.")
+        return np.nan
+
+    # Return cached meters to school if they were fetched for this property and school before
+    cache_key = coordinates_key(property_latitude, property_longitude, school_latitude, school_longitude)
+    cached = location_cache.get("meters_to_school", cache_key, default=CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return np.nan if cached is None else cached
+
+    # Base URL for the Google Maps Distance Matrix API
+    base_url = f"{google_maps_base_url}/distancematrix/json"
+
+    # Parameters for the Distance Matrix API request
+    params = {
+        "origins": f"{property_latitude},{property_longitude}",
+        "destinations": f"{school_latitude},{school_longitude}",
+        "key": google_maps_api_key
+    }
+
+    # Send the Distance Matrix API request and store the response
+    data = maps_get(base_url, params)
+
+    # Process the response to get the distance (an element without a route, e.g. status "ZERO_RESULTS", has no distance)
+    if distance_element_found(data):
+        meters_to_school = data["rows"][0]["elements"][0]["distance"]["value"]
+        logger.debug("Distance between property and closest school", extra={"meters_to_school": meters_to_school})
+        location_cache.set("meters_to_school", cache_key, meters_to_school)
+    else:
+        if no_distance_found(data):
+            location_cache.set("meters_to_school", cache_key, None)
+        logger.warning("No distance information available. Assigning missing value for meters to school.")
+        return np.nan
+    return meters_to_school
+
+
+# Create function to get the average Google Maps rating of nearby restaurants
+@timed("restaurants_rating")
+def get_restaurants_rating(property_latitude, property_longitude):
+    # Return missing value if latitude or longitude is missing
+    if np.isnan(property_latitude) or np.isnan(property_longitude):
+        logger.debug("Property latitude or longitude missing. Assigning missing value for restaurants rating.")
+        return np.nan
+
+    # Return cached restaurants rating if it was fetched for this location before
+    cache_key = coordinates_key(property_latitude, property_longitude)
+    cached = location_cache.get("restaurants_rating", cache_key, default=CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return np.nan if cached is None else cached
+
+    # Base URL for the Google Maps Places Nearby Search API
+    base_url = f"{google_maps_base_url}/place/nearbysearch/json"
+
+    # Parameters for the Nearby Search API request
+    params = {
+        "location": f"{property_latitude},{property_longitude}",
+        "radius": 1000,  # Search radius in meters
+        "type": "restaurant",
+        "key": google_maps_api_key
+    }
+
+    # Send the Nearby Search API request and store the response
+    data = maps_get(base_url, params)
+
+    # Process the response to get the average restaurant rating
+    if "results" in data and data["results"]:
+        # Extract restaurant ratings as a list, assigning np.nan for missing ratings
+        rating_list = [restaurant.get("rating", np.nan) for restaurant in data.get("results")]
+        # Calculate average rating, ignoring np.nan values
+        average_rating = np.nanmean(rating_list)
+        logger.debug("Restaurants rating", extra={
+            "n_restaurants": len(rating_list),
+            "n_ratings": len([rating for rating in rating_list if not np.isnan(rating)]),
+            "average_rating": round(float(average_rating), 2)
+        })
+        location_cache.set("restaurants_rating", cache_key, float(average_rating))
+    else:
+        if nothing_found(data):
+            location_cache.set("restaurants_rating", cache_key, None)
+        logger.info("No restaurants found nearby. Assigning missing value for restaurants rating.")
+        return np.nan
+    return average_rating
+
+
+# Create function to get latitude and longitude of the closest school and the meters to it
+def get_school_features(property_latitude, property_longitude):
+    # Meters to school depends on the school location, so both calls run one after another
+    school_latitude, school_longitude = get_school_location(property_latitude, property_longitude)
+    meters_to_school = get_meters_to_school(property_latitude, property_longitude, school_latitude, school_longitude)
+    return school_latitude, school_longitude, meters_to_school
+
+
+# Create function to get how long to wait for a location lookup: until the deadline of the request plus a short grace
+# period, so lookups that are answered from the cache still finish after the deadline (None without a deadline)
+def lookup_timeout():
+    remaining = remaining_time()
+    return None if remaining is None else remaining + LOOKUP_GRACE_SECONDS
+
+
+# Create function to wait for a location lookup until the deadline of the request
+# Returns None if the lookup failed for any reason (including an unexpected response that could not be parsed) or did
+# not finish in time, so the caller falls back to imputed values
+def wait_for_lookup(future, lookup):
+    try:
+        return future.result(timeout=lookup_timeout())
+    except (requests.RequestException, FutureTimeoutError) as error:
+        location_fallbacks.inc(lookup=lookup)
+        logger.warning("Location lookup unavailable, using imputed values", extra={"lookup": lookup,
+                                                                                   "error": repr(error)})
+        return None
+    except Exception:
+        location_fallbacks.inc(lookup=lookup)
+        logger.warning("Location lookup failed, using imputed values", exc_info=True, extra={"lookup": lookup})
+        return None
+
+
+# Create function to get the location-based features for degraded mode (all lookups failed)
+def degraded_location_features():
+    return {**DEGRADED_LOCATION_VALUES, "degraded": True}
+
+
+# Create function to get all location-based features of an address
+# Each lookup waits at most until the deadline of the request; features that cannot be looked up in time fall back to
+# imputed values and the result is flagged as degraded
+@timed("location_features")
+def get_location_features(address):
+    # Geocode the address first, since all other features depend on its latitude and longitude (Cost: 0.005$)
+    coordinates = wait_for_lookup(submit_with_context(enrichment_executor, get_latitude_longitude, address), "geocode")
+    if coordinates is None:
+        return degraded_location_features()
+    latitude, longitude = coordinates
+
+    # Use the local POI index to find the closest school and the restaurants rating if available (Cost: 0.01$ per
+    # input in total)
+    # The meters to school are still the Distance Matrix distance (not the straight-line distance of the index), since
+    # the model was trained on it
+    if poi_index is not None:
+        school_latitudes, school_longitudes, _ = poi_index.nearest_school([latitude], [longitude])
+        cbd_future = submit_with_context(enrichment_executor, get_meters_to_cbd, latitude, longitude)  # Cost: 0.005$
+        school_future = submit_with_context(enrichment_executor, get_meters_to_school, latitude, longitude,
+                                            school_latitudes[0], school_longitudes[0])  # Cost: 0.005$
+        meters_to_cbd = wait_for_lookup(cbd_future, "meters_to_cbd")
+        meters_to_school = wait_for_lookup(school_future, "meters_to_school")
+        restaurants_rating = poi_index.restaurants_rating([latitude], [longitude])
+        return {
+            "latitude": latitude,
+            "longitude": longitude,
+            "meters_to_cbd": DEGRADED_LOCATION_VALUES["meters_to_cbd"] if meters_to_cbd is None else meters_to_cbd,
+            "school_latitude": school_latitudes[0],
+            "school_longitude": school_longitudes[0],
+            "meters_to_school": (DEGRADED_LOCATION_VALUES["meters_to_school"] if meters_to_school is None
+                                 else meters_to_school),
+            "restaurants_rating": restaurants_rating[0],
+            "degraded": meters_to_cbd is None or meters_to_school is None
+        }
+
+    # Run the independent Google Maps API calls concurrently (in the context of the request, so they keep its deadline
+    # and their logs carry its id)
+    cbd_future = submit_with_context(enrichment_executor, get_meters_to_cbd, latitude, longitude)  # Cost: 0.005$
+    school_future = submit_with_context(enrichment_executor, get_school_features, latitude,
+                                        longitude)  # Cost: 0.032$ + 0.005$
+    restaurants_future = submit_with_context(enrichment_executor, get_restaurants_rating, latitude,
+                                             longitude)  # Cost: 0.032$
+
+    # Wait for all calls to finish or the deadline to pass
+    meters_to_cbd = wait_for_lookup(cbd_future, "meters_to_cbd")
+    school_features = wait_for_lookup(school_future, "school")
+    restaurants_rating = wait_for_lookup(restaurants_future, "restaurants_rating")
+    degraded = meters_to_cbd is None or school_features is None or restaurants_rating is None
+
+    # Fall back to imputed values for the features that could not be looked up
+    if meters_to_cbd is None:
+        meters_to_cbd = DEGRADED_LOCATION_VALUES["meters_to_cbd"]
+    if school_features is None:
+        school_features = (DEGRADED_LOCATION_VALUES["school_latitude"], DEGRADED_LOCATION_VALUES["school_longitude"],
+                           DEGRADED_LOCATION_VALUES["meters_to_school"])
+    school_latitude, school_longitude, meters_to_school = school_features
+    if restaurants_rating is None:
+        restaurants_rating = DEGRADED_LOCATION_VALUES["restaurants_rating"]
+
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "meters_to_cbd": meters_to_cbd,
+        "school_latitude": school_latitude,
+        "school_longitude": school_longitude,
+        "meters_to_school": meters_to_school,
+        "restaurants_rating": restaurants_rating,
+        "degraded": degraded
+    }
@@ -0,0 +1,174 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Bounding box of Singapore for the generated coordinates
+LATITUDE_RANGE = (1.25, 1.45)
+LONGITUDE_RANGE = (103.65, 103.98)
+
+# Path prefix of the Google Maps API (set google_maps_base_url to http://<host>:<port>/maps/api)
+API_PREFIX = "/maps/api"
+
+
+# Create function to map a text to a deterministic number between 0 and 1, so the same input always gets the same
+# response
+def text_to_unit(text):
+    return int(hashlib.sha256(text.encode()).hexdigest()[:12], 16) / 16 ** 12
+
+
+# Create function to calculate the great-circle distance in meters between two points
+def haversine_meters(latitude_1, longitude_1, latitude_2, longitude_2):
+    latitude_1, longitude_1, latitude_2, longitude_2 = map(math.radians, [latitude_1, longitude_1, latitude_2,
+                                                                            longitude_2])
+    a = (math.sin((latitude_2 - latitude_1) / 2) ** 2
+         + math.cos(latitude_1) * math.cos(latitude_2) * math.sin((longitude_2 - longitude_1) / 2) ** 2)
+    return 2 * 6371008.8 * math.asin(math.sqrt(a))
+
+
+# Create functions that return deterministic responses in the format of the Google Maps APIs
+def find_place(params):
+    name = params["input"].removesuffix(", Singapore")
+    # About 20% of the property names are not found
+    if text_to_unit("find_place" + name) < 0.2:
+        return {"status": "ZERO_RESULTS", "candidates": []}
+    return {"status": "OK", "candidates": [{"formatted_address": f"{name} Road, Singapore"}]}
+
+
+def geocode(params):
+    address = params["address"].lower()
+    # About 2% of the addresses cannot be geocoded
+    if text_to_unit("geocode" + address) < 0.02:
+        return {"status": "ZERO_RESULTS", "results": []}
+    latitude = LATITUDE_RANGE[0] + text_to_unit("latitude" + address) * (LATITUDE_RANGE[1] - LATITUDE_RANGE[0])
+    longitude = LONGITUDE_RANGE[0] + text_to_unit("longitude" + address) * (LONGITUDE_RANGE[1] - LONGITUDE_RANGE[0])
+    return {"status": "OK", "results": [{"geometry": {"location": {"lat": round(latitude, 7),
+                                                                    "lng": round(longitude, 7)}}}]}
+
+
+def distance_matrix(params):
+    origin = [float(value) for value in params["origins"].split(",")]
+    destination = [float(value) for value in params["destinations"].split(",")]
+    # Road distances are longer than great-circle distances
+    meters = round(1.3 * haversine_meters(*origin, *destination))
+    return {"status": "OK", "rows": [{"elements": [{"status": "OK", "distance": {"value": meters}}]}]}
+
+
+def nearby_search(params):
+    location = params["location"]
+    latitude, longitude = [float(value) for value in location.split(",")]
+    if params["type"] == "school":
+        # About 10% of the properties have no school within the radius
+        if text_to_unit("school" + location) < 0.1:
+            return {"status": "ZERO_RESULTS", "results": []}
+        offset = 0.008 * text_to_unit("school_offset" + location)
+        return {"status": "OK", "results": [{"name": f"School {location}",
+                                             "geometry": {"location": {"lat": round(latitude + offset, 7),
+                                                                       "lng": round(longitude - offset, 7)}}}]}
+    # Up to 20 restaurants, some of them without rating
+    n_restaurants = int(21 * text_to_unit("restaurants" + location))
+    restaurants = []
+    for index in range(n_restaurants):
+        unit = text_to_unit(f"rating{index}" + location)
+        offset = 0.008 * (text_to_unit(f"restaurant_offset{index}" + location) - 0.5)
+        restaurant = {"name": f"Restaurant {index}", "geometry": {"location": {"lat": round(latitude + offset, 7),
+                                                                                "lng": round(longitude + offset, 7)}}}
+        if unit >= 0.1:
+            restaurant["rating"] = round(3 + 2 * unit, 1)
+        restaurants.append(restaurant)
+    return {"status": "OK" if restaurants else "ZERO_RESULTS", "results": restaurants}
+
+
+ENDPOINTS = {
+    "/place/findplacefromtext/json": find_place,
+    "/geocode/json": geocode,
+    "/distancematrix/json": distance_matrix,
+    "/place/nearbysearch/json": nearby_search
+}
+
+
+# Create a request handler that serves the stub endpoints with a configurable latency and failure rate
+class MapsStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            # Number of requests per endpoint, e.g. to check that duplicate inputs are fetched once
+            with self.server.lock:
+                return self.send_json(200, dict(self.server.request_counts))
+        endpoint = url.path.removeprefix(API_PREFIX)
+        if endpoint not in ENDPOINTS:
+            return self.send_json(404, {"status": "NOT_FOUND"})
+        with self.server.lock:
+            self.server.request_counts[endpoint] += 1
+
+        if self.server.latency:
+            time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.server.failure_rate:
+            return self.send_json(503, {"status": "UNKNOWN_ERROR"})
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.send_json(200, ENDPOINTS[endpoint](params))
+
+    def send_json(self, status_code, data):
+        body = json.dumps(data).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting (e.g. its timeout is shorter than the latency of the stub)
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+# Create a class for the stub server (latency in seconds per request, failure rate between 0 and 1)
+class MapsStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, verbose=False):
+        super().__init__((host, port), MapsStubHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.request_counts = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+
+# Create function to start a stub server in a background thread (e.g. for tests and benchmarks)
+def start_stub_server(**kwargs):
+    server = MapsStubServer(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Run a stub server for the Google Maps APIs used by the app and the enrichment pipeline (no API key or cost)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve deterministic stub responses for the Google Maps APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean latency per request in seconds.")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with status 503.")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    args = parser.parse_args()
+
+    server = MapsStubServer(args.host, args.port, latency=args.latency, failure_rate=args.failure_rate,
+                            verbose=args.verbose)
+    print(f"Serving the Google Maps stub on {server.base_url} (set google_maps_base_url to this URL)")
+    server.serve_forever()
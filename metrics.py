@@ -0,0 +1,262 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Directory where each worker process saves its metrics, so /metrics can report the sum over all workers of the
+# preforking server (serve.py sets it; without it, /metrics reports the metrics of the current process)
+metrics_dir = os.getenv("metrics_dir")
+
+# Number of seconds between two saves of the metrics of a worker (the /metrics endpoint lags by at most this long)
+SAVE_INTERVAL = 1.0
+
+# File in the metrics directory with the sum of the metrics of all exited workers (the master folds the file of each
+# worker it reaps into it, so the number of files stays bounded and a reused PID cannot overwrite earlier counts)
+EXITED_FILE_NAME = "exited.json"
+
+
+# Create function to format the labels of a sample in the Prometheus text format
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for name, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+# Create a class for a counter with labels (e.g. the number of Google Maps API calls per API)
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.registry = registry
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self.registry.lock:
+            values = self.registry.values[self.name]
+            values[key] = values.get(key, 0) + amount
+            self.registry.changed = True
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def render(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(zip(self.label_names, key))} {value:g}"
+
+
+# Create a class for a histogram with labels (e.g. the latency per stage of the prediction path)
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, registry, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.registry = registry
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        # Each value is a list of counts per bucket (not cumulative), followed by the sum and the count
+        with self.registry.lock:
+            values = self.registry.values[self.name]
+            if key not in values:
+                values[key] = [0] * len(self.buckets) + [0.0, 0]
+            counts = values[key]
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+            self.registry.changed = True
+
+    @staticmethod
+    def merge(value, other):
+        return [count + other_count for count, other_count in zip(value, other)]
+
+    def render(self, values):
+        for key, counts in sorted(values.items()):
+            labels = list(zip(self.label_names, key))
+            cumulative_count = 0
+            for upper_bound, count in zip(self.buckets, counts):
+                cumulative_count += count
+                yield f"{self.name}_bucket{format_labels(labels + [('le', f'{upper_bound:g}')])} {cumulative_count}"
+            yield f"{self.name}_bucket{format_labels(labels + [('le', '+Inf')])} {counts[-1]}"
+            yield f"{self.name}_sum{format_labels(labels)} {counts[-2]:g}"
+            yield f"{self.name}_count{format_labels(labels)} {counts[-1]}"
+
+
+# Create a class for the metrics of a process, which can be saved to and merged with the metrics of other processes
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self.changed = False
+        self._saver_pid = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        self.values[metric.name] = {}
+
+    def counter(self, name, description, label_names=()):
+        return Counter(self, name, description, label_names)
+
+    def histogram(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        return Histogram(self, name, description, label_names, buckets)
+
+    def snapshot(self):
+        # Copy of the values (label values are stored as lists, since JSON has no tuples)
+        with self.lock:
+            return {name: [[list(key), list(value) if isinstance(value, list) else value]
+                           for key, value in values.items()]
+                    for name, values in self.values.items()}
+
+    def save(self):
+        # Save the metrics of this process to the metrics directory
+        if metrics_dir is None:
+            return
+        self.changed = False
+        path = os.path.join(metrics_dir, f"{os.getpid()}.json")
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary_path, path)
+
+    def start_saving(self):
+        # Start a thread that saves the metrics of this process every SAVE_INTERVAL seconds if they changed
+        # (once per process, since forked workers do not inherit the thread of the process they were forked from)
+        if metrics_dir is None or self._saver_pid == os.getpid():
+            return
+        self._saver_pid = os.getpid()
+        threading.Thread(target=self._save_periodically, daemon=True, name="metrics-saver").start()
+
+    def _save_periodically(self):
+        while True:
+            time.sleep(SAVE_INTERVAL)
+            if self.changed:
+                self.save()
+
+    def _lock_directory(self, operation):
+        # Lock the metrics directory, so /metrics never reads the file of an exited worker after it has been folded
+        # into the file of the exited workers (which would count it twice) or reads neither of them
+        lock_file = open(os.path.join(metrics_dir, "lock"), "a")
+        fcntl.flock(lock_file, operation)
+        return lock_file
+
+    def _read_snapshots(self, file_names):
+        snapshots = []
+        for file_name in file_names:
+            try:
+                with open(os.path.join(metrics_dir, file_name)) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def merge(self, snapshots):
+        # Sum the values of the same metric and labels over the snapshots
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, entries in snapshot.items():
+                if name not in self.metrics:
+                    continue
+                for key, value in entries:
+                    key = tuple(key)
+                    values = merged[name]
+                    values[key] = self.metrics[name].merge(values[key], value) if key in values else value
+        return merged
+
+    def fold(self, pid):
+        # Add the saved metrics of an exited worker to the metrics of all exited workers and remove its file (called
+        # by the master after reaping the worker, so the worker cannot save its metrics again)
+        if metrics_dir is None:
+            return
+        file_name = f"{pid}.json"
+        with self._lock_directory(fcntl.LOCK_EX):
+            snapshots = self._read_snapshots([EXITED_FILE_NAME, file_name])
+            if not os.path.exists(os.path.join(metrics_dir, file_name)):
+                return
+            merged = self.merge(snapshots)
+            path = os.path.join(metrics_dir, EXITED_FILE_NAME)
+            with open(f"{path}.tmp", "w") as file:
+                json.dump({name: [[list(key), value] for key, value in values.items()]
+                           for name, values in merged.items()}, file)
+            os.replace(f"{path}.tmp", path)
+            os.remove(os.path.join(metrics_dir, file_name))
+
+    def collect(self):
+        # Merge the saved metrics of all running workers and of the exited workers (so counters never decrease)
+        if metrics_dir is None:
+            return self.merge([self.snapshot()])
+        self.save()
+        with self._lock_directory(fcntl.LOCK_SH):
+            return self.merge(self._read_snapshots(file_name for file_name in os.listdir(metrics_dir)
+                                                   if file_name.endswith(".json")))
+
+    def render(self):
+        # Render all metrics in the Prometheus text exposition format
+        merged = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.description}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(merged[name]))
+        return "\n".join(lines) + "\n"
+
+
+# Create the metrics of the app
+registry = MetricsRegistry()
+request_latency = registry.histogram("http_request_duration_seconds", "Latency of HTTP requests.",
+                                     ["endpoint", "status"])
+stage_latency = registry.histogram("stage_duration_seconds", "Latency of the stages of the prediction path.",
+                                   ["stage"])
+maps_api_requests = registry.counter("google_maps_api_requests_total",
+                                     "Number of Google Maps API requests (including retries).", ["api"])
+maps_api_latency = registry.histogram("google_maps_api_duration_seconds",
+                                      "Latency of Google Maps API calls (including retries).", ["api"])
+maps_api_errors = registry.counter("google_maps_api_errors_total", "Number of failed Google Maps API requests.",
+                                   ["api"])
+maps_api_spend = registry.counter("google_maps_api_spend_dollars_total",
+                                  "Estimated Google Maps API spend in dollars.", ["api"])
+maps_api_rejected = registry.counter("google_maps_api_rejected_total",
+                                     "Number of Google Maps API requests not sent because the circuit breaker is open.",
+                                     ["api"])
+location_fallbacks = registry.counter("location_lookup_fallbacks_total",
+                                      "Number of location lookups that fell back to imputed values (degraded mode).",
+                                      ["lookup"])
+location_cache_lookups = registry.counter("location_cache_lookups_total",
+                                          "Number of location cache lookups by result (memory hit, disk hit or miss).",
+                                          ["result"])
+
+
+# Create a class to measure the latency of a stage, usable as a context manager or as a function decorator
+class timed(ContextDecorator):
+    def __init__(self, stage):
+        self.stage = stage
+        self._start_times = threading.local()
+
+    def __enter__(self):
+        # Keep a stack of start times per thread, so the same decorated function can be nested and run concurrently
+        if not hasattr(self._start_times, "stack"):
+            self._start_times.stack = []
+        self._start_times.stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc_info):
+        stage_latency.observe(time.perf_counter() - self._start_times.stack.pop(), stage=self.stage)
+        return False
@@ -0,0 +1,234 @@
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+import numpy as np
+from feature_encoder import FeatureEncoder
+from inference_engine import InferenceEngine, TreeEvaluator
+
+logger = logging.getLogger(__name__)
+
+# Version of the bundle layout (increase when the files or the manifest change incompatibly)
+BUNDLE_FORMAT_VERSION = 1
+
+# Arrays of the flattened trees used by the tree evaluator (stored as .npy files that can be memory-mapped)
+TREE_ARRAYS = ["left", "right", "features", "thresholds", "default_left", "roots"]
+
+# Name of the file in the bundles directory that points to the active bundle version
+CURRENT_FILE = "CURRENT"
+
+# Whether single-row predictions use the tree evaluator on the flattened trees instead of the native XGBoost booster
+# (off by default, so predictions come from the booster unless the evaluator is enabled explicitly)
+# Only with the evaluator does a bundle serve single rows without importing XGBoost and scikit-learn, which cuts the
+# time and memory to the first prediction (see README)
+use_tree_evaluator = os.getenv("use_tree_evaluator", "false").lower() in ("1", "true", "yes")
+
+
+# Create function to calculate the SHA-256 checksum of a file (memory-mapped, so it is not read into Python memory)
+def file_checksum(path):
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        return hashlib.sha256(mapped_file).hexdigest()
+
+
+# Create function to write a file atomically, so readers never see a partially written file
+def write_atomically(path, data):
+    temporary_path = f"{path}.tmp{os.getpid()}"
+    with open(temporary_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+# Create function to save a NumPy array as an .npy file atomically
+def save_array_atomically(path, array):
+    temporary_path = f"{path}.tmp{os.getpid()}.npy"
+    np.save(temporary_path, array)
+    os.replace(temporary_path, path)
+
+
+# Create function to export a model bundle (native XGBoost model, flattened trees, encoder spec and manifest with
+# checksums)
+def export_bundle(column_transformer, model, bundles_dir="models/bundles", version=None, activate=True):
+    version = version or time.strftime("%Y%m%d%H%M%S", time.gmtime())
+    bundle_dir = os.path.join(bundles_dir, version)
+    if os.path.exists(bundle_dir):
+        raise FileExistsError(f"Model bundle {version} already exists")
+    os.makedirs(bundle_dir)
+
+    # Save the XGBoost model in the native binary JSON (UBJSON) format and the encoder as compact JSON
+    booster = model.get_booster()
+    write_atomically(os.path.join(bundle_dir, "model.ubj"), booster.save_raw(raw_format="ubj"))
+    encoder = FeatureEncoder.from_column_transformer(column_transformer)
+    write_atomically(os.path.join(bundle_dir, "encoder.json"), json.dumps(encoder.to_spec()).encode())
+
+    # Save the flattened trees for the tree evaluator, which predicts single rows without loading XGBoost
+    tree_evaluator = TreeEvaluator.from_booster(booster)
+    for name in TREE_ARRAYS:
+        save_array_atomically(os.path.join(bundle_dir, f"tree_{name}.npy"), getattr(tree_evaluator, name))
+
+    # Save the manifest last, so a bundle without a manifest is recognizable as incomplete
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "n_features": booster.num_features(),
+        "tree_evaluator": {"base_score": tree_evaluator.base_score, "max_depth": tree_evaluator.max_depth},
+        "files": {file_name: {"sha256": file_checksum(os.path.join(bundle_dir, file_name)),
+                              "size": os.path.getsize(os.path.join(bundle_dir, file_name))}
+                  for file_name in ["model.ubj", "encoder.json"] + [f"tree_{name}.npy" for name in TREE_ARRAYS]}
+    }
+    write_atomically(os.path.join(bundle_dir, "manifest.json"), json.dumps(manifest, indent=2).encode())
+
+    if activate:
+        activate_bundle(bundles_dir, version)
+    return version
+
+
+# Create function to make a bundle version the active one (picked up by running apps on their next check)
+def activate_bundle(bundles_dir, version):
+    if not os.path.exists(os.path.join(bundles_dir, version, "manifest.json")):
+        raise FileNotFoundError(f"Model bundle {version} not found in {bundles_dir}")
+    write_atomically(os.path.join(bundles_dir, CURRENT_FILE), f"{version}\n".encode())
+
+
+# Create function to read the active bundle version (None if there is no active bundle)
+def current_version(bundles_dir):
+    try:
+        with open(os.path.join(bundles_dir, CURRENT_FILE)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# Create a class for a loaded model bundle with its feature encoder and inference engine
+class ModelBundle:
+    def __init__(self, version, feature_encoder, inference_engine):
+        self.version = version
+        self.feature_encoder = feature_encoder
+        self.inference_engine = inference_engine
+
+    @classmethod
+    def load(cls, bundle_dir):
+        with open(os.path.join(bundle_dir, "manifest.json")) as file:
+            manifest = json.load(file)
+        if manifest["format_version"] != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model bundle format: {manifest['format_version']}")
+
+        # Verify the checksums before loading any file
+        for file_name, file_info in manifest["files"].items():
+            if file_checksum(os.path.join(bundle_dir, file_name)) != file_info["sha256"]:
+                raise ValueError(f"Checksum mismatch for {file_name} in model bundle {manifest['version']}")
+
+        with open(os.path.join(bundle_dir, "encoder.json")) as file:
+            feature_encoder = FeatureEncoder.from_spec(json.load(file))
+        if manifest["n_features"] != feature_encoder.n_output_features:
+            raise ValueError(f"Model bundle {manifest['version']} expects {manifest['n_features']} features, but "
+                             f"the encoder produces {feature_encoder.n_output_features}")
+
+        # Memory-map the flattened trees, so worker processes share the same pages
+        tree_evaluator = None
+        if use_tree_evaluator:
+            tree_arrays = {name: np.asarray(np.load(os.path.join(bundle_dir, f"tree_{name}.npy"), mmap_mode="r"))
+                           for name in TREE_ARRAYS}
+            tree_evaluator = TreeEvaluator(**tree_arrays, **manifest["tree_evaluator"])
+
+        # Load the native XGBoost model only when it is first needed
+        # XGBoost reads the file into its own model structures (only the flattened trees are memory-mapped), so load
+        # it from the path instead of copying the file into a Python buffer first
+        def load_booster():
+            # Import XGBoost only here, since importing it also imports scikit-learn
+            import xgboost
+
+            booster = xgboost.Booster()
+            booster.load_model(os.path.join(bundle_dir, "model.ubj"))
+            return booster
+
+        return cls(manifest["version"], feature_encoder, InferenceEngine(load_booster, tree_evaluator=tree_evaluator))
+
+    @classmethod
+    def from_pickles(cls, column_transformer_path, model_path):
+        # Fallback for the pickled models written by model_training.ipynb (requires scikit-learn and XGBoost)
+        import pickle
+
+        with open(column_transformer_path, "rb") as file:
+            column_transformer = pickle.load(file)
+        with open(model_path, "rb") as file:
+            model = pickle.load(file)
+        return cls("pickle", FeatureEncoder.from_column_transformer(column_transformer),
+                   InferenceEngine.from_booster(model.get_booster(), use_tree_evaluator=use_tree_evaluator))
+
+
+# Create a class that serves the active model bundle and hot-swaps to a newly activated version
+class ModelRegistry:
+    def __init__(self, bundles_dir, fallback_loader=None, check_interval=5):
+        self.bundles_dir = bundles_dir
+        self.fallback_loader = fallback_loader
+        self.check_interval = check_interval
+        self._bundle = None
+        self._last_check = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        # Return the active bundle, checking for a new version at most every check_interval seconds
+        # Requests keep a reference to the bundle they started with, so swapping never affects in-flight requests
+        if self._bundle is None or time.monotonic() - self._last_check >= self.check_interval:
+            self._refresh()
+        return self._bundle
+
+    def _refresh(self):
+        # Only one thread loads a new bundle; the others keep serving the current one in the meantime
+        if not self._lock.acquire(blocking=self._bundle is None):
+            return
+        try:
+            self._last_check = time.monotonic()
+            version = current_version(self.bundles_dir)
+            if version is not None and (self._bundle is None or version != self._bundle.version):
+                try:
+                    bundle = ModelBundle.load(os.path.join(self.bundles_dir, version))
+                    # Replace the reference in a single assignment (atomic in Python)
+                    self._bundle = bundle
+                    logger.info("Loaded model bundle", extra={"version": version})
+                except (OSError, ValueError) as error:
+                    logger.error("Failed to load model bundle", extra={"version": version, "error": str(error)})
+            if self._bundle is None:
+                if self.fallback_loader is None:
+                    raise RuntimeError(f"No model bundle found in {self.bundles_dir}")
+                self._bundle = self.fallback_loader()
+                logger.info("Loaded fallback model")
+        finally:
+            self._lock.release()
+
+
+# Command line interface to export and activate model bundles
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and activate model bundles.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export the pickled models as a new bundle version.")
+    export_parser.add_argument("--column-transformer", default="models/column_transformer.pkl")
+    export_parser.add_argument("--model", default="models/xgboost.pkl")
+    export_parser.add_argument("--bundles-dir", default="models/bundles")
+    export_parser.add_argument("--version", help="Bundle version (default: current UTC timestamp).")
+    export_parser.add_argument("--no-activate", action="store_true", help="Export without activating the bundle.")
+    activate_parser = subparsers.add_parser("activate", help="Activate an exported bundle version.")
+    activate_parser.add_argument("version")
+    activate_parser.add_argument("--bundles-dir", default="models/bundles")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        import pickle
+
+        with open(args.column_transformer, "rb") as file:
+            column_transformer = pickle.load(file)
+        with open(args.model, "rb") as file:
+            model = pickle.load(file)
+        version = export_bundle(column_transformer, model, bundles_dir=args.bundles_dir, version=args.version,
+                                activate=not args.no_activate)
+        print(f"Exported model bundle {version}{'' if args.no_activate else ' (active)'}")
+    else:
+        activate_bundle(args.bundles_dir, args.version)
+        print(f"Activated model bundle {args.version}")
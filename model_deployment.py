@@ -1,211 +1,61 @@
-from flask import Flask, render_template
+from flask import Flask, Response, g, render_template, request, jsonify
 from flask_wtf import FlaskForm
 from wtforms import IntegerField, SelectField, TextAreaField, SubmitField
-from wtforms.validators import DataRequired, Optional
-import sklearn  # required to use the column transformer for data preprocessing
-import xgboost  # required to use the XGBoost model
-import pickle
-import requests
-import numpy as np
+from wtforms.validators import DataRequired, NumberRange, Optional
+from concurrent.futures import ThreadPoolExecutor, wait
 import pandas as pd
 from dotenv import load_dotenv
 import os
+import logging
+import time
+from location_cache import CACHE_MISS, normalize_address
+from location_features import (degraded_location_features, get_location_features, location_cache, lookup_timeout,
+                               maps_calls_per_address, maps_requests_per_second)
+from feature_preparation import (BEDROOM_CHOICES, PROPERTY_TYPE_CHOICES, FURNISHING_CHOICES, LISTING_COLUMNS,
+                                 LOCATION_COLUMNS, validate_listing, check_model_categories, prepare_feature_row,
+                                 prepare_features)
+from model_bundle import ModelBundle, ModelRegistry
+from metrics import registry as metrics_registry, request_latency, timed
+from request_context import (SamplingProfiler, configure_logging, deadline_var, request_id_var, set_deadline,
+                             set_request_id, submit_with_context)
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Get Google Maps API key from .env
-google_maps_api_key = os.getenv("google_maps_api_key")
-
-
-# --------------------------- HELPER FUNCTIONS FOR PREPROCESSING -------------------------------------------------------
-# Create function to get latitude and longitude from an address
-def get_latitude_longitude(address):
-    # Base URL for the Google Maps Geocoding API
-    base_url = "https://maps.googleapis.com/maps/api/geocode/json"
-
-    # Parameters for the Geocoding API request
-    params = {
-        "address": f"{address}, Singapore",
-        "key": google_maps_api_key
-    }
-
-    # Send Geocoding API request and store the response
-    response = requests.get(base_url, params=params)
-    data = response.json()
-
-    # Check if request was successful
-    if data["status"] == "OK":
-        # Extract latitude and longitude from the response
-        location = data["results"][0]["geometry"]["location"]
-        latitude = location["lat"]
-        longitude = location["lng"]
-    else:
-        # Assign missing values and print error message if the request failed
-        latitude = np.nan
-        longitude = np.nan
-        print(f"Geocoding request failed for {address}")
-
-    # Return latitude and longitude
-    return latitude, longitude
-
-
-# Create function to get meters to central business district from property latitude and longitude
-def get_meters_to_cbd(property_latitude, property_longitude):
-    # Return a missing value if latitude or longitude is missing
-    if np.isnan(property_latitude) or np.isnan(property_longitude):
-        print(f"Property latitude or longitude missing. Assigning missing value for meters to CBD.")
-        return np.nan
-
-    # Latitude and longitude of central business district (i.e. Raffles Place)
-    cbd_latitude = 1.284184
-    cbd_longitude = 103.85151
-
-    # Base URL for the Google Maps Distance Matrix API
-    base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-
-    # Parameters for the Distance Matrix API request
-    params = {
-        "origins": f"{property_latitude},{property_longitude}",
-        "destinations": f"{cbd_latitude},{cbd_longitude}",
-        "key": google_maps_api_key
-    }
-
-    # Send the Distance Matrix API request and store the response
-    response = requests.get(base_url, params=params)
-    data = response.json()
-
-    # Process the response to get the distance
-    if "rows" in data and data["rows"]:
-        meters_to_cbd = data["rows"][0]["elements"][0]["distance"]["value"]
-        print(f"Distance between property and CBD: {meters_to_cbd} meters")
-    else:
-        print("No distance information available.")
-        return np.nan
-    return meters_to_cbd
-
-
-# Create function to get latitude and longitude of the closest school from property latitude and longitude
-def get_school_location(property_latitude, property_longitude):
-    # Return missing value if latitude or longitude is missing
-    if np.isnan(property_latitude) or np.isnan(property_longitude):
-        print(f"Property latitude or longitude missing. Assigning missing values for school latitude and longitude.")
-        return np.nan, np.nan
-
-    # Base URL for the Google Maps Places Nearby Search API
-    base_url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-
-    # Parameters for the Nearby Search API request
-    params = {
-        "location": f"{property_latitude},{property_longitude}",
-        "radius": 1000,  # Search radius in meters
-        "type": "school",
-        "key": google_maps_api_key
-    }
-
-    # Send the Nearby Search API request and store the response
-    response = requests.get(base_url, params=params)
-    data = response.json()
-
-    # Extract latitude and longitude of the closest school from the response
-    if "results" in data and data["results"]:
-        closest_school = data["results"][0]
-        school_name = closest_school["name"]
-        school_location = closest_school["geometry"]["location"]
-        school_latitude = school_location["lat"]
-        school_longitude = school_location["lng"]
-        print(f"Closest school: {school_name}")
-        print(f"Latitude: {school_latitude}, Longitude: {school_longitude}")
-    else:
-        school_latitude = np.nan
-        school_longitude = np.nan
-        print("No schools found nearby.")
-    return school_latitude, school_longitude
-
-
-# Create function to get meters to the closest school
-def get_meters_to_school(property_latitude, property_longitude, school_latitude, school_longitude):
-    # Return missing value if property latitude or longitude is missing
-    if np.isnan(property_latitude) or np.isnan(property_longitude):
-        print(f"Property latitude or longitude missing. Assigning missing value for meters to school.")
-        return np.nan
-
-    # Return missing value if the school location is missing
-    if np.isnan(school_latitude) or np.isnan(school_longitude):
-        print(f"School latitude or longitude missing. Assigning missing value for meters to school.")
-        return np.nan
-
-    # Base URL for the Google Maps Distance Matrix API
-    base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-
-    # Parameters for the Distance Matrix API request
-    params = {
-        "origins": f"{property_latitude},{property_longitude}",
-        "destinations": f"{school_latitude},{school_longitude}",
-        "key": google_maps_api_key
-    }
-
-    # Send the Distance Matrix API request and store the response
-    response = requests.get(base_url, params=params)
-    data = response.json()
-
-    # Process the response to get the distance
-    if "rows" in data and data["rows"]:
-        meters_to_school = data["rows"][0]["elements"][0]["distance"]["value"]
-        print(f"Distance between property and closest school: {meters_to_school} meters")
-    else:
-        print("No distance information available. Assigning missing value for meters to school.")
-        return np.nan
-    return meters_to_school
-
-
-# Create function to get the average Google Maps rating of nearby restaurants
-def get_restaurants_rating(property_latitude, property_longitude):
-    # Return missing value if latitude or longitude is missing
-    if np.isnan(property_latitude) or np.isnan(property_longitude):
-        print(f"Property latitude or longitude missing. Assigning missing value for restaurants rating.")
-        return np.nan
-
-    # Base URL for the Google Maps Places Nearby Search API
-    base_url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-
-    # Parameters for the Nearby Search API request
-    params = {
-        "location": f"{property_latitude},{property_longitude}",
-        "radius": 1000,  # Search radius in meters
-        "type": "restaurant",
-        "key": google_maps_api_key
-    }
-
-    # Send the Nearby Search API request and store the response
-    response = requests.get(base_url, params=params)
-    data = response.json()
-
-    # Process the response to get the average restaurant rating
-    if "results" in data and data["results"]:
-        # Extract restaurant ratings as a list, assigning np.nan for missing ratings
-        rating_list = [restaurant.get("rating", np.nan) for restaurant in data.get("results")]
-        # Calculate average rating, ignoring np.nan values
-        average_rating = np.nanmean(rating_list)
-        print(f"Number of restaurants: {len(rating_list)}")
-        print(f"Number of ratings: {len([rating for rating in rating_list if not np.isnan(rating)])}")
-        print(f"Average rating: {average_rating:.2f}")
-    else:
-        print("No restaurants found nearby. Assigning missing value for restaurants rating.")
-        return np.nan
-    return average_rating
-# ----------------------------------------------------------------------------------------------------------------------
-
-
-# Load column transformer  from pickle file to encode categorical columns and scale numerical columns
-with open("models/column_transformer.pkl", "rb") as file:
-    column_transformer = pickle.load(file)
-
-# Load XGBoost model from pickle file
-with open("models/xgboost.pkl", "rb") as file:
-    model = pickle.load(file)
-# Enable categorical support for the loaded model
-model.enable_categorical = True
+# Write structured logs (one JSON object per line) that carry the id of the request they belong to
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Allow clients to request a sampling profile of a request (with the header "X-Profile: 1" or "?profile=1")
+# Disabled by default, since profiling slows down the profiled request
+profiling_enabled = os.getenv("profiling_enabled", "false").lower() in ("1", "true", "yes")
+
+# Create a separate thread pool to enrich the unique addresses of a batch concurrently (each address in turn submits
+# its independent Google Maps API calls to the enrichment thread pool)
+batch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="batch")
+
+# Maximum number of listings per batch prediction request
+MAX_BATCH_SIZE = 1000
+
+# Latency budget in seconds for the location lookups of a form request and of a batch request
+# Location-based features that cannot be looked up within the budget fall back to imputed values (degraded mode)
+request_budget = float(os.getenv("request_budget_seconds", "2"))
+batch_request_budget = float(os.getenv("batch_request_budget_seconds", "10"))
+
+# Maximum number of new addresses (not geocoded before) per batch prediction request, i.e. the number of addresses the
+# Google Maps API rate limit allows to enrich within the batch budget (with a margin for latency), since the addresses
+# beyond it would all fall back to imputed values
+MAX_BATCH_NEW_ADDRESSES = max(1, int(0.8 * batch_request_budget * maps_requests_per_second / maps_calls_per_address))
+
+
+# Create a model registry that loads the active model bundle (native XGBoost model and feature encoder) from
+# models/bundles and hot-swaps to a newly activated bundle version without a restart
+# Fall back to the pickled column transformer and XGBoost model if no bundle has been exported
+model_registry = ModelRegistry(
+    bundles_dir=os.getenv("model_bundles_dir", "models/bundles"),
+    fallback_loader=lambda: ModelBundle.from_pickles("models/column_transformer.pkl", "models/xgboost.pkl"),
+    check_interval=int(os.getenv("model_check_interval", "5"))
+)
 
 # Create the Flask web application
 app = Flask(__name__)
@@ -216,34 +66,68 @@ app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
 
 # Create a class for rental price estimation forms (that inherits from the Flask WTForm class)
 class RentalPriceEstimationForm(FlaskForm):
-    size = IntegerField("Size (in sqft):", validators=[DataRequired()])
+    size = IntegerField("Size (in sqft):", validators=[DataRequired(), NumberRange(min=1)])
     bedrooms = SelectField("Bedrooms:",
-                           choices=[("Room", "Room"), ("Studio", "Studio"), ("1", "1"), ("2", "2"), ("3", "3"),
-                                    ("4", "4"), ("5", "5"), ("6", "6"), ("7+", "7+")],
+                           choices=[(choice, choice) for choice in BEDROOM_CHOICES],
                            validators=[DataRequired()])
     bathrooms = IntegerField("Bathrooms:", validators=[Optional()])
     address = TextAreaField("Address:", validators=[DataRequired()])
     property_type = SelectField("Property type:",
-                                choices=[("Condominium", "Condominium"), ("Apartment", "Apartment"),
-                                         ("HDB Flat", "HDB Flat"), ("Semi-Detached House", "Semi-Detached House"),
-                                         ("Good Class Bungalow", "Good Class Bungalow"),
-                                         ("Corner Terrace", "Corner Terrace"),
-                                         ("Detached House", "Detached House"),
-                                         ("Executive Condominium", "Executive Condominium"),
-                                         ("Terraced House", "Terraced House"), ("Bungalow House", "Bungalow House"),
-                                         ("Cluster House", "Cluster House")],
+                                choices=[(choice, choice) for choice in PROPERTY_TYPE_CHOICES],
                                 validators=[DataRequired()])
     furnishing = SelectField("Furnishing:",
-                             choices=[("", ""),
-                                      ("Fully Furnished", "Fully Furnished"),
-                                      ("Partially Furnished", "Partially Furnished"),
-                                      ("Unfurnished", "Unfurnished")])
+                             choices=[("", "")] + [(choice, choice) for choice in FURNISHING_CHOICES])
     year = IntegerField("Built year:", validators=[Optional()])
     meters_to_mrt = IntegerField("Meters to MRT:", validators=[Optional()])
     agent_description = TextAreaField("Agent description:")
     submit = SubmitField("Estimate")
 
 
+# Start timing each request, assign its request id (the one sent by the client, if any) and deadline, and start the
+# profiler if the client requested it
+@app.before_request
+def start_request():
+    g.start_time = time.perf_counter()
+    g.request_id_token = set_request_id(request.headers.get("X-Request-ID"))
+    g.deadline_token = set_deadline(batch_request_budget if request.endpoint == "api_predict" else request_budget)
+    g.profiler = None
+    if profiling_enabled and (request.headers.get("X-Profile") == "1" or request.args.get("profile") == "1"):
+        g.profiler = SamplingProfiler().start()
+
+
+# Record the latency of each request, log it and return the request id to the client
+@app.after_request
+def finish_request(response):
+    duration = time.perf_counter() - g.start_time
+    request_latency.observe(duration, endpoint=request.endpoint or "unknown", status=str(response.status_code))
+    response.headers["X-Request-ID"] = request_id_var.get()
+    logger.info("Request completed", extra={"method": request.method, "path": request.path,
+                                            "status": response.status_code, "duration_ms": round(duration * 1000, 2)})
+    if g.profiler is not None:
+        profiler = g.profiler.stop()
+        logger.info("Request profile", extra={"n_samples": profiler.n_samples, "stacks": profiler.top_stacks()})
+        response.headers["X-Profile-Samples"] = str(profiler.n_samples)
+    # Save the metrics of this worker in the background for the /metrics endpoint of the other workers
+    metrics_registry.start_saving()
+    return response
+
+
+# Reset the request id and deadline once the request is done, so they do not leak into the next request of the thread
+@app.teardown_request
+def end_request(error=None):
+    if "request_id_token" in g:
+        request_id_var.reset(g.request_id_token)
+    if "deadline_token" in g:
+        deadline_var.reset(g.deadline_token)
+
+
+# Create the metrics route that exposes latency histograms per request and stage, Google Maps API call counts and
+# the estimated Google Maps API spend in the Prometheus text format
+@app.route("/metrics")
+def metrics():
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 # Create the home route
 @app.route("/", methods=["GET", "POST"])
 def home():
@@ -252,73 +136,130 @@ def home():
     # If the user submits valid input
     if form.validate_on_submit():
         # Get the input data from the form
-        size = form.size.data
-        bedrooms = form.bedrooms.data
-        bathrooms = form.bathrooms.data
-        address = form.address.data
-        property_type = form.property_type.data
-        furnishing = form.furnishing.data
-        year = form.year.data
-        meters_to_mrt = form.meters_to_mrt.data
-        agent_description = form.agent_description.data
+        listing = {
+            "size": form.size.data,
+            "bedrooms": form.bedrooms.data,
+            "bathrooms": form.bathrooms.data,
+            "address": form.address.data,
+            "property_type": form.property_type.data,
+            "furnishing": form.furnishing.data,
+            "year": form.year.data,
+            "meters_to_mrt": form.meters_to_mrt.data,
+            "agent_description": form.agent_description.data
+        }
+
+        # Get the active model bundle (kept for the whole request, even if a new version is activated meanwhile)
+        bundle = model_registry.get()
+
+        # Reject categories that are offered by the form but were not part of the training data (before paying for
+        # any Google Maps API call)
+        error = check_model_categories(listing, bundle.feature_encoder.categories)
+        if error is not None:
+            return render_template("index.html", form=form, error=error)
 
         # Engineer location-based features via Google Maps API (Cost: 0.079$ per input submitted by the user)
-        latitude, longitude = get_latitude_longitude(address)  # Cost: 0.005$
-        meters_to_cbd = get_meters_to_cbd(latitude, longitude)  # Cost: 0.005$
-        school_latitude, school_longitude = get_school_location(latitude, longitude)  # Cost: 0.032$
-        meters_to_school = get_meters_to_school(latitude, longitude, school_latitude, school_longitude)  # Cost: 0.005$
-        restaurants_rating = get_restaurants_rating(latitude, longitude)  # Cost: 0.032$
-
-        # Extract features from the agent description
-        high_floor = "high floor" in agent_description.lower()
-        new = any(keyword in agent_description.lower() for keyword in ["brand new", "new unit"])
-        renovated = any(keyword in agent_description.lower() for keyword in ["renovated", "renovation"])
-        view = any(keyword in agent_description.lower() for keyword in
-                   ["sea view", "seaview", "panoramic view", "unblocked view", "unblock view", "stunning view",
-                    "park view", "breathtaking view", "river view", "pool view", "spectacular view", "city view",
-                    "greenery view", "gorgeous view"])
-        penthouse = "penthouse" in agent_description.lower()
-
-        # Handle missing values
-        # Bathrooms: Assume 1 bathroom for a room or studio, 7 bathrooms for 7+ bedrooms, else same number as bedrooms
-        if bathrooms is None:
-            bedroom_mapping = {"Room": 1, "Studio": 1, "7+": 7}
-            if bedrooms in bedroom_mapping:
-                bathrooms = bedroom_mapping[bedrooms]
-            else:
-                bathrooms = int(bedrooms)
-        # Meters to school: Impute the maximum (i.e. 9689 meters, see data_preprocessing.ipynb)
-        meters_to_school = 9689 if np.isnan(meters_to_school) else meters_to_school
-        # Meters to MRT: Impute the median (i.e. 450 meters, see data_preprocessing.ipynb)
-        meters_to_mrt = 450 if meters_to_mrt is None else meters_to_mrt
-        # Furnishing: Impute the mode (i.e. "Partially Furnished", see data_preprocessing.ipynb)
-        furnishing = "Partially Furnished" if furnishing == "" else furnishing
-        # Built year: Impute the median (i.e. 2013, see data_preprocessing.ipynb)
-        year = 2013 if year is None else year
-
-        # Convert input data to a NumPy 2D array
-        input_data = pd.DataFrame([[size, bedrooms, bathrooms, latitude, longitude, meters_to_cbd, meters_to_school,
-                                    restaurants_rating, property_type, furnishing, year, meters_to_mrt, high_floor,
-                                    new, renovated, view, penthouse]],
-                                  columns=["size", "bedrooms", "bathrooms", "latitude", "longitude", "meters_to_cbd",
-                                           "meters_to_school", "restaurants_rating", "property_type", "furnishing",
-                                           "year", "meters_to_mrt", "high_floor", "new", "renovated", "view",
-                                           "penthouse"])
-
-        # Apply the column transformer to encode the categorical features and scale the numerical features
-        input_data_transformed = column_transformer.transform(input_data)
+        # Features that cannot be looked up within the request budget are imputed and the result is flagged as degraded
+        location_features = get_location_features(listing["address"])
+
+        # Extract features from the agent description, handle missing values and order the features
+        with timed("prepare_features"):
+            input_data = prepare_feature_row({**listing, **location_features})
+
+        # Encode the categorical features and scale the numerical features (same as the column transformer)
+        with timed("encode"):
+            input_data_transformed = bundle.feature_encoder.transform_row(input_data)
 
         # Estimate rental price based on the model
-        prediction = model.predict(input_data_transformed)[0]
+        with timed("predict"):
+            prediction = bundle.inference_engine.predict(input_data_transformed)[0]
         prediction = round(prediction)
 
         # Render the estimated rental price in the index.html template
-        return render_template("index.html", form=form, prediction=prediction)
+        return render_template("index.html", form=form, prediction=prediction,
+                               degraded=location_features["degraded"])
 
     # Render the index.html template
     return render_template("index.html", form=form)
 
 
+# Create the batch prediction API route that accepts a JSON array of listings
+@app.route("/api/predict", methods=["POST"])
+def api_predict():
+    listings = request.get_json(silent=True)
+    if not isinstance(listings, list):
+        return jsonify({"error": "Expected a JSON array of listings."}), 400
+    if len(listings) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Too many listings. The maximum batch size is {MAX_BATCH_SIZE}."}), 413
+
+    # Get the active model bundle (kept for the whole request, even if a new version is activated meanwhile)
+    bundle = model_registry.get()
+
+    # Validate each listing and keep the valid ones
+    errors = [validate_listing(listing) for listing in listings]
+    for position, listing in enumerate(listings):
+        # Reject categories that are offered by the form but were not part of the training data
+        if errors[position] is None:
+            errors[position] = check_model_categories(listing, bundle.feature_encoder.categories)
+    predictions = [None] * len(listings)
+    degraded = [False] * len(listings)
+    valid_positions = [position for position, error in enumerate(errors) if error is None]
+
+    if valid_positions:
+        # Engineer location-based features once per unique address, enriching the addresses concurrently
+        # Addresses that cannot be enriched within the batch budget fall back to imputed values (degraded mode)
+        address_keys = [normalize_address(listings[position]["address"]) for position in valid_positions]
+        unique_addresses = {key: listings[position]["address"] for key, position in zip(address_keys, valid_positions)}
+        n_new_addresses = sum(location_cache.get("geocode", key, default=CACHE_MISS) is CACHE_MISS
+                              for key in unique_addresses)
+        if n_new_addresses > MAX_BATCH_NEW_ADDRESSES:
+            return jsonify({"error": f"Too many new addresses ({n_new_addresses}). At most {MAX_BATCH_NEW_ADDRESSES} "
+                                     f"addresses that were not looked up before can be enriched per batch, split the "
+                                     f"listings into smaller batches."}), 413
+        location_futures = {key: submit_with_context(batch_executor, get_location_features, address)
+                            for key, address in unique_addresses.items()}
+        wait(location_futures.values(), timeout=lookup_timeout())
+        # Cancel the lookups that have not started, so they do not take executor slots and Google Maps API quota after
+        # the response has been sent (running lookups stop at the deadline of the request)
+        for future in location_futures.values():
+            future.cancel()
+        location_features = {}
+        for key, future in location_futures.items():
+            if future.done() and not future.cancelled() and future.exception() is None:
+                location_features[key] = future.result()
+            elif future.done() and not future.cancelled():
+                # A failed lookup of one address must not fail the whole batch
+                logger.warning("Location lookup failed, using imputed values", exc_info=future.exception(),
+                               extra={"address": unique_addresses[key]})
+                location_features[key] = degraded_location_features()
+            else:
+                logger.warning("Location lookup unavailable, using imputed values",
+                               extra={"address": unique_addresses[key]})
+                location_features[key] = degraded_location_features()
+
+        # Combine listings with their location-based features
+        rows = []
+        for position, key in zip(valid_positions, address_keys):
+            rows.append({**listings[position], **location_features[key]})
+            degraded[position] = location_features[key]["degraded"]
+
+        # Extract features from the agent descriptions and handle missing values for the whole batch
+        with timed("prepare_features_batch"):
+            input_data = prepare_features(pd.DataFrame(rows).reindex(columns=LISTING_COLUMNS + LOCATION_COLUMNS))
+
+        # Encode and predict the whole batch at once
+        with timed("encode_batch"):
+            input_data_transformed = bundle.feature_encoder.transform_rows(input_data.to_records(index=False))
+        with timed("predict_batch"):
+            batch_predictions = bundle.inference_engine.predict(input_data_transformed)
+        for position, prediction in zip(valid_positions, batch_predictions):
+            predictions[position] = round(float(prediction))
+
+    # Return the predictions, errors and degraded flags (imputed location-based features) in the order of the
+    # submitted listings
+    return jsonify({"predictions": [{"prediction": prediction, "error": error, "degraded": is_degraded}
+                                    for prediction, error, is_degraded in zip(predictions, errors, degraded)]})
+
+
 # Start the Flask web application
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=8080)
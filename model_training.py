@@ -0,0 +1,245 @@
+import argparse
+import math
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_squared_error, mean_absolute_percentage_error, r2_score
+from sklearn.model_selection import KFold, ParameterGrid, train_test_split
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from xgboost import XGBRegressor
+from model_bundle import export_bundle, write_atomically
+
+# Numerical, categorical and boolean columns (same as model_training.ipynb)
+NUMERICAL_COLUMNS = ["size", "bathrooms", "latitude", "longitude", "meters_to_mrt", "meters_to_cbd", "meters_to_school",
+                     "restaurants_rating", "year"]
+CATEGORICAL_COLUMNS = ["bedrooms", "property_type", "furnishing"]
+BOOLEAN_COLUMNS = ["high_floor", "new", "renovated", "view", "penthouse"]
+
+# Hyperparameter grids of model_training.ipynb without n_estimators, which is the resource that successive halving
+# increases from one rung to the next (each rung trains the remaining candidates with the next n_estimators value)
+XGB_PARAM_GRID = {
+    "max_depth": [3, 4, 5],
+    "subsample": [0.8, 0.9, 1.0],
+    "colsample_bytree": [0.8, 0.9, 1.0],
+    "learning_rate": [0.01, 0.1],
+    "min_child_weight": [1, 2, 3],
+    "gamma": [0, 0.1, 0.2]
+}
+RF_PARAM_GRID = {
+    "max_depth": [20, 30, 40, 50],
+    "max_features": [0.33, 0.5, 0.66, 1]
+}
+
+# Models to tune: model class, hyperparameter grid and n_estimators values (one rung per value)
+MODELS = {
+    "xgboost": (XGBRegressor, XGB_PARAM_GRID, [100, 200, 300, 400, 500]),
+    "random_forest": (RandomForestRegressor, RF_PARAM_GRID, [200, 300, 400, 500])
+}
+
+# Transformed training and validation data of each cross-validation fold (set once per worker process)
+fold_data = None
+
+
+# Create a custom transformer class to handle outliers based on 1.5 IQR (same as model_training.ipynb)
+class OutlierHandlerIQR(BaseEstimator, TransformerMixin):
+    def fit(self, X, y):
+        # Calculate quartiles, IQR and cutoff values of target label (y)
+        Q1 = y.quantile(0.25)
+        Q3 = y.quantile(0.75)
+        IQR = Q3 - Q1
+        self.lower_cutoff_ = Q1 - 1.5 * IQR
+        self.upper_cutoff_ = Q3 + 1.5 * IQR
+        print(f"Lower cutoff: {round(self.lower_cutoff_)} S$/month")
+        print(f"Upper cutoff: {round(self.upper_cutoff_)} S$/month")
+        return self
+
+    def transform(self, X, y):
+        # Apply cutoff values
+        mask = (y >= self.lower_cutoff_) & (y <= self.upper_cutoff_)
+        # Print number of outliers
+        print(f"Rental price outliers based on 1.5 IQR: {y.shape[0] - y[mask].shape[0]}")
+        # Return data with outliers removed
+        return X[mask], y[mask]
+
+    def fit_transform(self, X, y):
+        # Perform both fit and transform
+        return self.fit(X, y).transform(X, y)
+
+
+# Create function to create the column transformer that scales numerical columns and encodes categorical columns
+def create_column_transformer():
+    return ColumnTransformer(
+        transformers=[
+            ("scaler", StandardScaler(), NUMERICAL_COLUMNS),
+            ("encoder", OneHotEncoder(drop=None, sparse_output=False), CATEGORICAL_COLUMNS)
+        ],
+        remainder="passthrough"  # Include the boolean columns without transformation
+    )
+
+
+# Create function to load the preprocessed data and split it into training, validation and test data (70/15/15)
+def load_data(path):
+    df = pd.read_csv(path)
+    # Combine 7, 8, 9 and 10 bedrooms into the category "7+"
+    df["bedrooms"] = df["bedrooms"].astype(str).replace({"7": "7+", "8": "7+", "9": "7+", "10": "7+"})
+    X = df.drop("price", axis=1)
+    y = df["price"]
+    X_train, X_temp, y_train, y_temp = train_test_split(X, y, test_size=0.3, random_state=42)
+    X_val, X_test, y_val, y_test = train_test_split(X_temp, y_temp, test_size=0.5, random_state=42)
+    return X_train, X_val, X_test, y_train, y_val, y_test
+
+
+# Create function to transform the data of each cross-validation fold once, with a column transformer fitted on the
+# training part of the fold only, so the candidates reuse the transformed arrays instead of transforming them again
+def prepare_folds(X, y, n_folds):
+    folds = []
+    for train_index, val_index in KFold(n_splits=n_folds).split(X):
+        column_transformer = create_column_transformer()
+        X_fold_train = column_transformer.fit_transform(X.iloc[train_index]).astype(np.float32)
+        X_fold_val = column_transformer.transform(X.iloc[val_index]).astype(np.float32)
+        folds.append((X_fold_train, y.iloc[train_index].to_numpy(), X_fold_val, y.iloc[val_index].to_numpy()))
+    return folds
+
+
+# Create function to set the transformed folds in a worker process
+def set_fold_data(folds):
+    global fold_data
+    fold_data = folds
+
+
+# Create function to train a candidate on one fold and calculate its validation RMSE for each n_estimators value up to
+# the budget (runs in a worker process with one thread per model, so the trials run in parallel across cores)
+def score_candidate(model_name, params, fold_index, budget):
+    model_class, _, n_estimators_values = MODELS[model_name]
+    X_fold_train, y_fold_train, X_fold_val, y_fold_val = fold_data[fold_index]
+    model = model_class(**params, n_estimators=budget, random_state=42, n_jobs=1)
+    model.fit(X_fold_train, y_fold_train)
+
+    # Predictions with fewer trees come from the first trees of the trained model, so one fit per rung is enough
+    n_estimators_values = [n_estimators for n_estimators in n_estimators_values if n_estimators <= budget]
+    if model_name == "xgboost":
+        predictions = [model.predict(X_fold_val, iteration_range=(0, n_estimators))
+                       for n_estimators in n_estimators_values]
+    else:
+        tree_predictions = np.cumsum([tree.predict(X_fold_val) for tree in model.estimators_], axis=0)
+        predictions = [tree_predictions[n_estimators - 1] / n_estimators for n_estimators in n_estimators_values]
+    return [mean_squared_error(y_fold_val, y_pred, squared=False) for y_pred in predictions]
+
+
+# Create function to tune the hyperparameters of a model with successive halving: all candidates are trained with few
+# trees, and only the best 1/factor of them move on to the next rung with more trees
+# Returns the results of all rungs (mean validation RMSE over the folds of each candidate and n_estimators value)
+def successive_halving(model_name, executor, n_folds, factor=3):
+    _, param_grid, n_estimators_values = MODELS[model_name]
+    candidates = list(enumerate(ParameterGrid(param_grid)))
+    results = []
+    for rung, budget in enumerate(n_estimators_values):
+        start_time = time.monotonic()
+        futures = [[executor.submit(score_candidate, model_name, params, fold_index, budget)
+                    for fold_index in range(n_folds)] for _, params in candidates]
+        rung_results = []
+        for (candidate, params), candidate_futures in zip(candidates, futures):
+            validation_rmse = np.mean([future.result() for future in candidate_futures], axis=0)
+            for n_estimators, rmse in zip(n_estimators_values, validation_rmse):
+                rung_results.append({"rung": rung, "candidate": candidate, "validation_rmse": rmse,
+                                     "n_estimators": n_estimators, **params})
+        rung_results = pd.DataFrame(rung_results)
+        results.append(rung_results)
+
+        # Keep the candidates with the lowest RMSE at any n_estimators value of this rung
+        best_rmse = rung_results.groupby("candidate")["validation_rmse"].min().sort_values()
+        print(f"{model_name} rung {rung}: {len(candidates)} candidates x {n_folds} folds with n_estimators <= {budget} "
+              f"in {time.monotonic() - start_time:.1f}s (best RMSE: {best_rmse.iloc[0]:.2f})")
+        n_kept = max(1, math.ceil(len(candidates) / factor))
+        candidates = [(candidate, params) for candidate, params in candidates if candidate in best_rmse.index[:n_kept]]
+    return pd.concat(results, ignore_index=True)
+
+
+# Create function to calculate the evaluation metrics (RMSE, MAPE, R2) of predictions
+def print_metrics(name, y_true, y_pred):
+    print(name)
+    print(f"RMSE: {round(mean_squared_error(y_true, y_pred, squared=False), 2)}")
+    print(f"MAPE: {round(mean_absolute_percentage_error(y_true, y_pred), 2)}")
+    print(f"R-squared (R²): {round(r2_score(y_true, y_pred), 2)}")
+    print("=" * 40)
+
+
+# Tune, train and save the final XGBoost model and its column transformer
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune and train the rental price model with successive halving.")
+    parser.add_argument("--data", default="data/rental_prices_singapore_preprocessed.csv")
+    parser.add_argument("--models-dir", default="models", help="Directory of the pickled models (default: models).")
+    parser.add_argument("--tune", nargs="+", choices=list(MODELS), default=list(MODELS),
+                        help="Models to tune (the XGBoost model is always the one that is saved).")
+    parser.add_argument("--folds", type=int, default=5, help="Number of cross-validation folds.")
+    parser.add_argument("--factor", type=int, default=3,
+                        help="Fraction of candidates (1/factor) that moves on to the next rung.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of parallel trials.")
+    parser.add_argument("--results", help="Optional csv file for the results of all rungs.")
+    parser.add_argument("--export-bundle", action="store_true",
+                        help="Also export the models as a new model bundle for the web application and activate it.")
+    args = parser.parse_args()
+
+    start_time = time.monotonic()
+    X_train, X_val, X_test, y_train, y_val, y_test = load_data(args.data)
+
+    # Remove outliers
+    outlier_handler_iqr = OutlierHandlerIQR()
+    X_train_new, y_train_new = outlier_handler_iqr.fit_transform(X_train, y_train)
+
+    # Tune the hyperparameters with cross-validation on the training data
+    folds = prepare_folds(X_train_new, y_train_new, args.folds)
+    all_results = []
+    with ProcessPoolExecutor(args.workers, initializer=set_fold_data, initargs=(folds,)) as executor:
+        for model_name in args.tune:
+            results = successive_halving(model_name, executor, args.folds, args.factor)
+            results.insert(0, "model", model_name)
+            all_results.append(results)
+            # Show the top 10 best performing models of the last rung
+            last_rung = results[results["rung"] == results["rung"].max()]
+            print(last_rung.sort_values("validation_rmse")[:10].to_string(index=False))
+    all_results = pd.concat(all_results, ignore_index=True)
+    if args.results:
+        all_results.to_csv(args.results, index=False)
+
+    # Get the best XGBoost hyperparameters (tuned in this run, otherwise the ones of model_training.ipynb)
+    if "xgboost" in args.tune:
+        xgb_results = all_results[all_results["model"] == "xgboost"]
+        best = xgb_results[xgb_results["rung"] == xgb_results["rung"].max()].sort_values("validation_rmse").iloc[0]
+        best_params = {"n_estimators": int(best["n_estimators"]),
+                       **list(ParameterGrid(XGB_PARAM_GRID))[int(best["candidate"])]}
+    else:
+        best_params = {"n_estimators": 300, "max_depth": 4, "subsample": 0.8, "colsample_bytree": 0.8,
+                       "learning_rate": 0.1, "min_child_weight": 3, "gamma": 0}
+    print(f"XGBoost hyperparameters: {best_params}")
+
+    # Train the final model on the training data
+    column_transformer = create_column_transformer()
+    X_train_new = column_transformer.fit_transform(X_train_new)
+    xgb_final_model = XGBRegressor(**best_params, random_state=42)
+    xgb_final_model.fit(X_train_new, y_train_new)
+
+    # Evaluate the final model on the training, validation and test data (outliers removed)
+    X_val_new, y_val_new = outlier_handler_iqr.transform(X_val, y_val)
+    X_test_new, y_test_new = outlier_handler_iqr.transform(X_test, y_test)
+    print("=" * 40)
+    print_metrics("TRAINING DATA", y_train_new, xgb_final_model.predict(X_train_new))
+    print_metrics("VALIDATION DATA", y_val_new, xgb_final_model.predict(column_transformer.transform(X_val_new)))
+    print_metrics("TEST DATA", y_test_new, xgb_final_model.predict(column_transformer.transform(X_test_new)))
+
+    # Save the column transformer and the final XGBoost model as pickle files (atomically, since running apps may load
+    # them at any time)
+    os.makedirs(args.models_dir, exist_ok=True)
+    write_atomically(os.path.join(args.models_dir, "column_transformer.pkl"), pickle.dumps(column_transformer))
+    write_atomically(os.path.join(args.models_dir, "xgboost.pkl"), pickle.dumps(xgb_final_model))
+    print(f"Saved the models to {args.models_dir} ({time.monotonic() - start_time:.0f}s in total)")
+
+    if args.export_bundle:
+        version = export_bundle(column_transformer, xgb_final_model, os.path.join(args.models_dir, "bundles"))
+        print(f"Exported and activated model bundle {version}")
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+# Mean earth radius in meters (used to convert haversine distances from radians to meters)
+EARTH_RADIUS_METERS = 6371008.8
+
+# Columns of a POI snapshot file: one row per school or restaurant with its coordinates and Google Maps rating
+SNAPSHOT_COLUMNS = ["type", "name", "latitude", "longitude", "rating"]
+
+
+# Create function to load a POI snapshot from a csv file
+def load_snapshot(path):
+    snapshot = pd.read_csv(path, usecols=SNAPSHOT_COLUMNS)
+    # Drop POIs without coordinates since they cannot be indexed
+    return snapshot.dropna(subset=["latitude", "longitude"]).reset_index(drop=True)
+
+
+# Create function to save a POI snapshot (e.g. collected from Google Maps Places results) as a csv file
+def save_snapshot(snapshot, path):
+    snapshot[SNAPSHOT_COLUMNS].to_csv(path, index=False)
+
+
+# Create function to convert latitude and longitude in degrees to a 2D array of radians as expected by the BallTree
+def to_radians(latitudes, longitudes):
+    return np.radians(np.column_stack([np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)]))
+
+
+# Create a class for in-memory nearest-school and restaurant-rating lookups that replace Places Nearby Search calls
+class POIIndex:
+    def __init__(self, snapshot):
+        # Import scikit-learn only when a POI snapshot is used
+        from sklearn.neighbors import BallTree
+
+        schools = snapshot[snapshot["type"] == "school"]
+        restaurants = snapshot[snapshot["type"] == "restaurant"]
+
+        # Store school coordinates and restaurant ratings aligned with the rows of their BallTree
+        self.school_coordinates = schools[["latitude", "longitude"]].to_numpy(dtype=float)
+        self.restaurant_ratings = restaurants["rating"].to_numpy(dtype=float)
+
+        # Build BallTrees with the haversine metric so distances are great-circle distances on the earth surface
+        # (a BallTree needs at least one point, so a snapshot without schools or restaurants has no tree for them)
+        self.school_tree = (BallTree(to_radians(schools["latitude"], schools["longitude"]), metric="haversine")
+                            if len(schools) > 0 else None)
+        self.restaurant_tree = (BallTree(to_radians(restaurants["latitude"], restaurants["longitude"]),
+                                         metric="haversine") if len(restaurants) > 0 else None)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        return cls(load_snapshot(path))
+
+    def nearest_school(self, latitudes, longitudes, radius=1000):
+        # Vectorized lookup of the closest school within the radius (in meters) for each property
+        # Returns arrays of school latitude, school longitude and meters to school (missing values if none is found)
+        points = to_radians(latitudes, longitudes)
+        school_latitudes = np.full(len(points), np.nan)
+        school_longitudes = np.full(len(points), np.nan)
+        meters_to_school = np.full(len(points), np.nan)
+
+        # Only query properties with valid coordinates
+        valid = ~np.isnan(points).any(axis=1)
+        if not valid.any() or self.school_tree is None:
+            return school_latitudes, school_longitudes, meters_to_school
+        distances, indices = self.school_tree.query(points[valid], k=1)
+        distances = distances[:, 0] * EARTH_RADIUS_METERS
+        indices = indices[:, 0]
+
+        # Assign missing values if the closest school is farther away than the radius, like Places Nearby Search
+        within_radius = distances <= radius
+        valid_positions = np.flatnonzero(valid)[within_radius]
+        school_latitudes[valid_positions] = self.school_coordinates[indices[within_radius], 0]
+        school_longitudes[valid_positions] = self.school_coordinates[indices[within_radius], 1]
+        meters_to_school[valid_positions] = np.round(distances[within_radius])
+        return school_latitudes, school_longitudes, meters_to_school
+
+    def restaurants_rating(self, latitudes, longitudes, radius=1000):
+        # Vectorized average rating of restaurants within the radius (in meters) for each property
+        # Returns an array of average ratings (missing value if no rated restaurant is found)
+        points = to_radians(latitudes, longitudes)
+        average_ratings = np.full(len(points), np.nan)
+
+        # Only query properties with valid coordinates
+        valid = ~np.isnan(points).any(axis=1)
+        if not valid.any() or self.restaurant_tree is None:
+            return average_ratings
+        neighbors = self.restaurant_tree.query_radius(points[valid], r=radius / EARTH_RADIUS_METERS)
+
+        # Calculate average ratings, ignoring restaurants without a rating
+        for position, indices in zip(np.flatnonzero(valid), neighbors):
+            ratings = self.restaurant_ratings[indices]
+            ratings = ratings[~np.isnan(ratings)]
+            if len(ratings) > 0:
+                average_ratings[position] = ratings.mean()
+        return average_ratings
+
@@ -0,0 +1,113 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+# Id of the request that is currently being handled (None outside of requests)
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# Deadline of the request that is currently being handled as a time.monotonic() value (None without a deadline)
+deadline_var = contextvars.ContextVar("deadline", default=None)
+
+# Attributes of every log record, so the formatter can tell which attributes were passed as extra fields
+STANDARD_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "request_id"}
+
+
+# Create function to set the id of the current request (a new id unless the client sent one)
+def set_request_id(request_id=None):
+    return request_id_var.set(request_id or uuid.uuid4().hex)
+
+
+# Create function to set the deadline of the current request to a number of seconds from now (None for no deadline)
+def set_deadline(seconds=None):
+    return deadline_var.set(None if seconds is None else time.monotonic() + seconds)
+
+
+# Create function to get the number of seconds left until the deadline of the current request (None without a deadline)
+def remaining_time():
+    deadline = deadline_var.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+# Create function to submit a function to a thread pool with the context of the caller, so the worker thread keeps the
+# deadline of the request that submitted it and its logs carry the request id
+def submit_with_context(executor, function, *args, **kwargs):
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+# Create a logging filter that adds the id of the current request to each log record
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+# Create a logging formatter that writes one JSON object per log record, including extra fields
+# (e.g. logger.info("Request completed", extra={"status": 200}))
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None)
+        }
+        entry.update({key: value for key, value in record.__dict__.items() if key not in STANDARD_RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Create function to configure the root logger (JSON logs for the app, plain text logs for command line tools)
+def configure_logging(level=None, structured=True):
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(JsonFormatter() if structured else logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+    root_logger = logging.getLogger()
+    root_logger.handlers = [handler]
+    root_logger.setLevel(level or os.getenv("log_level", "INFO").upper())
+
+
+# Create a class for a sampling profiler that records the call stacks of one thread (e.g. the thread handling a
+# request) at a fixed interval and counts how often each stack was seen
+# Only the sampled thread is profiled, so time spent in thread pools shows up as waiting for their results
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=0.001):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.n_samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profiler")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.n_samples += 1
+
+    def top_stacks(self, n=20):
+        # Most frequent stacks in the collapsed format of flame graph tools ("caller;callee count")
+        return [f"{stack} {count}" for stack, count in self.stacks.most_common(n)]
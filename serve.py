@@ -0,0 +1,227 @@
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+
+# Create a request handler for the workers
+class WorkerRequestHandler(WSGIRequestHandler):
+    # Close idle keep-alive connections after 5 seconds, so stopping workers do not wait for idle clients
+    timeout = 5
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        # Close keep-alive connections once the worker is shutting down
+        if self.server.shutting_down:
+            self.close_connection = True
+
+    def log_request(self, code="-", size="-"):
+        # Access logs for every request are costly under load, so they are optional
+        if self.server.access_log:
+            super().log_request(code, size)
+
+    def log_error(self, format, *args):
+        # Closing idle keep-alive connections is expected, so do not log it as an error
+        if not format.startswith("Request timed out"):
+            super().log_error(format, *args)
+
+
+# Create a class for the threaded WSGI server of a worker that waits for in-flight requests when shutting down
+class WorkerServer(ThreadedWSGIServer):
+    daemon_threads = False
+    block_on_close = True
+    shutting_down = False
+    access_log = False
+
+
+# Create function to run a worker process that serves requests on the shared listening socket
+def run_worker(app, listening_socket, max_requests, access_log):
+    server = WorkerServer(*listening_socket.getsockname()[:2], app, handler=WorkerRequestHandler,
+                          fd=listening_socket.fileno())
+    server.access_log = access_log
+    n_requests = 0
+    lock = threading.Lock()
+
+    # Stop accepting new requests (server.shutdown blocks until serve_forever returns, so call it from a thread)
+    def shutdown(*args):
+        server.shutting_down = True
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    # Count requests and recycle the worker after max_requests to bound memory growth
+    def counting_app(environ, start_response):
+        nonlocal n_requests
+        with lock:
+            n_requests += 1
+            if max_requests and n_requests == max_requests:
+                shutdown()
+        return app(environ, start_response)
+
+    server.app = counting_app
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    server.serve_forever()
+    # Wait for in-flight requests to finish before exiting
+    server.server_close()
+
+
+# Create a class for the master process that preloads the application and manages the forked workers
+class PreforkServer:
+    def __init__(self, app, host, port, workers, max_requests=0, max_requests_jitter=0, graceful_timeout=30,
+                 access_log=False):
+        self.app = app
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.access_log = access_log
+        self.worker_pids = set()
+        self.stopping = False
+        self.recycle_requested = False
+
+        # Create the listening socket in the master, so all workers accept connections from the same socket
+        self.listening_socket = socket.create_server((host, port), backlog=2048)
+        self.listening_socket.set_inheritable(True)
+
+    def spawn_worker(self):
+        # Add jitter to max_requests, so workers do not all recycle at the same time
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                random.seed()
+                run_worker(self.app, self.listening_socket, max_requests, self.access_log)
+            except BaseException as error:
+                print(f"Worker {os.getpid()} failed: {error!r}", file=sys.stderr)
+                exit_code = 1
+            finally:
+                # Save the final metrics of the worker, so the master can fold them into the metrics of exited workers
+                try:
+                    from metrics import registry as metrics_registry
+                    metrics_registry.save()
+                except Exception as error:
+                    print(f"Worker {os.getpid()} could not save its metrics: {error!r}", file=sys.stderr)
+                # Exit without running the master's cleanup handlers
+                os._exit(exit_code)
+        self.worker_pids.add(pid)
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def recycle(self, *args):
+        self.recycle_requested = True
+
+    def run(self):
+        # Move all objects created so far (application, model bundle, encoder) to the permanent generation, so the
+        # garbage collector in the workers does not touch them and their memory pages stay shared copy-on-write
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.recycle)
+
+        host, port = self.listening_socket.getsockname()[:2]
+        print(f"Serving on http://{host}:{port} with {self.workers} workers (master pid {os.getpid()})")
+        for _ in range(self.workers):
+            self.spawn_worker()
+
+        # Replace workers that exit (recycled or crashed) until the master is stopped
+        while not self.stopping:
+            if self.recycle_requested:
+                # Gracefully restart all workers; replacements are spawned as the old workers exit
+                self.recycle_requested = False
+                for pid in list(self.worker_pids):
+                    self.signal_worker(pid, signal.SIGTERM)
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            if pid in self.worker_pids:
+                self.worker_pids.remove(pid)
+                self.fold_metrics(pid)
+                if not self.stopping:
+                    self.spawn_worker()
+
+        self.shutdown_workers()
+
+    def signal_worker(self, pid, signal_number):
+        try:
+            os.kill(pid, signal_number)
+        except ProcessLookupError:
+            self.worker_pids.discard(pid)
+
+    def fold_metrics(self, pid):
+        # Fold the metrics of a reaped worker into the metrics of all exited workers (before a new worker can reuse
+        # its PID)
+        from metrics import registry as metrics_registry
+        try:
+            metrics_registry.fold(pid)
+        except OSError as error:
+            print(f"Could not fold the metrics of worker {pid}: {error!r}", file=sys.stderr)
+
+    def shutdown_workers(self):
+        # Ask the workers to finish their in-flight requests, then kill the ones that exceed the graceful timeout
+        for pid in list(self.worker_pids):
+            self.signal_worker(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.worker_pids and time.monotonic() < deadline:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.1)
+            else:
+                self.worker_pids.discard(pid)
+                self.fold_metrics(pid)
+        for pid in list(self.worker_pids):
+            self.signal_worker(pid, signal.SIGKILL)
+        self.listening_socket.close()
+
+
+# Start the production server
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the rental price prediction app with preforked workers.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+                        help="Number of worker processes (default: number of cores).")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("MAX_REQUESTS", "10000")),
+                        help="Recycle a worker after this many requests (0 to disable).")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.getenv("MAX_REQUESTS_JITTER", "1000")))
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="Seconds to wait for in-flight requests when stopping workers.")
+    parser.add_argument("--access-log", action="store_true", help="Log every request.")
+    args = parser.parse_args()
+
+    # Share the cores between the workers for multi-threaded XGBoost batch predictions
+    os.environ.setdefault("xgboost_batch_threads", str(max(1, (os.cpu_count() or 1) // args.workers)))
+
+    # Let the workers save their metrics to a shared directory, so /metrics reports the sum over all workers
+    # (metrics of earlier server runs are removed, since counters start from zero after a restart)
+    metrics_dir = os.environ.setdefault("metrics_dir", tempfile.mkdtemp(prefix="metrics_"))
+    os.makedirs(metrics_dir, exist_ok=True)
+    for file_name in os.listdir(metrics_dir):
+        if file_name.endswith(".json"):
+            os.remove(os.path.join(metrics_dir, file_name))
+
+    # Load the application and the model bundle once in the master, so the workers share them copy-on-write
+    from model_deployment import app, model_registry
+    model_registry.get().inference_engine.load_boosters()
+
+    PreforkServer(app, args.host, args.port, args.workers, max_requests=args.max_requests,
+                  max_requests_jitter=args.max_requests_jitter, graceful_timeout=args.graceful_timeout,
+                  access_log=args.access_log).run()
@@ -0,0 +1,69 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import pandas as pd
+from maps_stub_server import start_stub_server
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Small fixture of scraped listings (every sixth listing has no address, so its address is looked up by name)
+LISTINGS_PATH = os.path.join(REPOSITORY_DIR, "fixtures", "enrichment_listings.csv")
+
+# Number of concurrent API calls of the pipeline (calls in flight when the run is killed may be paid but not
+# checkpointed, so they can be repeated once by the resumed run)
+WORKERS = 2
+
+
+# Create function to start the enrichment pipeline against the stub in a subprocess
+# Each run gets its own location cache, so only the checkpoints can save the resumed run from repeating paid calls
+def start_pipeline(stub, directory, run):
+    environment = dict(os.environ, google_maps_base_url=stub.base_url,
+                       location_cache_path=os.path.join(directory, f"location_cache_{run}.sqlite"))
+    return subprocess.Popen([sys.executable, "enrichment_pipeline.py", "--input", LISTINGS_PATH,
+                             "--output", os.path.join(directory, "enriched.csv"),
+                             "--checkpoint-dir", os.path.join(directory, "checkpoints"),
+                             "--workers", str(WORKERS), "--rate", "0"],
+                            cwd=REPOSITORY_DIR, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+# Create function to count the lines of a checkpoint file (0 if it does not exist yet)
+def count_lines(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as file:
+        return sum(1 for _ in file)
+
+
+def test_resumed_pipeline_makes_no_new_paid_calls(tmp_path):
+    stub = start_stub_server(latency=0.02)
+    try:
+        # Kill the first run in the middle of the geocoding stage
+        process = start_pipeline(stub, tmp_path, 1)
+        geocode_checkpoint = os.path.join(tmp_path, "checkpoints", "geocode.jsonl")
+        deadline = time.monotonic() + 60
+        while count_lines(geocode_checkpoint) < 5 and process.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert process.poll() is None, "The pipeline finished before it could be killed"
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+        assert not os.path.exists(os.path.join(tmp_path, "enriched.csv"))
+        geocoded_before_kill = count_lines(geocode_checkpoint)
+
+        # Resume the run, which fetches only what is missing from the checkpoints
+        assert start_pipeline(stub, tmp_path, 2).wait(timeout=120) == 0
+        counts_after_resume = dict(stub.request_counts)
+        listings = pd.read_csv(LISTINGS_PATH)
+        enriched = pd.read_csv(os.path.join(tmp_path, "enriched.csv"))
+        assert len(enriched) == len(listings)
+        assert enriched["latitude"].notna().sum() > 0
+        # Each listing is geocoded at most once (plus the calls in flight when the first run was killed)
+        assert counts_after_resume["/geocode/json"] <= len(listings) + WORKERS
+        assert count_lines(geocode_checkpoint) > geocoded_before_kill
+
+        # Rerun the finished run: every result comes from the checkpoints, so the stub receives no request
+        assert start_pipeline(stub, tmp_path, 3).wait(timeout=120) == 0
+        assert dict(stub.request_counts) == counts_after_resume
+    finally:
+        stub.shutdown()
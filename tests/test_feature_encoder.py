@@ -0,0 +1,78 @@
+import json
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from feature_encoder import FeatureEncoder
+from feature_preparation import FEATURE_COLUMNS
+from keyword_features import KEYWORDS
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Load the pickled column transformer (requires scikit-learn) and the encoder created from it
+@pytest.fixture(scope="module")
+def column_transformer():
+    pytest.importorskip("sklearn")
+    with open(os.path.join(REPOSITORY_DIR, "models", "column_transformer.pkl"), "rb") as file:
+        return pickle.load(file)
+
+
+# Create random rows covering all known categories, including missing location-based features
+@pytest.fixture(scope="module")
+def data(column_transformer):
+    categories = FeatureEncoder.from_column_transformer(column_transformer).categories
+    rng = np.random.default_rng(42)
+    n_rows = 1000
+    data = pd.DataFrame({
+        "size": rng.integers(100, 5000, n_rows),
+        "bedrooms": rng.choice(categories["bedrooms"], n_rows),
+        "bathrooms": rng.integers(1, 8, n_rows),
+        "latitude": rng.uniform(1.25, 1.45, n_rows),
+        "longitude": rng.uniform(103.6, 104.0, n_rows),
+        "meters_to_cbd": rng.integers(0, 25000, n_rows),
+        "meters_to_school": rng.integers(0, 9689, n_rows),
+        "restaurants_rating": np.where(rng.random(n_rows) < 0.1, np.nan, rng.uniform(3, 5, n_rows)),
+        "property_type": rng.choice(categories["property_type"], n_rows),
+        "furnishing": rng.choice(categories["furnishing"], n_rows),
+        "year": rng.integers(1970, 2025, n_rows),
+        "meters_to_mrt": rng.integers(0, 3000, n_rows)
+    })
+    for feature in KEYWORDS:
+        data[feature] = rng.random(n_rows) < 0.3
+    return data[FEATURE_COLUMNS]
+
+
+def test_transform_rows_matches_column_transformer(column_transformer, data):
+    encoder = FeatureEncoder.from_column_transformer(column_transformer)
+    expected = column_transformer.transform(data)
+    rows = list(data.itertuples(index=False, name=None))
+    np.testing.assert_allclose(encoder.transform_rows(rows), expected, rtol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(encoder.transform_rows(data.to_records(index=False)), expected, rtol=1e-12,
+                               equal_nan=True)
+
+
+def test_transform_row_matches_column_transformer(column_transformer, data):
+    encoder = FeatureEncoder.from_column_transformer(column_transformer)
+    expected = column_transformer.transform(data)
+    rows = list(data.itertuples(index=False, name=None))
+    for index in range(0, len(rows), 50):
+        np.testing.assert_allclose(encoder.transform_row(rows[index]), expected[index:index + 1], rtol=1e-12,
+                                   equal_nan=True)
+
+
+def test_spec_round_trip_matches_column_transformer(column_transformer, data):
+    # The bundle stores the encoder as its spec, so an encoder loaded from the spec must give the same output
+    spec = FeatureEncoder.from_column_transformer(column_transformer).to_spec()
+    encoder = FeatureEncoder.from_spec(json.loads(json.dumps(spec)))
+    np.testing.assert_allclose(encoder.transform_rows(data.to_records(index=False)),
+                               column_transformer.transform(data), rtol=1e-12, equal_nan=True)
+
+
+def test_unknown_category_is_rejected(column_transformer, data):
+    encoder = FeatureEncoder.from_column_transformer(column_transformer)
+    row = list(next(data.itertuples(index=False, name=None)))
+    row[FEATURE_COLUMNS.index("property_type")] = "Castle"
+    with pytest.raises(ValueError):
+        encoder.transform_row(tuple(row))
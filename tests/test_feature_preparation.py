@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+from feature_preparation import (BEDROOM_CHOICES, FURNISHING_CHOICES, PROPERTY_TYPE_CHOICES, check_model_categories,
+                                 validate_listing, validate_listings)
+
+# Categories of a model that supports every form choice
+CATEGORIES = {"bedrooms": BEDROOM_CHOICES, "property_type": PROPERTY_TYPE_CHOICES, "furnishing": FURNISHING_CHOICES}
+
+VALID_LISTING = {"size": 800, "bedrooms": "2", "bathrooms": None, "address": "1 Raffles Place",
+                 "property_type": "Condominium", "furnishing": "", "year": None, "meters_to_mrt": None}
+
+
+@pytest.mark.parametrize("changes, error", [
+    ({}, None),
+    ({"size": 0}, "Field size must be positive."),
+    ({"size": -800}, "Field size must be positive."),
+    ({"size": None}, "Missing required field: size."),
+    ({"address": ""}, "Missing required field: address."),
+    ({"address": "  \t"}, "Missing required field: address."),
+    ({"bedrooms": "12"}, f"Field bedrooms must be one of {BEDROOM_CHOICES}."),
+    ({"year": 1999.5}, "Field year must be an integer.")
+])
+def test_single_and_vectorized_validation_agree(changes, error):
+    listing = {**VALID_LISTING, **changes}
+    assert (validate_listing(listing) or check_model_categories(listing, CATEGORIES)) == error
+    # validate_listings marks valid listings with a missing value
+    vectorized_error = validate_listings(pd.DataFrame([listing]), CATEGORIES)[0]
+    assert (None if pd.isna(vectorized_error) else vectorized_error) == error
@@ -0,0 +1,65 @@
+import os
+import pickle
+import numpy as np
+import pytest
+from inference_engine import InferenceEngine, TreeEvaluator
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Load the pickled XGBoost model (requires XGBoost and scikit-learn)
+@pytest.fixture(scope="module")
+def model():
+    pytest.importorskip("xgboost")
+    pytest.importorskip("sklearn")
+    with open(os.path.join(REPOSITORY_DIR, "models", "xgboost.pkl"), "rb") as file:
+        return pickle.load(file)
+
+
+# Create random encoded features with some missing values
+@pytest.fixture(scope="module")
+def features(model):
+    rng = np.random.default_rng(42)
+    features = rng.normal(size=(10000, model.get_booster().num_features()))
+    features[rng.random(features.shape) < 0.02] = np.nan
+    return features
+
+
+def test_booster_predictions_match_scikit_learn_wrapper(model, features):
+    engine = InferenceEngine.from_booster(model.get_booster())
+    expected = model.predict(features)
+    # Large batches use the multi-threaded booster, small ones and single rows the single-threaded booster
+    np.testing.assert_allclose(engine.predict(features), expected, rtol=1e-5)
+    np.testing.assert_allclose(engine.predict(features[:100]), expected[:100], rtol=1e-5)
+    for index in range(100):
+        np.testing.assert_allclose(engine.predict(features[index:index + 1]), expected[index:index + 1], rtol=1e-5)
+
+
+def test_tree_evaluator_matches_booster(model, features):
+    evaluator = TreeEvaluator.from_booster(model.get_booster())
+    expected = model.get_booster().inplace_predict(features[:200].astype(np.float32), missing=np.nan)
+    predictions = [evaluator.predict_row(row) for row in features[:200]]
+    np.testing.assert_allclose(predictions, expected, rtol=1e-4)
+
+
+def test_single_rows_use_tree_evaluator_if_enabled(model, features):
+    engine = InferenceEngine.from_booster(model.get_booster(), use_tree_evaluator=True)
+    expected = model.predict(features[:100])
+    for index in range(100):
+        np.testing.assert_allclose(engine.predict(features[index:index + 1]), expected[index:index + 1], rtol=1e-4)
+    # The booster is only loaded for batches
+    assert engine.batch_booster is None
+
+
+def test_bundle_tree_evaluator_matches_bundle_booster(monkeypatch, features):
+    # The flattened trees of the active bundle are memory-mapped from its .npy files
+    import model_bundle
+
+    monkeypatch.setattr(model_bundle, "use_tree_evaluator", True)
+    bundles_dir = os.path.join(REPOSITORY_DIR, "models", "bundles")
+    engine = model_bundle.ModelBundle.load(
+        os.path.join(bundles_dir, model_bundle.current_version(bundles_dir))).inference_engine
+    engine.load_boosters()
+    expected = engine.single_thread_booster.inplace_predict(features[:100].astype(np.float32), missing=np.nan)
+    predictions = [engine.tree_evaluator.predict_row(row) for row in features[:100]]
+    np.testing.assert_allclose(predictions, expected, rtol=1e-4)
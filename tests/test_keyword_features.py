@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+import keyword_features
+from keyword_features import KEYWORD_FEATURES, KEYWORDS, extract_keyword_features, extract_keyword_flags
+
+
+# Create function to extract the keyword features with a separate substring scan per keyword (reference)
+def separate_scans(agent_description):
+    agent_description = agent_description.lower() if isinstance(agent_description, str) else ""
+    return tuple(any(keyword in agent_description for keyword in keywords) for keywords in KEYWORDS.values())
+
+
+# Create random descriptions from the keywords and filler words, plus empty and missing descriptions
+@pytest.fixture(scope="module")
+def descriptions():
+    rng = np.random.default_rng(42)
+    words = ["spacious", "unit", "near", "mrt", "Floor", "High", "VIEW", "new", "Brand", "renovat", "sea", "city",
+             "penthouse", "view", "quiet", "pool", "with", "amenities", "call", "now", "for", "viewing"]
+    words += [phrase for phrases in KEYWORDS.values() for phrase in phrases]
+    return [" ".join(rng.choice(words, size=rng.integers(0, 200))) for _ in range(2000)] + ["", None, np.nan]
+
+
+# Run each test with both the separate scans per phrase and the single scan with the compiled matcher, since only one of
+# them is used for the current phrase list
+@pytest.fixture(autouse=True, params=[False, True], ids=["separate_scans", "single_scan"])
+def use_single_scan(request, monkeypatch):
+    monkeypatch.setattr(keyword_features, "use_single_scan", request.param)
+
+
+def test_keyword_flags_match_separate_scans(descriptions):
+    assert [extract_keyword_flags(description) for description in descriptions] == [
+        separate_scans(description) for description in descriptions]
+
+
+def test_keyword_features_match_separate_scans(descriptions):
+    expected = pd.DataFrame([separate_scans(description) for description in descriptions], columns=KEYWORD_FEATURES)
+    pd.testing.assert_frame_equal(extract_keyword_features(descriptions), expected)
+
+
+@pytest.mark.parametrize("description", ["High floorenovated", "PENTHOUSEA VIEW", "renovationew unit"])
+def test_overlapping_phrases_of_different_features_are_all_found(description):
+    assert extract_keyword_flags(description) == separate_scans(description)
@@ -0,0 +1,86 @@
+import json
+import pandas as pd
+import pytest
+import requests
+import http_utils
+import location_features
+from http_utils import CircuitBreaker
+from location_cache import LocationCache
+from maps_stub_server import geocode, haversine_meters, start_stub_server
+from metrics import registry
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # Retry without waiting and start every test with closed circuit breakers
+    monkeypatch.setattr(http_utils, "retry_delay", lambda attempt, backoff, response=None: 0)
+    monkeypatch.setattr(location_features, "maps_circuit_breakers",
+                        {api: CircuitBreaker(api) for api in location_features.MAPS_API_COSTS})
+    stub = start_stub_server()
+    yield stub
+    stub.shutdown()
+
+
+# Create function to get the value of a metric of the geocoding API
+def geocode_metric(name):
+    return registry.values[name].get(("geocode",), 0)
+
+
+def test_every_attempt_counts_as_a_paid_request(stub, monkeypatch):
+    monkeypatch.setattr(location_features, "maps_max_retries", 2)
+    stub.failure_rate = 1.0
+    requests_before = geocode_metric("google_maps_api_requests_total")
+    spend_before = geocode_metric("google_maps_api_spend_dollars_total")
+    with pytest.raises(requests.HTTPError):
+        location_features.maps_get(stub.base_url + "/geocode/json", {"address": "1 Test Road"})
+    assert stub.request_counts["/geocode/json"] == 3
+    assert geocode_metric("google_maps_api_requests_total") - requests_before == 3
+    assert geocode_metric("google_maps_api_spend_dollars_total") - spend_before == pytest.approx(
+        3 * location_features.MAPS_API_COSTS["geocode"])
+
+
+# Create a session that answers every request with the same response
+class StaticSession:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+
+    def get(self, url, **kwargs):
+        response = requests.Response()
+        response.status_code = self.status_code
+        response._content = json.dumps(self.data).encode()
+        return response
+
+
+@pytest.mark.parametrize("status_code", [429, 200], ids=["http_429", "over_query_limit"])
+def test_over_query_limit_counts_as_breaker_failure(stub, monkeypatch, status_code):
+    monkeypatch.setattr(location_features, "maps_max_retries", 0)
+    monkeypatch.setattr(location_features, "session", StaticSession(status_code, {"status": "OVER_QUERY_LIMIT"}))
+    with pytest.raises(requests.HTTPError):
+        location_features.maps_get(stub.base_url + "/geocode/json", {"address": "1 Test Road"})
+    assert location_features.maps_circuit_breakers["geocode"].n_failures == 1
+
+
+def test_poi_index_keeps_distance_matrix_meters_to_school(stub, monkeypatch, tmp_path):
+    pytest.importorskip("sklearn")
+    from poi_index import POIIndex
+
+    # Put a school about 500 m north and a restaurant next to the location the stub geocodes the address to
+    location = geocode({"address": "1 Test Road, Singapore"})["results"][0]["geometry"]["location"]
+    latitude, longitude = location["lat"], location["lng"]
+    snapshot = pd.DataFrame({"type": ["school", "restaurant"], "name": ["School", "Restaurant"],
+                             "latitude": [latitude + 0.0045, latitude], "longitude": [longitude, longitude + 0.001],
+                             "rating": [None, 4.5]})
+    monkeypatch.setattr(location_features, "poi_index", POIIndex(snapshot))
+    monkeypatch.setattr(location_features, "google_maps_base_url", stub.base_url)
+    monkeypatch.setattr(location_features, "location_cache", LocationCache(path=str(tmp_path / "cache.sqlite")))
+
+    features = location_features.get_location_features("1 Test Road")
+    # The school is chosen by the index, but its distance is the road distance of the Distance Matrix API (which the
+    # stub returns as 1.3 times the straight-line distance), like the training data
+    assert (features["school_latitude"], features["school_longitude"]) == (latitude + 0.0045, longitude)
+    assert features["meters_to_school"] == round(1.3 * haversine_meters(latitude, longitude, latitude + 0.0045,
+                                                                        longitude))
+    assert features["restaurants_rating"] == 4.5
+    assert not features["degraded"]
+    assert dict(stub.request_counts) == {"/geocode/json": 1, "/distancematrix/json": 2}
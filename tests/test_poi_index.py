@@ -0,0 +1,37 @@
+import os
+import numpy as np
+import pytest
+from poi_index import POIIndex, load_snapshot
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Raffles Place (closest school 647 m away, two rated and one unrated restaurant within 1 km), a property in Kallang
+# (no school within 1 km, one rated restaurant 111 m away) and a property without coordinates
+LATITUDES = [1.284184, 1.3, np.nan]
+LONGITUDES = [103.85151, 103.879, np.nan]
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    pytest.importorskip("sklearn")
+    return load_snapshot(os.path.join(REPOSITORY_DIR, "fixtures", "poi_snapshot.csv"))
+
+
+def test_nearest_school_matches_known_distances(snapshot):
+    school_latitudes, school_longitudes, meters_to_school = POIIndex(snapshot).nearest_school(LATITUDES, LONGITUDES)
+    np.testing.assert_allclose(school_latitudes, [1.29, np.nan, np.nan])
+    np.testing.assert_allclose(school_longitudes, [103.8515, np.nan, np.nan])
+    np.testing.assert_allclose(meters_to_school, [647, np.nan, np.nan])
+
+
+def test_restaurants_rating_matches_known_ratings(snapshot):
+    np.testing.assert_allclose(POIIndex(snapshot).restaurants_rating(LATITUDES, LONGITUDES), [4.25, 3.0, np.nan])
+
+
+def test_snapshot_with_one_type_has_missing_values_for_the_other(snapshot):
+    schools_only = POIIndex(snapshot[snapshot["type"] == "school"])
+    restaurants_only = POIIndex(snapshot[snapshot["type"] == "restaurant"])
+    assert np.isnan(schools_only.restaurants_rating(LATITUDES, LONGITUDES)).all()
+    assert np.isnan(restaurants_only.nearest_school(LATITUDES, LONGITUDES)[2]).all()
+    np.testing.assert_allclose(schools_only.nearest_school(LATITUDES, LONGITUDES)[2], [647, np.nan, np.nan])
+    np.testing.assert_allclose(restaurants_only.restaurants_rating(LATITUDES, LONGITUDES), [4.25, 3.0, np.nan])